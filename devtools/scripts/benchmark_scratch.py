@@ -0,0 +1,115 @@
+"""
+Benchmarks the scratch backends used for the intermediate files of vina runs.
+
+By default every run writes the test receptor and ligand, runs a child process
+that reads the inputs and writes an output file (a stand-in for vina isolating
+the I/O cost), and reads the output back. With --vina, each run docks the test
+ligand with AutoDockComputeComponent instead.
+
+    python devtools/scripts/benchmark_scratch.py -n 200 --backends tmp shm memfd
+"""
+
+from mmic_autodock_vina.util.scratch import SCRATCH_BACKENDS, ScratchDir
+import argparse
+import functools
+import os
+import statistics
+import subprocess
+import time
+
+data_dir = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "..",
+    "mmic_autodock_vina",
+    "data",
+    "autodock_test",
+    "input",
+)
+
+
+def io_run(backend, receptor, ligand):
+    with ScratchDir(backend) as scratch:
+        receptor_path = scratch.write("receptor.pdbqt", receptor)
+        ligand_path = scratch.write("ligand.pdbqt", ligand)
+        out = scratch.name("out.pdbqt")
+        with open(out, "w") as fp:
+            subprocess.run(["cat", receptor_path, ligand_path], stdout=fp, check=True)
+        with open(out) as fp:
+            fp.read()
+
+
+def vina_run(backend, receptor, ligand, proc_input, box):
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+    from mmic_autodock_vina.models import AutoDockComputeInput
+
+    compute_input = AutoDockComputeInput(
+        proc_input=proc_input,
+        receptor=receptor,
+        ligand=ligand,
+        exhaustiveness=1,
+        seed=1,
+        **box,
+    )
+    AutoDockComputeComponent.compute(compute_input, extras={"scratch_backend": backend})
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "-n", "--nruns", type=int, default=100, help="Runs per backend."
+    )
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=list(SCRATCH_BACKENDS),
+        help="Scratch backends or parent directories to compare.",
+    )
+    parser.add_argument(
+        "--vina", action="store_true", help="Dock with vina instead of a stand-in."
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with open(os.path.join(data_dir, "receptor_rigid.pdbqt")) as fp:
+        receptor = fp.read()
+    with open(os.path.join(data_dir, "ligand.pdbqt")) as fp:
+        ligand = fp.read()
+
+    run = io_run
+    if args.vina:
+        from mmic_docking.models import InputDock
+        from mmelemental.models import Molecule
+
+        structs = os.path.join(data_dir, "..", "structs")
+        proc_input = InputDock(
+            schema_name="mmschema",
+            schema_version=1,
+            molecule={
+                "ligand": Molecule.from_file(os.path.join(structs, "ligand.pdb")),
+                "receptor": Molecule.from_file(os.path.join(structs, "receptor.pdb")),
+            },
+        )
+        # search box of data/autodock_test/run.sh
+        box = dict(
+            center_x=11.0, center_y=90.5, center_z=57.5,
+            size_x=22.0, size_y=24.0, size_z=28.0,
+        )  # fmt: skip
+        run = functools.partial(vina_run, proc_input=proc_input, box=box)
+
+    print(f"{'backend':>16} {'mean (ms)':>10} {'median (ms)':>12} {'stdev (ms)':>11}")
+    for backend in args.backends:
+        timings = []
+        for _ in range(args.nruns):
+            start = time.perf_counter()
+            run(backend, receptor, ligand)
+            timings.append(1000 * (time.perf_counter() - start))
+        print(
+            f"{backend:>16} {statistics.mean(timings):10.2f} "
+            f"{statistics.median(timings):12.2f} {statistics.pstdev(timings):11.2f}"
+        )
@@ -1,4 +1,10 @@
 from . import autodock_component
 from .autodock_component import *
+from . import autodock_screen_component
+from .autodock_screen_component import *
+from . import autodock_campaign_component
+from .autodock_campaign_component import *
+from . import autodock_funnel_component
+from .autodock_funnel_component import *
 
 RunComponent = autodock_component.AutoDockComponent
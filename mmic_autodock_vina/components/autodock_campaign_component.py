@@ -0,0 +1,134 @@
+# Import models
+from mmelemental.models import Molecule
+from mmic_autodock_vina.models import AutoDockCampaignInput, AutoDockCampaignOutput
+
+# Import components
+from mmic.components.blueprints import GenericComponent
+from mmic_autodock_vina.components.autodock_screen_component import (
+    AutoDockScreenComponent,
+    ScreenResult,
+)
+from mmic_autodock_vina.util.cache import hash_molecule, hash_text
+from mmic_autodock_vina.util.journal import Journal
+from cmselemental.util.decorators import classproperty
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+import time
+
+__all__ = ["AutoDockCampaignComponent"]
+
+
+class AutoDockCampaignComponent(GenericComponent):
+    """
+    Resumable screening campaign: docks the ligands with the screening pipeline and
+    appends the status and result of each ligand to a journal as it completes. On
+    restart, ligands already completed in the journal are skipped. Failed ligands
+    are retried in rounds with exponential backoff.
+    """
+
+    @classproperty
+    def input(cls):
+        return AutoDockCampaignInput
+
+    @classproperty
+    def output(cls):
+        return AutoDockCampaignOutput
+
+    @classproperty
+    def version(cls):
+        return ""
+
+    def execute(
+        self,
+        inputs: AutoDockCampaignInput,
+        extra_outfiles: Optional[List[str]] = None,
+        extra_commands: Optional[List[str]] = None,
+        scratch_name: Optional[str] = None,
+        timeout: Optional[int] = None,
+        config: Optional["TaskConfig"] = None,
+    ) -> Tuple[bool, AutoDockCampaignOutput]:
+
+        if isinstance(inputs, dict):
+            inputs = self.input(**inputs)
+
+        keys = [self.ligand_key(ligand) for ligand in inputs.ligands]
+        settings = inputs.copy(update={"ligands": [], "lazy": True})
+
+        with Journal(inputs.journal) as journal:
+            records = {
+                index: record
+                for index, record in journal.load().items()
+                if index < len(keys) and record.get("key") == keys[index]
+            }
+
+            for retry in range(inputs.max_retries + 1):
+                todo = [
+                    index
+                    for index in range(len(keys))
+                    if records.get(index, {}).get("status") != "done"
+                    and records.get(index, {}).get("attempt", -1) < retry
+                ]
+                if not todo:
+                    break
+                if retry and inputs.backoff:
+                    time.sleep(inputs.backoff * 2 ** (retry - 1))
+
+                results = AutoDockScreenComponent.stream(
+                    settings,
+                    ligands=(inputs.ligands[index] for index in todo),
+                    extras=self.extras,
+                )
+                for result in results:
+                    index = todo[result.index]
+                    record = self.build_record(result, keys[index], index, retry)
+                    journal.append(record)
+                    records[index] = record
+
+        return True, self.parse_output(records, inputs)
+
+    # helper functions
+    def ligand_key(self, ligand: Union[str, Molecule]) -> str:
+        """Returns a hash identifying the ligand, used to match journal records on resume."""
+        if isinstance(ligand, str):
+            return hash_text("smiles", ligand)
+        return hash_molecule(ligand, ligand.identifiers)
+
+    def build_record(
+        self, result: ScreenResult, key: str, index: int, attempt: int
+    ) -> Dict[str, Any]:
+        """Returns the journal record of a docking result."""
+        record = {"index": index, "key": key, "attempt": attempt, "time": time.time()}
+        if result.error is not None:
+            record.update(status="failed", error=result.error)
+            return record
+
+        output = result.output
+        record.update(
+            status="done",
+            scores=output.scores.tolist(),
+            rmsd_lb=output.rmsd_lb.tolist(),
+            rmsd_ub=output.rmsd_ub.tolist(),
+            system=output.system,
+        )
+        return record
+
+    def parse_output(
+        self, records: Dict[int, Dict[str, Any]], inputs: AutoDockCampaignInput
+    ) -> AutoDockCampaignOutput:
+        scores = [None] * len(inputs.ligands)
+        errors = {}
+
+        for index, record in records.items():
+            if record["status"] == "done":
+                scores[index] = record["scores"][0] if record["scores"] else None
+            else:
+                errors[index] = record["error"]
+
+        return AutoDockCampaignOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=len(errors) < len(scores) or not scores,
+            proc_input=inputs,
+            scores=scores,
+            errors=errors or None,
+        )
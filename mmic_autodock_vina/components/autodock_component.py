@@ -3,11 +3,21 @@ from mmic_docking.components import DockComponent
 from mmic_autodock_vina.components.autodock_prep_component import AutoDockPrepComponent
 from mmic_autodock_vina.components.autodock_compute_component import (
     AutoDockComputeComponent,
+    merge_outputs,
 )
 from mmic_autodock_vina.components.autodock_post_component import AutoDockPostComponent
+from mmic_autodock_vina.models import AutoDockComputeOutput
+from mmic_autodock_vina.util.box import MULTI_BOX_OPTIONS
+from mmic_autodock_vina.util.merge import MIN_RMSD
+from mmic_autodock_vina.util.scheduler import available_cores
+from mmic_docking.models import InputDock
 from cmselemental.util.decorators import classproperty
 
 from typing import Any, Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+VINA_NUM_MODES = 9  # vina default
 
 __all__ = ["AutoDockComponent"]
 
@@ -38,8 +48,70 @@ class AutoDockComponent(TacticComponent):
         timeout: Optional[int] = None,
     ) -> Tuple[bool, Dict[str, Any]]:
 
-        compInput = AutoDockPrepComponent.compute(inputs)
-        compOutput = AutoDockComputeComponent.compute(compInput)
-        dockOutput = AutoDockPostComponent.compute(compOutput)
+        if isinstance(inputs, dict):
+            inputs = self.input(**inputs)
+
+        box = (self.extras or {}).get("box") or {}
+        if not any(box.get(key) for key in MULTI_BOX_OPTIONS):
+            compInput = AutoDockPrepComponent.compute(inputs, extras=self.extras)
+            compOutput = AutoDockComputeComponent.compute(compInput, extras=self.extras)
+        else:
+            compOutput = self.dock_boxes(inputs, box)
+
+        dockOutput = AutoDockPostComponent.compute(compOutput, extras=self.extras)
 
         return True, dockOutput
+
+    # helper functions
+    def dock_boxes(
+        self, inputs: InputDock, box: Dict[str, Any]
+    ) -> AutoDockComputeOutput:
+        """
+        Docks the ligand concurrently into each box of the ``box`` specification
+        (several sites, the top k pockets, or tiles of a large box), splitting the
+        available cores between the runs unless the number of CPUs was set, and
+        merges the results with :meth:`merge_outputs`.
+        """
+        extras = {**(self.extras or {}), "box": None}
+        prep = AutoDockPrepComponent(
+            name=AutoDockPrepComponent.__name__,
+            scratch=self.scratch,
+            thread_safe=self.thread_safe,
+            thread_parallel=self.thread_parallel,
+            node_parallel=self.node_parallel,
+            managed_memory=self.managed_memory,
+            extras=extras,
+        )
+        boxes = prep.get_boxes(
+            inputs.molecule.receptor,
+            inputs.search_space,
+            inputs.search_space_units,
+            box=box,
+            ligand=inputs.molecule.ligand,
+        )
+
+        # Molecules are prepared once, then docked in each box
+        _, compInput = prep.execute(inputs)
+        cpu = compInput.cpu
+        if "cpu" not in compInput.__fields_set__:
+            cpu = max(1, len(available_cores()) // len(boxes))
+        compInputs = [compInput.copy(update={**params, "cpu": cpu}) for params in boxes]
+
+        compute = functools.partial(AutoDockComputeComponent.compute, extras=extras)
+        with ThreadPoolExecutor(max_workers=len(boxes)) as executor:
+            outputs = list(executor.map(compute, compInputs))
+
+        return self.merge_outputs(outputs, compInput.num_modes or VINA_NUM_MODES)
+
+    def merge_outputs(
+        self, outputs: List[AutoDockComputeOutput], num_modes: Optional[int] = None
+    ) -> AutoDockComputeOutput:
+        """
+        Merges the poses docked in several boxes into a single output ranked by
+        score, keeping the best ``num_modes`` poses. Duplicate poses, found in
+        overlapping boxes, within the "dedup_rmsd" extras (1 angstrom by default)
+        of a better pose are dropped.
+        """
+        return merge_outputs(
+            outputs, num_modes, (self.extras or {}).get("dedup_rmsd", MIN_RMSD)
+        )
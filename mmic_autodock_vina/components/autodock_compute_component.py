@@ -2,11 +2,80 @@ from typing import Any, Dict, List, Optional, Tuple
 from mmic.components.blueprints import GenericComponent
 from mmic_autodock_vina.models.input import AutoDockComputeInput
 from mmic_autodock_vina.models.output import AutoDockComputeOutput
+from mmic_autodock_vina.util.cache import get_cache, hash_text
+from mmic_autodock_vina.util.merge import (
+    MIN_RMSD,
+    consensus_poses,
+    merge_poses,
+    pose_rmsd,
+)
+from mmic_autodock_vina.util.pdbqt import pose_coordinates, split_poses
+from mmic_autodock_vina.util.scheduler import available_cores
+from mmic_autodock_vina.util.engine import get_engine
+from mmic_autodock_vina.util.scores import get_scores, parse_scores
+from mmic_autodock_vina.util.scratch import ScratchDir
 from mmic_cmd.components import CmdComponent
 from cmselemental.util.decorators import classproperty
-import tempfile
-
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import functools
+import glob
+import json
+import numpy
 import os
+import random
+import subprocess
+import threading
+
+# Fields that do not change the docking result
+FINGERPRINT_EXCLUDE = {"proc_input", "out", "log", "cpu", "provenance", "extras"}
+
+# Search box parameters, replaced by the affinity maps
+BOX_PARAMS = ("center_x", "center_y", "center_z", "size_x", "size_y", "size_z")
+
+# Affinity maps are computed once per key by concurrent threads
+_map_locks = collections.defaultdict(threading.Lock)
+
+
+def merge_outputs(
+    outputs: List[AutoDockComputeOutput],
+    num_modes: Optional[int] = None,
+    min_rmsd: Optional[float] = MIN_RMSD,
+) -> AutoDockComputeOutput:
+    """
+    Merges the outputs of several vina runs of the same ligand into a single
+    output ranked by score, see :func:`~mmic_autodock_vina.util.merge.merge_poses`.
+    """
+    scores = [
+        output.scores
+        or get_scores(output.stdout, output.log, output.system).affinity.tolist()
+        for output in outputs
+    ]
+    system, merged = merge_poses(
+        [output.system or "" for output in outputs],
+        scores,
+        num_modes=num_modes,
+        min_rmsd=min_rmsd,
+    )
+
+    return outputs[0].copy(
+        update={
+            "scores": merged.affinity.tolist(),
+            "rmsd_lb": merged.rmsd_lb.tolist(),
+            "rmsd_ub": merged.rmsd_ub.tolist(),
+            "system": system,
+        }
+    )
+
+
+@functools.lru_cache()
+def vina_version() -> str:
+    """Returns the version string of the vina executable, or "" if vina is not found."""
+    try:
+        proc = subprocess.run(["vina", "--version"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return (proc.stdout or proc.stderr).strip()
 
 
 class AutoDockComputeComponent(GenericComponent):
@@ -32,30 +101,435 @@ class AutoDockComputeComponent(GenericComponent):
         config: Optional["TaskConfig"] = None,
     ) -> Tuple[bool, Dict[str, Any]]:
 
-        receptor, ligand = inputs.receptor, inputs.ligand
-        receptor_fname = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
-        ligand_fname = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
+        replicas = (self.extras or {}).get("replicas")
+        adaptive = (self.extras or {}).get("adaptive")
+        if replicas and adaptive:
+            raise ValueError("The 'replicas' and 'adaptive' extras cannot be combined.")
+
+        if replicas:
+            settings = {} if replicas is True else replicas
+            return True, self.replica_run(inputs, config=config, **settings)
+
+        if adaptive:
+            settings = {} if adaptive is True else adaptive
+            return True, self.adaptive_run(inputs, config=config, **settings)
+
+        return True, self.run(inputs, config)
+
+    def run(
+        self,
+        inputs: AutoDockComputeInput,
+        config: Optional["TaskConfig"] = None,
+        cached: Optional[bool] = None,
+    ) -> AutoDockComputeOutput:
+        """
+        Runs vina once, or returns the cached result of an identical run. Only
+        seeded runs are cached, unless ``cached`` is False: the result of an
+        unseeded run is one sample of a stochastic search, not to be replayed. The
+        "engine" extras selects the vina executable ("subprocess", the default) or
+        the vina Python bindings ("bindings"). With the "grid_maps" extras, vina
+        docks against the affinity maps of the receptor and box, see :meth:`get_maps`.
+        """
+        extras = self.extras or {}
+        if extras.get("grid_maps") and inputs.maps is None:
+            box = {key: getattr(inputs, key) for key in BOX_PARAMS}
+            inputs = inputs.copy(
+                update={"maps": self.get_maps(inputs.receptor, box, config)}
+            )
+
+        cache = None
+        if inputs.seed is not None and cached is not False:
+            cache = get_cache(
+                "results",
+                extras.get("result_cache"),
+                suffix=".json",
+                ttl=extras.get("result_cache_ttl"),
+            )
+
+        if cache is not None:
+            key = self.fingerprint(inputs)
+            cached = cache.get(key)
+            if cached is not None:
+                return AutoDockComputeOutput(
+                    **{**json.loads(cached), "extras": {"cached": True}},
+                    proc_input=inputs.proc_input,
+                )
 
-        with open(receptor_fname, "w") as fp:
-            fp.write(receptor)
+        engine = extras.get("engine", "subprocess")
+        if engine == "subprocess":
+            output = self.run_subprocess(inputs, config)
+        elif engine == "bindings":
+            output = self.run_bindings(inputs)
+        else:
+            raise ValueError(
+                f"Engine {engine} not supported. Use 'subprocess' or 'bindings'."
+            )
 
-        with open(ligand_fname, "w") as fp:
-            fp.write(ligand)
+        if cache is not None:
+            cache.put(key, output.json(exclude={"proc_input"}))
 
+        return output
+
+    def run_subprocess(
+        self, inputs: AutoDockComputeInput, config: Optional["TaskConfig"] = None
+    ) -> AutoDockComputeOutput:
+        """Runs the vina executable, passing the inputs by path."""
+        extras = self.extras or {}
         input_model = inputs.dict()
         del input_model["proc_input"]
 
-        input_model["receptor"] = receptor_fname
-        input_model["ligand"] = ligand_fname
-        # need to include flex too
-        input_model["out"] = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
-        input_model["log"] = tempfile.NamedTemporaryFile(suffix=".log").name
+        backend = extras.get("scratch_backend")
+
+        # Inputs are written once to the scratch space and passed to vina by path
+        with ScratchDir(backend) as scratch:
+            if inputs.maps:
+                for key in ("receptor", *BOX_PARAMS):
+                    del input_model[key]
+            else:
+                input_model["receptor"] = scratch.write(
+                    "receptor.pdbqt", inputs.receptor
+                )
+            input_model["ligand"] = scratch.write("ligand.pdbqt", inputs.ligand)
+            if inputs.flex:
+                input_model["flex"] = scratch.write("flex.pdbqt", inputs.flex)
+            input_model["out"] = scratch.name("out.pdbqt")
+            input_model["log"] = scratch.name("out.log")
+
+            execute_input = self.build_input(input_model, config)
+            execute_input["scratch_directory"] = (
+                execute_input["scratch_directory"] or scratch.path
+            )
+            execute_output = CmdComponent.compute(execute_input)
 
-        execute_input = self.build_input(input_model, config)
-        execute_output = CmdComponent.compute(execute_input)
         input_model["proc_input"] = inputs.proc_input
-        output = True, self.parse_output(execute_output.dict(), input_model)
-        return output
+        return self.parse_output(execute_output.dict(), input_model)
+
+    def run_bindings(self, inputs: AutoDockComputeInput) -> AutoDockComputeOutput:
+        """
+        Docks in-process with the vina Python bindings. The receptor and its grid
+        stay loaded in the calling thread between runs with the same receptor, box,
+        CPUs, and seed, see :func:`~mmic_autodock_vina.util.engine.get_engine`.
+        The ligand is passed as a string and no files are written. The bindings
+        only take the seed when vina is created, so adaptive and replica runs,
+        which use a new seed in a new thread for every run, are never warm: each
+        loads the receptor and computes (or, with "grid_maps", reads) the grid.
+        """
+        engine = get_engine(
+            receptor=inputs.receptor,
+            box=[getattr(inputs, key) for key in BOX_PARAMS],
+            flex=inputs.flex,
+            maps=inputs.maps,
+            cpu=inputs.cpu,
+            seed=inputs.seed,
+            scratch_backend=(self.extras or {}).get("scratch_backend"),
+        )
+        system, energies = engine.dock(
+            inputs.ligand,
+            exhaustiveness=inputs.exhaustiveness,
+            num_modes=inputs.num_modes,
+            energy_range=inputs.energy_range,
+        )
+        scores = parse_scores(system)
+
+        return AutoDockComputeOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=True,
+            stdout="",
+            system=system,
+            scores=energies[:, 0].tolist(),
+            rmsd_lb=scores.rmsd_lb.tolist(),
+            rmsd_ub=scores.rmsd_ub.tolist(),
+            proc_input=inputs.proc_input,
+        )
+
+    def adaptive_run(
+        self,
+        inputs: AutoDockComputeInput,
+        exhaustiveness: Optional[int] = 2,
+        max_exhaustiveness: Optional[int] = None,
+        seeds: Optional[int] = 2,
+        score_tol: Optional[float] = 0.5,
+        rmsd_tol: Optional[float] = 2.0,
+        hit_threshold: Optional[float] = None,
+        config: Optional["TaskConfig"] = None,
+    ) -> AutoDockComputeOutput:
+        """
+        Docks with adaptive exhaustiveness: each round runs ``seeds`` concurrent
+        vina runs with different seeds, splitting the CPUs between them (see
+        :meth:`split_cpu`), starting at a low ``exhaustiveness`` that
+        is doubled, up to ``max_exhaustiveness``, as long as the runs have not
+        converged or the ligand is a hit. The poses of all runs are merged.
+
+        Parameters
+        ----------
+        inputs : AutoDockComputeInput
+            Docking input. Its exhaustiveness is the default maximum.
+        exhaustiveness : int, optional
+            Exhaustiveness of the first round.
+        max_exhaustiveness : int, optional
+            Maximum exhaustiveness, defaults to the input exhaustiveness.
+        seeds : int, optional
+            Number of runs (seeds) per round.
+        score_tol : float, optional
+            Maximum spread (kcal/mol) of the best scores of the runs of a round
+            for the docking to be converged.
+        rmsd_tol : float, optional
+            Maximum heavy atom RMSD (angstrom) of the best poses of the runs of a
+            round from the overall best pose for the docking to be converged.
+        hit_threshold : float, optional
+            Ligands scoring at or below this affinity (kcal/mol) are escalated up
+            to the maximum exhaustiveness even when converged.
+
+        Returns
+        -------
+        AutoDockComputeOutput
+            Merged output, with the final exhaustiveness, the number of runs, and
+            whether the runs converged in ``extras["adaptive"]``.
+        """
+        max_exhaustiveness = max_exhaustiveness or inputs.exhaustiveness or 8
+        exhaustiveness = min(exhaustiveness, max_exhaustiveness)
+        seed = inputs.seed if inputs.seed is not None else random.randrange(2**31)
+        cpu = self.split_cpu(inputs, seeds)
+
+        # Runs with random seeds cannot be replayed, and are not cached
+        run = functools.partial(self.run, config=config, cached=inputs.seed is not None)
+
+        outputs = []
+        with ThreadPoolExecutor(max_workers=seeds) as executor:
+            while True:
+                rounds = [
+                    inputs.copy(
+                        update={
+                            "exhaustiveness": exhaustiveness,
+                            "seed": seed + len(outputs) + index,
+                            "cpu": cpu,
+                        }
+                    )
+                    for index in range(seeds)
+                ]
+                latest = list(executor.map(run, rounds))
+                outputs.extend(latest)
+
+                converged = self.converged(latest, score_tol, rmsd_tol)
+                best = min(min(output.scores or [0.0]) for output in latest)
+                hit = hit_threshold is not None and best <= hit_threshold
+                if exhaustiveness >= max_exhaustiveness or (converged and not hit):
+                    break
+                exhaustiveness = min(2 * exhaustiveness, max_exhaustiveness)
+
+        output = merge_outputs(
+            outputs, inputs.num_modes, (self.extras or {}).get("dedup_rmsd", MIN_RMSD)
+        )
+        adaptive = {
+            "exhaustiveness": exhaustiveness,
+            "runs": len(outputs),
+            "converged": converged,
+        }
+        return output.copy(update={"extras": {"adaptive": adaptive}})
+
+    def replica_run(
+        self,
+        inputs: AutoDockComputeInput,
+        seeds: Optional[int] = 4,
+        exhaustiveness: Optional[int] = None,
+        cluster_rmsd: Optional[float] = 2.0,
+        config: Optional["TaskConfig"] = None,
+    ) -> AutoDockComputeOutput:
+        """
+        Docks ``seeds`` concurrent replicas with different seeds, splitting the
+        CPUs between them, and ranks the pose clusters of all replicas by
+        support, then consensus score, see :func:`~mmic_autodock_vina.util.merge.consensus_poses`.
+
+        Parameters
+        ----------
+        inputs : AutoDockComputeInput
+            Docking input.
+        seeds : int, optional
+            Number of replicas.
+        exhaustiveness : int, optional
+            Exhaustiveness of each replica, defaults to the input exhaustiveness.
+        cluster_rmsd : float, optional
+            Clustering RMSD cutoff (angstrom).
+
+        Returns
+        -------
+        AutoDockComputeOutput
+            Consensus output: the best pose of each cluster with the mean score of
+            the replicas. The standard deviation of the scores and the number of
+            replicas supporting each cluster are in ``extras["replicas"]``.
+        """
+        seed = inputs.seed if inputs.seed is not None else random.randrange(2**31)
+        cpu = self.split_cpu(inputs, seeds)
+        replicas = [
+            inputs.copy(
+                update={
+                    "exhaustiveness": exhaustiveness or inputs.exhaustiveness,
+                    "seed": seed + index,
+                    "cpu": cpu,
+                }
+            )
+            for index in range(seeds)
+        ]
+        run = functools.partial(self.run, config=config, cached=inputs.seed is not None)
+        with ThreadPoolExecutor(max_workers=seeds) as executor:
+            outputs = list(executor.map(run, replicas))
+
+        scores = [
+            output.scores
+            or get_scores(output.stdout, output.log, output.system).affinity.tolist()
+            for output in outputs
+        ]
+        system, consensus = consensus_poses(
+            [output.system or "" for output in outputs],
+            scores,
+            num_modes=inputs.num_modes,
+            cluster_rmsd=cluster_rmsd,
+        )
+
+        replicas = {
+            "seeds": [replica.seed for replica in replicas],
+            "std": consensus.std.tolist(),
+            "support": consensus.support.tolist(),
+        }
+        return outputs[0].copy(
+            update={
+                "scores": consensus.scores.affinity.tolist(),
+                "rmsd_lb": consensus.scores.rmsd_lb.tolist(),
+                "rmsd_ub": consensus.scores.rmsd_ub.tolist(),
+                "system": system,
+                "extras": {"replicas": replicas},
+            }
+        )
+
+    def split_cpu(self, inputs: AutoDockComputeInput, runs: int) -> int:
+        """
+        Returns the number of CPUs of each of ``runs`` concurrent vina runs of an
+        input, splitting its number of CPUs if set, or else the available cores.
+        """
+        ncores = inputs.cpu
+        if "cpu" not in inputs.__fields_set__ or not ncores:
+            ncores = len(available_cores())
+        return max(1, ncores // runs)
+
+    def converged(
+        self,
+        outputs: List[AutoDockComputeOutput],
+        score_tol: Optional[float] = 0.5,
+        rmsd_tol: Optional[float] = 2.0,
+    ) -> bool:
+        """
+        Returns True if the best scores of independent runs are within
+        ``score_tol`` and their best poses within ``rmsd_tol`` heavy atom RMSD of
+        the overall best pose.
+        """
+        tops = [
+            (output.scores[0], output.system[split_poses(output.system)[0].ligand])
+            for output in outputs
+            if output.scores and output.system
+        ]
+        if len(tops) < len(outputs):
+            return False
+
+        scores = [score for score, _ in tops]
+        if max(scores) - min(scores) > score_tol:
+            return False
+
+        best = tops[scores.index(min(scores))][1]
+        types, ref = pose_coordinates(best)
+        coords = numpy.array([pose_coordinates(pose)[1] for _, pose in tops])
+        _, rmsd = pose_rmsd(coords, types, ref)
+        return bool(rmsd.max() <= rmsd_tol)
+
+    def get_maps(
+        self,
+        receptor: str,
+        box: Dict[str, float],
+        config: Optional["TaskConfig"] = None,
+    ) -> str:
+        """
+        Returns the path prefix of the vina affinity maps of a receptor in a search
+        box. The maps are written once by ``vina --write_maps``, for every atom
+        type, and stored in the map cache (the "grid_maps" extras: True for the
+        default directory or a directory path e.g. on /dev/shm), where every later
+        run and worker process reads them instead of recomputing the grid.
+        """
+        extras = self.extras or {}
+        setting = extras.get("grid_maps")
+        setting = None if setting is True else setting
+        maps = get_cache("maps", setting, suffix=".map")
+        index = get_cache("maps", setting, suffix=".json")
+
+        key = hash_text(
+            vina_version(), receptor, *(float(box[param]) for param in BOX_PARAMS)
+        )
+
+        def lookup() -> Optional[str]:
+            # The maps of a key are evicted independently, all must be cached
+            types = json.loads(index.get(key) or "[]")
+            paths = [maps.locate(f"{key}.{adtype}") for adtype in types]
+            if not paths or None in paths:
+                return None
+            return paths[0][: -len(f".{types[0]}{maps.suffix}")]
+
+        with _map_locks[key]:
+            prefix = lookup()
+            if prefix is not None:
+                return prefix
+
+            env = os.environ.copy()
+
+            if config:
+                env["MKL_NUM_THREADS"] = str(config.ncores)
+                env["OMP_NUM_THREADS"] = str(config.ncores)
+
+            scratch_directory = config.scratch_directory if config else None
+
+            with ScratchDir(extras.get("scratch_backend")) as scratch:
+                command = [
+                    "vina",
+                    "--receptor",
+                    scratch.write("receptor.pdbqt", receptor),
+                ]
+                for param in BOX_PARAMS:
+                    command.extend(["--" + param, str(box[param])])
+                command.extend(
+                    ["--write_maps", scratch.name("maps"), "--force_even_voxels"]
+                )
+
+                CmdComponent.compute(
+                    {
+                        "command": command,
+                        "infiles": None,
+                        "outfiles": None,
+                        "scratch_directory": scratch_directory or scratch.path,
+                        "environment": env,
+                        "raise_err": True,
+                    }
+                )
+
+                types = []
+                for fname in sorted(glob.glob(scratch.name("maps.*.map"))):
+                    adtype = os.path.basename(fname)[len("maps.") : -len(".map")]
+                    with open(fname) as fp:
+                        maps.put(f"{key}.{adtype}", fp.read())
+                    types.append(adtype)
+
+            if not types:
+                raise RuntimeError("vina did not write any affinity maps.")
+            index.put(key, json.dumps(types))
+            return lookup()
+
+    def fingerprint(self, inputs: AutoDockComputeInput) -> str:
+        """
+        Returns a hash of the vina version and the input fields that determine the
+        docking result: receptor, ligand, flexible side-chains, box, and search
+        parameters. The number of CPUs and the output paths are excluded.
+        """
+        fields = inputs.dict(exclude=FINGERPRINT_EXCLUDE, exclude_unset=False)
+        return hash_text(
+            vina_version(), json.dumps(fields, sort_keys=True, default=str)
+        )
 
     def build_input(
         self,
@@ -84,7 +558,7 @@ class AutoDockComputeComponent(GenericComponent):
 
         return {
             "command": cmd,
-            "infiles": [input_model["ligand"], input_model["receptor"]],
+            "infiles": None,  # passed by absolute path, no copy needed
             "outfiles": [
                 input_model["out"],
                 input_model["log"],
@@ -102,6 +576,7 @@ class AutoDockComputeComponent(GenericComponent):
         outfiles = output["outfiles"]
         system = outfiles[inputs["out"]]
         log = outfiles[inputs["log"]]
+        scores = get_scores(stdout, log, system)
 
         return AutoDockComputeOutput(
             schema_name="mmschema",
@@ -111,5 +586,8 @@ class AutoDockComputeComponent(GenericComponent):
             stderr=stderr,
             log=log,
             system=system,
+            scores=scores.affinity.tolist(),
+            rmsd_lb=scores.rmsd_lb.tolist(),
+            rmsd_ub=scores.rmsd_ub.tolist(),
             proc_input=inputs["proc_input"],
         )
@@ -0,0 +1,267 @@
+# Import models
+from mmic_autodock_vina.models import (
+    AutoDockFunnelInput,
+    AutoDockFunnelOutput,
+    AutoDockFunnelStage,
+)
+
+# Import components
+from mmic.components.blueprints import GenericComponent
+from mmic_autodock_vina.components.autodock_screen_component import (
+    PLAN_SAMPLE_SIZE,
+    AutoDockScreenComponent,
+    ScreenResult,
+)
+from mmic_autodock_vina.util.scheduler import available_cores, heavy_atom_count
+from cmselemental.util.decorators import classproperty
+
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import math
+import numpy
+import queue
+import threading
+
+__all__ = ["AutoDockFunnelComponent"]
+
+
+class StagePromoter:
+    """
+    Selects the ligands of a stage promoted to the next stage as their scores
+    arrive. After ``warmup`` scores, ligands beating the running ``keep``
+    quantile (and the score ``threshold``) are promoted immediately; the
+    remaining ligands of the final top fraction are promoted by :meth:`finish`.
+    """
+
+    def __init__(self, stage: AutoDockFunnelStage, warmup: int, promote: queue.Queue):
+        self.keep = stage.keep if stage.keep and stage.keep < 1 else None
+        self.threshold = stage.threshold
+        self.warmup = warmup
+        self.promote = promote
+        self.scores: Dict[int, float] = {}
+        self.promoted = set()
+        self._cutoff = None
+        self._next_update = warmup
+
+    def add(self, index: int, score: float):
+        self.scores[index] = score
+        if self.keep and len(self.scores) >= self._next_update:
+            # The quantile is refreshed as the stage grows by ~6%
+            self._cutoff = numpy.quantile(list(self.scores.values()), self.keep)
+            self._next_update = len(self.scores) + max(16, len(self.scores) // 16)
+
+        if self.keep and self._cutoff is None:
+            return
+        if self.passes(score, self._cutoff):
+            self.promoted.add(index)
+            self.promote.put(index)
+
+    def passes(self, score: float, cutoff: Optional[float] = None) -> bool:
+        return (self.threshold is None or score <= self.threshold) and (
+            cutoff is None or score <= cutoff
+        )
+
+    def finish(self):
+        """Promotes the ligands of the final top fraction not promoted yet, best first."""
+        ranked = sorted(self.scores, key=self.scores.get)
+        if self.keep:
+            ranked = ranked[: math.ceil(self.keep * len(ranked))]
+        for index in ranked:
+            if index not in self.promoted and self.passes(self.scores[index]):
+                self.promoted.add(index)
+                self.promote.put(index)
+
+
+class AutoDockFunnelComponent(GenericComponent):
+    """
+    Multi-stage screening funnel: the first stage docks the whole library with
+    cheap settings, and each following stage re-docks the best ligands of the
+    previous stage with its own keywords and extras. The stages run concurrently,
+    each streaming its top ligands into the next one as they are scored, and
+    share the cores: unless set per stage, each stage gets an equal share. If a
+    stage fails, every stage stops pulling ligands and the error is raised.
+    """
+
+    @classproperty
+    def input(cls):
+        return AutoDockFunnelInput
+
+    @classproperty
+    def output(cls):
+        return AutoDockFunnelOutput
+
+    @classproperty
+    def version(cls):
+        return ""
+
+    def execute(
+        self,
+        inputs: AutoDockFunnelInput,
+        extra_outfiles: Optional[List[str]] = None,
+        extra_commands: Optional[List[str]] = None,
+        scratch_name: Optional[str] = None,
+        timeout: Optional[int] = None,
+        config: Optional["TaskConfig"] = None,
+    ) -> Tuple[bool, AutoDockFunnelOutput]:
+
+        if isinstance(inputs, dict):
+            inputs = self.input(**inputs)
+
+        for stage in inputs.stages:
+            if "flex_residues" in {**(self.extras or {}), **(stage.extras or {})}:
+                raise ValueError(
+                    "Flexible residues are set by the flex_residues field of the "
+                    "funnel or its stages, not by extras."
+                )
+
+        nstages = len(inputs.stages)
+        stage_scores = [[None] * len(inputs.ligands) for _ in range(nstages)]
+        outputs = [None] * len(inputs.ligands)
+        errors, failures = {}, []
+        failed = threading.Event()
+
+        # Ligand indices promoted to each stage, terminated by None
+        promoted = [None] + [queue.Queue() for _ in range(1, nstages)]
+
+        # Later stages are planned from the library sizes, without waiting for
+        # a sample of promoted ligands
+        sizes = [
+            heavy_atom_count(ligand) for ligand in inputs.ligands[:PLAN_SAMPLE_SIZE]
+        ]
+
+        def run_stage(stage: int):
+            promoter = None
+            if stage + 1 < nstages:
+                promoter = StagePromoter(
+                    inputs.stages[stage + 1], inputs.warmup, promoted[stage + 1]
+                )
+            source = (
+                iter(range(len(inputs.ligands)))
+                if stage == 0
+                else iter(promoted[stage].get, None)
+            )
+            results = self.iter_stage(inputs, stage, source, sizes, stop=failed)
+            try:
+                for index, result in results:
+                    if failed.is_set():
+                        break
+                    if result.error is not None:
+                        errors[index] = result.error
+                        continue
+                    stage_scores[stage][index] = result.output.score
+                    if promoter is None:
+                        outputs[index] = result.output.to_output(
+                            inputs.materialize_top_k
+                        )
+                    elif result.output.score is not None:
+                        promoter.add(index, result.output.score)
+                if promoter is not None and not failed.is_set():
+                    promoter.finish()
+            except Exception as err:
+                failures.append(err)
+                failed.set()
+                # Later stages waiting for promoted ligands stop at once
+                for later in promoted[stage + 2 :]:
+                    later.put(None)
+            finally:
+                results.close()
+                if promoter is not None:
+                    promoted[stage + 1].put(None)
+
+        # Intermediate stages run in threads, the last stage in this thread
+        threads = [
+            threading.Thread(target=run_stage, args=(stage,), daemon=True)
+            for stage in range(nstages - 1)
+        ]
+        for thread in threads:
+            thread.start()
+        run_stage(nstages - 1)
+
+        # Once a stage failed, the earlier stages stop pulling ligands and their
+        # in-flight dockings are not waited for
+        if not failed.is_set():
+            for thread in threads:
+                thread.join()
+
+        if failures:
+            raise failures[0]
+
+        return True, self.parse_output(stage_scores, outputs, errors, inputs)
+
+    # helper functions
+    def iter_stage(
+        self,
+        inputs: AutoDockFunnelInput,
+        stage: int,
+        source: Iterator[int],
+        sizes: Optional[Sequence[int]] = None,
+        stop: Optional[threading.Event] = None,
+    ) -> Iterator[Tuple[int, ScreenResult]]:
+        """
+        Docks the ligands at the positions yielded by ``source`` with the settings
+        of a stage, yielding each (position, result) as its docking completes.
+        ``source`` may block until ligands are promoted to the stage. The CPUs per
+        docking are planned from the heavy atom counts ``sizes``. No ligand is
+        pulled from ``source`` once the ``stop`` event is set, and closing the
+        iterator cancels the dockings not started yet.
+        """
+        settings = inputs.stages[stage]
+        ncores = inputs.ncores or len(available_cores())
+        screen = inputs.copy(
+            update={
+                "ligands": [],
+                "keywords": {**(inputs.keywords or {}), **(settings.keywords or {})},
+                "nworkers": settings.nworkers or inputs.nworkers,
+                "ncores": settings.ncores or max(1, ncores // len(inputs.stages)),
+                "flex_residues": (
+                    inputs.flex_residues
+                    if settings.flex_residues is None
+                    else settings.flex_residues
+                ),
+                "lazy": True,
+            }
+        )
+
+        order = []
+
+        def ligands():
+            for index in source:
+                if stop is not None and stop.is_set():
+                    return
+                order.append(index)
+                yield inputs.ligands[index]
+
+        results = AutoDockScreenComponent.stream(
+            screen,
+            ligands=ligands(),
+            extras={**(self.extras or {}), **(settings.extras or {})},
+            sizes=sizes,
+        )
+        try:
+            for result in results:
+                yield order[result.index], result
+        finally:
+            results.close()
+
+    def parse_output(
+        self,
+        stage_scores: List[List[Optional[float]]],
+        outputs: List,
+        errors: Dict[int, str],
+        inputs: AutoDockFunnelInput,
+    ) -> AutoDockFunnelOutput:
+        scores = [None] * len(inputs.ligands)
+        for stage in stage_scores:
+            for index, score in enumerate(stage):
+                if score is not None:
+                    scores[index] = score
+
+        return AutoDockFunnelOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=len(errors) < len(scores) or not scores,
+            proc_input=inputs,
+            scores=scores,
+            stage_scores=stage_scores,
+            outputs=outputs,
+            errors=errors or None,
+        )
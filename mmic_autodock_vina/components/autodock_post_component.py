@@ -1,5 +1,8 @@
 # Import models
 from mmic_autodock_vina.models.output import AutoDockComputeOutput
+from mmic_autodock_vina.util.pdbqt import LazyPose, get_poses, read_pdbqt, split_poses
+from mmic_autodock_vina.util.scores import VinaScores, get_scores
+from mmic_docking.models.input import InputDock
 from mmic_docking.models.output import OutputDock
 from mmelemental.models.util import FileInput, FileOutput
 from mmelemental.models import Molecule
@@ -10,10 +13,56 @@ from mmic.components.blueprints import GenericComponent
 from mmic_cmd.components import CmdComponent
 
 from typing import Any, Dict, List, Optional, Tuple, Union
+import numpy
 import os
 import tempfile
 
 
+class LazyDockOutput:
+    """
+    Lightweight docking output holding the scores and :class:`LazyPose` handles to
+    the raw poses, which are only parsed into molecules when accessed. Use
+    :meth:`to_output` to build the full OutputDock.
+    """
+
+    def __init__(self, proc_input: InputDock, system: str, scores: VinaScores):
+        self.proc_input = proc_input
+        self.system = system
+        self.scores = scores.affinity
+        self.rmsd_lb, self.rmsd_ub = scores.rmsd_lb, scores.rmsd_ub
+        self.ligand, self.flex = [], []
+
+        for pose, score in zip(split_poses(system), self.scores.tolist()):
+            self.ligand.append(LazyPose(system, pose.ligand, score))
+            if pose.flex is not None:
+                self.flex.append(LazyPose(system, pose.flex, score))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(nposes={len(self.ligand)}, score={self.score})"
+
+    @property
+    def score(self) -> Optional[float]:
+        """The score of the top pose."""
+        return float(self.scores[0]) if len(self.scores) else None
+
+    def to_output(self, materialize_top_k: Optional[int] = None) -> OutputDock:
+        """Returns the docking output with (at most) the top k poses parsed into molecules."""
+        k = materialize_top_k
+
+        return OutputDock(
+            proc_input=self.proc_input,
+            schema_name=self.proc_input.schema_name,
+            schema_version=self.proc_input.schema_version,
+            success=True,
+            poses={
+                "ligand": [pose.molecule for pose in self.ligand[:k]],
+                "receptor": [pose.molecule for pose in self.flex[:k]],
+            },
+            scores=self.scores[:k].tolist(),
+            scores_units="kcal/mol",
+        )
+
+
 class AutoDockPostComponent(GenericComponent):
     """Postprocessing autodock component."""
 
@@ -38,10 +87,9 @@ class AutoDockPostComponent(GenericComponent):
         timeout: Optional[int] = None,
     ) -> Tuple[bool, Dict[str, Any]]:
 
-        execute_input = self.build_input(inputs)
-        execute_output = CmdComponent.compute(execute_input)
+        poses = self.build_input(inputs)
 
-        out = True, self.parse_output(execute_output, inputs)
+        out = True, self.parse_output(poses, inputs)
         return out
 
     def build_input(
@@ -50,49 +98,25 @@ class AutoDockPostComponent(GenericComponent):
         config: "TaskConfig" = None,
         template: Optional[str] = None,
     ) -> Dict[str, Any]:
-        """Builds input files for autodock vina_split."""
-
-        system = input_model.system
-
-        fsystem = FileOutput(path=tempfile.NamedTemporaryFile(suffix=".pdbqt").name)
-        fsystem.write(system)
-
-        cmd = [
-            "vina_split",
-            "--input",
-            fsystem.abs_path,
-            "--ligand",
-            "ligand",
-            "--flex",
-            "flex",
-        ]
-        env = os.environ.copy()
+        """Splits the docked system into ligand and flexible side-chain poses in-process."""
 
-        if config:
-            env["MKL_NUM_THREADS"] = str(config.ncores)
-            env["OMP_NUM_THREADS"] = str(config.ncores)
+        ligands, flex = get_poses(input_model.system)
 
-        scratch_directory = config.scratch_directory if config else None
-
-        return {
-            "command": cmd,
-            "infiles": [fsystem.abs_path],
-            "outfiles": ["ligand*", "flex*"]
-            if hasattr(input_model.proc_input, "flex")
-            else ["ligand*"],
-            "scratch_directory": scratch_directory,
-            "environment": env,
-        }
+        return {"ligand": ligands, "flex": flex}
 
     def parse_output(
         self, outputs: Dict[str, Any], inputs: AutoDockComputeOutput
     ) -> OutputDock:
-        """Parses output from vina_split."""
+        """
+        Parses the split poses. If the "materialize_top_k" extras is set, only the
+        top k poses (and scores) are returned.
+        """
+        k = (self.extras or {}).get("materialize_top_k")
 
-        ligands = self.read_files(files=outputs.outfiles["ligand*"])
-        flex = self.read_files(files=outputs.outfiles.get("flex*"))
+        ligands = self.read_files(files=outputs["ligand"][:k])
+        flex = self.read_files(files=outputs["flex"][:k])
 
-        scores = self.get_scores(inputs.stdout)
+        scores = self.get_scores(inputs).affinity[:k].tolist()
 
         return OutputDock(
             proc_input=inputs.proc_input,
@@ -107,9 +131,41 @@ class AutoDockPostComponent(GenericComponent):
             scores_units="kcal/mol",
         )
 
+    def lazy_output(self, inputs: AutoDockComputeOutput) -> LazyDockOutput:
+        """Returns a lightweight output whose poses are parsed on first access."""
+        return LazyDockOutput(
+            proc_input=inputs.proc_input,
+            system=inputs.system,
+            scores=self.get_scores(inputs),
+        )
+
     def read_files(
         self, files: List[str], config: Optional["TaskConfig"] = None
     ) -> List[Molecule]:
+        """
+        Converts PDBQT pose strings to molecules with the native PDBQT reader.
+        Poses the reader cannot handle, or all poses if the "pdbqt_reader" extras
+        is set to "obabel", are converted with obabel instead.
+        """
+        if files is None:
+            return []
+
+        if (self.extras or {}).get("pdbqt_reader", "native") == "obabel":
+            return self.read_files_obabel(files, config)
+
+        mols = []
+        for pose in files:
+            try:
+                mols.append(read_pdbqt(pose))
+            except ValueError:
+                mols.extend(self.read_files_obabel([pose], config))
+
+        return mols
+
+    def read_files_obabel(
+        self, files: List[str], config: Optional["TaskConfig"] = None
+    ) -> List[Molecule]:
+        """Converts PDBQT pose strings to molecules via obabel."""
 
         env = os.environ.copy()
 
@@ -134,11 +190,12 @@ class AutoDockPostComponent(GenericComponent):
         }
 
         if files is not None:
-            for fname in files:
+            for pose in files:
                 ligand_file = tempfile.NamedTemporaryFile(suffix=".pdb")
-                with FileOutput(path=os.path.abspath(fname), clean=True) as pdbqt:
+                fname = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
+                with FileOutput(path=fname, clean=True) as pdbqt:
 
-                    pdbqt.write(files[fname])
+                    pdbqt.write(pose)
                     obabel_input = obabel_input_lambda(pdbqt.path, ligand_file.name)
 
                     ligand_pdb = CmdComponent.compute(input_data=obabel_input).outfiles[
@@ -150,22 +207,16 @@ class AutoDockPostComponent(GenericComponent):
 
         return mols
 
-    def get_scores(self, stdout: str) -> List[float]:
+    def get_scores(self, inputs: AutoDockComputeOutput) -> VinaScores:
         """
-        Extracts scores from autodock vina command-line output.
-        .. todo:: Extract and return RMSD values.
+        Returns the affinity and RMSD bounds of each pose. Scores already parsed
+        by the compute component are reused, otherwise they are extracted from
+        the vina stdout, log file, or output pdbqt string.
         """
-        read_scores = False
-        scores = []
-
-        for line in stdout.split("\n"):
-            if line == "-----+------------+----------+----------":
-                read_scores = True
-                continue
-            elif "Writing output" in line:
-                break
-            if read_scores:
-                trial, score, _, _ = line.split()
-                scores.append(float(score))
-
-        return scores
+        if inputs.scores:
+            return VinaScores(
+                numpy.asarray(inputs.scores, dtype=float),
+                numpy.asarray(inputs.rmsd_lb or [], dtype=float),
+                numpy.asarray(inputs.rmsd_ub or [], dtype=float),
+            )
+        return get_scores(inputs.stdout, inputs.log, inputs.system)
@@ -2,18 +2,47 @@
 from mmic_docking.models import InputDock
 from mmelemental.models import Molecule
 from mmic_autodock_vina.models import AutoDockComputeInput
+from mmic_autodock_vina.util.box import Box, build_boxes
+from mmic_autodock_vina.util.cache import (
+    FileCache,
+    get_cache,
+    hash_molecule,
+    hash_smiles,
+    hash_text,
+)
+from mmic_autodock_vina.util.pdbqt import (
+    has_autodock_types,
+    split_flex,
+    split_titled,
+    write_pdbqt,
+)
 
 # Import components
 from mmic.components.blueprints import GenericComponent
 from mmic_cmd.components import CmdComponent
 
-from mmelemental.util.units import convert
 from cmselemental.util.decorators import classproperty
-from typing import Any, Dict, Optional, Tuple, List
+from typing import Any, Dict, Optional, Sequence, Tuple, List, Union
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import numpy
 import os
 import string
+import subprocess
 import tempfile
 
+SMILES_ARGS = ("--gen3d", "-h")  # obabel args for 3D ligands from smiles
+
+
+@functools.lru_cache()
+def obabel_version() -> str:
+    """Returns the version string of the obabel executable, or "" if obabel is not found."""
+    try:
+        proc = subprocess.run(["obabel", "-V"], capture_output=True, text=True)
+    except OSError:
+        return ""
+    return (proc.stdout or proc.stderr).strip()
+
 
 class AutoDockPrepComponent(GenericComponent):
     """Preprocessing component for autodock"""
@@ -44,34 +73,107 @@ class AutoDockPrepComponent(GenericComponent):
         self, inputs: InputDock, config: Optional["TaskConfig"] = None
     ) -> Dict[str, Any]:
 
-        if inputs.molecule.ligand.identifiers is None:
-            ligand_pdbqt = self.pdbqt_prep(
-                inputs.molecule.ligand, config=config, args=["-h"]
+        ligand_pdbqt = self.ligand_prep(inputs.molecule.ligand, config=config)
+        receptor_pdbqt = self.receptor_prep(inputs.molecule.receptor, config=config)
+        inputDict = self.check_computeparams(inputs)
+        inputDict["ligand"] = ligand_pdbqt
+        inputDict["receptor"] = receptor_pdbqt
+
+        residues = (self.extras or {}).get("flex_residues")
+        if residues:
+            inputDict["receptor"], inputDict["flex"] = self.flex_prep(
+                receptor_pdbqt, residues
             )
-        else:
-            ligand_pdbqt = self.smiles_prep(
-                smiles=inputs.molecule.ligand.identifiers.smiles
+
+        return inputDict
+
+    # helper functions
+    def ligand_prep(self, ligand: Molecule, config: "TaskConfig" = None) -> str:
+        """Returns a pdbqt ligand from a 3D structure or a smiles code, looked up in the ligand cache first."""
+        extras = self.extras or {}
+        cache = get_cache("ligand", extras.get("ligand_cache"))
+        if ligand.identifiers is None or has_autodock_types(ligand):
+            return self.pdbqt_prep(
+                ligand, config=config, args=["-h"], cache=cache, rigid=False
             )
+        return self.smiles_prep(
+            smiles=ligand.identifiers.smiles, config=config, cache=cache
+        )
 
-        receptor_pdbqt = self.pdbqt_prep(
-            receptor=inputs.molecule.receptor,
+    def receptor_prep(self, receptor: Molecule, config: "TaskConfig" = None) -> str:
+        """Returns a rigid pdbqt receptor, looked up in the receptor cache first."""
+        extras = self.extras or {}
+        return self.pdbqt_prep(
+            receptor=receptor,
             config=config,
             args=["-xrh"],
+            cache=get_cache("receptor", extras.get("receptor_cache")),
         )
-        inputDict = self.check_computeparams(inputs)
-        inputDict["ligand"] = ligand_pdbqt
-        inputDict["receptor"] = receptor_pdbqt
 
-        return inputDict
+    def flex_prep(
+        self,
+        receptor_pdbqt: str,
+        residues: Sequence[Union[int, str, Tuple[str, int]]],
+    ) -> Tuple[str, str]:
+        """
+        Splits a pdbqt receptor into its rigid part and the flexible side-chains of
+        ``residues``, see :func:`~mmic_autodock_vina.util.pdbqt.split_flex`. Both
+        parts are looked up in the receptor cache first, by the receptor content
+        and the residue set.
+        """
+        cache = get_cache("receptor", (self.extras or {}).get("receptor_cache"))
+        residues = sorted(
+            {tuple(res) if isinstance(res, (tuple, list)) else res for res in residues},
+            key=str,
+        )
+
+        if cache is not None:
+            keys = [
+                hash_text(receptor_pdbqt, part, *residues) for part in ("rigid", "flex")
+            ]
+            cached = [cache.get(key) for key in keys]
+            if None not in cached:
+                return tuple(cached)
+
+        rigid, flex = split_flex(receptor_pdbqt, residues)
+
+        if cache is not None:
+            for key, pdbqt in zip(keys, (rigid, flex)):
+                cache.put(key, pdbqt)
+
+        return rigid, flex
 
-    # helper functions
     def pdbqt_prep(
         self,
         receptor: Molecule,
         config: "TaskConfig" = None,
         args: Optional[List[str]] = None,
+        cache: Optional[FileCache] = None,
+        rigid: Optional[bool] = True,
     ) -> str:
-        """Returns a pdbqt molecule for rigid docking."""
+        """
+        Returns a pdbqt molecule for docking. Molecules that already carry partial
+        charges and AutoDock atom types are written in-process, with a torsion tree
+        unless ``rigid``, unless the "pdbqt_writer" extras is set to "obabel".
+        Otherwise the molecule is converted with obabel. If a cache is supplied,
+        the pdbqt file is looked up by the molecule content and obabel args before
+        running obabel.
+        """
+        extras = self.extras or {}
+        if extras.get("pdbqt_writer", "native") == "native" and has_autodock_types(
+            receptor
+        ):
+            try:
+                return write_pdbqt(receptor, rigid=rigid)
+            except ValueError:
+                pass
+
+        if cache is not None:
+            key = hash_molecule(receptor, "obabel", obabel_version(), *(args or []))
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
         env = os.environ.copy()
 
         if config:
@@ -101,10 +203,30 @@ class AutoDockPrepComponent(GenericComponent):
         obabel_output = CmdComponent.compute(obabel_input)
         final_receptor = obabel_output.outfiles[outfile]
 
+        if cache is not None:
+            cache.put(key, final_receptor)
+
         return final_receptor
 
-    def smiles_prep(self, smiles: str, config: Optional["TaskConfig"] = None) -> str:
-        """Returns a pdbqt molecule from smiles for rigid docking."""
+    def smiles_prep(
+        self,
+        smiles: str,
+        config: Optional["TaskConfig"] = None,
+        cache: Optional[FileCache] = None,
+    ) -> str:
+        """
+        Returns a pdbqt molecule from smiles for rigid docking. If a cache is
+        supplied, the 3D structure is looked up by the canonical smiles and the
+        obabel version and args before running obabel.
+        """
+        args = SMILES_ARGS
+
+        if cache is not None:
+            key = hash_smiles(smiles, "obabel", obabel_version(), *args)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+
         env = os.environ.copy()
 
         if config:
@@ -121,13 +243,7 @@ class AutoDockPrepComponent(GenericComponent):
         outfile = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
 
         obabel_input = {
-            "command": [
-                "obabel",
-                smi_file,
-                "-O" + outfile,
-                "--gen3d",
-                "-h",
-            ],
+            "command": ["obabel", smi_file, "-O" + outfile, *args],
             "infiles": [smi_file],
             "outfiles": [outfile],
             "scratch_directory": scratch_directory,
@@ -136,36 +252,161 @@ class AutoDockPrepComponent(GenericComponent):
         obabel_output = CmdComponent.compute(obabel_input)
         final_ligand = obabel_output.outfiles[outfile]
 
+        if cache is not None:
+            cache.put(key, final_ligand)
+
         return final_ligand
 
-    def check_computeparams(self, input_model: InputDock) -> Dict[str, Any]:
-        geometry = convert(
-            input_model.molecule.receptor.geometry,
-            input_model.molecule.receptor.geometry_units,
-            "angstrom",
-        )
-        outputDict = {}
-        searchSpace = input_model.search_space
-
-        if not searchSpace:
-            xmin, xmax = geometry[:, 0].min(), geometry[:, 0].max()
-            ymin, ymax = geometry[:, 1].min(), geometry[:, 1].max()
-            zmin, zmax = geometry[:, 2].min(), geometry[:, 2].max()
-        else:
-            xmin, xmax, ymin, ymax, zmin, zmax = convert(
-                searchSpace, input_model.search_space_units, "angstrom"
+    def smiles_batch_prep(
+        self,
+        smiles: List[str],
+        config: Optional["TaskConfig"] = None,
+        cache: Optional[FileCache] = None,
+        nprocs: Optional[int] = 1,
+    ) -> List[Optional[str]]:
+        """
+        Returns pdbqt molecules from many smiles codes, running one obabel process
+        per chunk of smiles instead of one per molecule. The chunks are converted by
+        ``nprocs`` concurrent obabel processes.
+
+        Returns
+        -------
+        List[Optional[str]]
+            pdbqt molecule of each smiles code, None for codes obabel failed to convert.
+        """
+        args = SMILES_ARGS
+        ligands = [None] * len(smiles)
+        keys = [None] * len(smiles)
+
+        if cache is not None:
+            version = obabel_version()
+            for index, code in enumerate(smiles):
+                keys[index] = hash_smiles(code, "obabel", version, *args)
+                ligands[index] = cache.get(keys[index])
+
+        todo = [index for index, ligand in enumerate(ligands) if ligand is None]
+        chunks = [
+            chunk.tolist()
+            for chunk in numpy.array_split(todo, max(1, min(nprocs, len(todo))))
+            if len(chunk)
+        ]
+
+        with ThreadPoolExecutor(max_workers=max(1, len(chunks))) as pool:
+            results = pool.map(
+                lambda chunk: self.obabel_batch(
+                    [smiles[index] for index in chunk], config, args
+                ),
+                chunks,
             )
+            for chunk, pdbqts in zip(chunks, results):
+                for index, pdbqt in zip(chunk, pdbqts):
+                    ligands[index] = pdbqt
+                    if cache is not None and pdbqt is not None:
+                        cache.put(keys[index], pdbqt)
+
+        return ligands
+
+    def obabel_batch(
+        self,
+        smiles: List[str],
+        config: Optional["TaskConfig"] = None,
+        args: Optional[Tuple[str, ...]] = SMILES_ARGS,
+    ) -> List[Optional[str]]:
+        """
+        Converts smiles codes to pdbqt molecules in a single obabel process. Each
+        smiles is titled by its position, which obabel writes to the name record of
+        the output molecule, so outputs are mapped back to inputs even if obabel
+        skips invalid smiles.
+        """
+        env = os.environ.copy()
+
+        if config:
+            env["MKL_NUM_THREADS"] = str(config.ncores)
+            env["OMP_NUM_THREADS"] = str(config.ncores)
+
+        scratch_directory = config.scratch_directory if config else None
+
+        smi_file = tempfile.NamedTemporaryFile(suffix=".smi").name
+
+        with open(smi_file, "w") as fp:
+            for index, code in enumerate(smiles):
+                if code.strip():
+                    fp.write(f"{code.split()[0]} {index}\n")
+
+        outfile = tempfile.NamedTemporaryFile(suffix=".pdbqt").name
+
+        obabel_input = {
+            "command": ["obabel", smi_file, "-O" + outfile, *args],
+            "infiles": [smi_file],
+            "outfiles": [outfile],
+            "scratch_directory": scratch_directory,
+            "environment": env,
+        }
+        obabel_output = CmdComponent.compute(obabel_input)
+        os.remove(smi_file)
 
-        outputDict["center_x"] = (xmin + xmax) / 2.0
-        outputDict["size_x"] = xmax - xmin
+        ligands = [None] * len(smiles)
+        for title, pdbqt in split_titled(obabel_output.outfiles[outfile] or ""):
+            if title.isdigit() and int(title) < len(smiles):
+                ligands[int(title)] = pdbqt
 
-        outputDict["center_y"] = (ymin + ymax) / 2.0
-        outputDict["size_y"] = ymax - ymin
+        return ligands
 
-        outputDict["center_z"] = (zmin + zmax) / 2.0
-        outputDict["size_z"] = zmax - zmin
+    def check_computeparams(self, input_model: InputDock) -> Dict[str, Any]:
+        extras = self.extras or {}
+        outputDict = self.get_box(
+            input_model.molecule.receptor,
+            input_model.search_space,
+            input_model.search_space_units,
+            box=extras.get("box"),
+            ligand=input_model.molecule.ligand,
+        )
 
         outputDict["out"] = os.path.abspath("autodock.pdbqt")
         outputDict["log"] = os.path.abspath("autodock.log")
 
         return outputDict
+
+    def get_box(
+        self,
+        receptor: Molecule,
+        search_space: Optional[Tuple[float, ...]] = None,
+        search_space_units: Optional[str] = "angstrom",
+        box: Optional[Dict[str, Any]] = None,
+        ligand: Optional[Molecule] = None,
+    ) -> Dict[str, float]:
+        """
+        Returns the vina search box center and size. An explicit search space takes
+        precedence, otherwise the box is derived from the ``box`` specification (see
+        :func:`~mmic_autodock_vina.util.box.build_box`), defaulting to the receptor
+        extent. In the "ligand" mode, the reference ligand defaults to ``ligand`` if
+        it has 3D coordinates.
+        """
+        return self.get_boxes(
+            receptor, search_space, search_space_units, box=box, ligand=ligand
+        )[0]
+
+    def get_boxes(
+        self,
+        receptor: Molecule,
+        search_space: Optional[Tuple[float, ...]] = None,
+        search_space_units: Optional[str] = "angstrom",
+        box: Optional[Dict[str, Any]] = None,
+        ligand: Optional[Molecule] = None,
+    ) -> List[Dict[str, float]]:
+        """
+        Returns the vina search boxes, see :meth:`get_box` and
+        :func:`~mmic_autodock_vina.util.box.build_boxes`: several boxes, the top
+        k pockets, or tiles of a large box or search space.
+        """
+        box = dict(box or {})
+        if search_space:
+            space = Box.from_search_space(search_space, search_space_units)
+            box = {key: box[key] for key in ("tile", "overlap") if key in box}
+            box["boxes"] = [space]
+
+        if box.get("mode") == "ligand" and box.get("ligand") is None:
+            if ligand is not None and ligand.geometry is not None:
+                box["ligand"] = ligand
+
+        return [item.to_params() for item in build_boxes(receptor, **box)]
@@ -0,0 +1,605 @@
+# Import models
+from mmic_docking.models import InputDock, OutputDock
+from mmelemental.models import Molecule
+from mmic_autodock_vina.models import (
+    AutoDockComputeInput,
+    AutoDockComputeOutput,
+    AutoDockScreenInput,
+    AutoDockScreenOutput,
+)
+
+# Import components
+from mmic.components.blueprints import GenericComponent
+from mmic_autodock_vina.components.autodock_prep_component import AutoDockPrepComponent
+from mmic_autodock_vina.components.autodock_compute_component import (
+    AutoDockComputeComponent,
+)
+from mmic_autodock_vina.components.autodock_post_component import (
+    AutoDockPostComponent,
+    LazyDockOutput,
+)
+from mmic_autodock_vina.util.cache import get_cache
+from mmic_autodock_vina.util.scheduler import (
+    JobPlan,
+    heavy_atom_count,
+    pin_worker,
+    plan_jobs,
+)
+from cmselemental.util.decorators import classproperty
+
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+import collections
+import itertools
+import multiprocessing
+
+__all__ = ["AutoDockScreenComponent", "ScreenResult"]
+
+PLAN_SAMPLE_SIZE = 64  # ligands sampled to plan the cpu count per docking
+
+
+class ScreenResult(NamedTuple):
+    """Docking result of the ligand at position ``index`` in a screen."""
+
+    index: int
+    output: Optional[Union[OutputDock, LazyDockOutput]]
+    error: Optional[str] = None
+
+
+class WarmResult(NamedTuple):
+    """Compact docking result sent back by a warm worker: the raw poses and scores."""
+
+    system: str
+    scores: List[float]
+    rmsd_lb: Optional[List[float]] = None
+    rmsd_ub: Optional[List[float]] = None
+    extras: Optional[Dict[str, Any]] = None
+
+
+# Screen settings resident in a warm worker process, set once by its initializer
+_warm_state: Dict[str, Any] = {}
+
+
+def init_warm_worker(
+    state: Dict[str, Any], core_sets: Optional["multiprocessing.Queue"] = None
+):
+    """
+    Warm process pool initializer: keeps the screen component, settings, prepared
+    receptor, and search box parameters resident in the worker process, so each
+    task only carries a ligand. Pins the worker to a core set if ``core_sets`` is
+    given, see :func:`~mmic_autodock_vina.util.scheduler.pin_worker`.
+    """
+    if core_sets is not None:
+        pin_worker(core_sets)
+    _warm_state.update(state)
+
+
+def dock_warm(ligand: Molecule, ligand_pdbqt: str) -> WarmResult:
+    """Docks a prepared ligand in a warm worker against its resident receptor."""
+    output = _warm_state["component"].dock_compute(
+        ligand,
+        _warm_state["inputs"],
+        _warm_state["receptor_pdbqt"],
+        _warm_state["params"],
+        ligand_pdbqt,
+    )
+    return WarmResult(
+        output.system, output.scores, output.rmsd_lb, output.rmsd_ub, output.extras
+    )
+
+
+class AutoDockScreenComponent(GenericComponent):
+    """
+    Virtual screening component: docks many ligands against a single receptor. The
+    receptor is prepared once and the ligands are docked concurrently by a pool of
+    workers, bypassing the per-ligand model validation of the docking pipeline. The
+    available cores are split across concurrent vina jobs by :func:`plan_jobs`.
+    Ligand preparation is pipelined with docking: a separate pool prepares the
+    upcoming ligands while the prepared ones are docked.
+    """
+
+    @classproperty
+    def input(cls):
+        return AutoDockScreenInput
+
+    @classproperty
+    def output(cls):
+        return AutoDockScreenOutput
+
+    @classproperty
+    def version(cls):
+        return ""
+
+    def execute(
+        self,
+        inputs: AutoDockScreenInput,
+        extra_outfiles: Optional[List[str]] = None,
+        extra_commands: Optional[List[str]] = None,
+        scratch_name: Optional[str] = None,
+        timeout: Optional[int] = None,
+        config: Optional["TaskConfig"] = None,
+    ) -> Tuple[bool, AutoDockScreenOutput]:
+
+        if isinstance(inputs, dict):
+            inputs = self.input(**inputs)
+
+        outputs = [None] * len(inputs.ligands)
+        errors = {}
+
+        for result in self.iter_dock(inputs, config=config):
+            if isinstance(result.output, LazyDockOutput):
+                outputs[result.index] = result.output.to_output(
+                    inputs.materialize_top_k
+                )
+            elif result.error is None:
+                outputs[result.index] = result.output
+            else:
+                errors[result.index] = result.error
+
+        return True, AutoDockScreenOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=len(errors) < len(outputs) or not outputs,
+            proc_input=inputs,
+            outputs=outputs,
+            errors=errors or None,
+        )
+
+    @classmethod
+    def stream(
+        cls,
+        input_data: Union[AutoDockScreenInput, Dict[str, Any]],
+        ligands: Optional[Iterable[Union[str, Molecule]]] = None,
+        max_inflight: Optional[int] = None,
+        extras: Optional[Dict[str, Any]] = None,
+        sizes: Optional[Sequence[int]] = None,
+    ) -> Iterator[ScreenResult]:
+        """
+        Docks the ligands and yields each result as soon as its docking completes.
+
+        Parameters
+        ----------
+        input_data : AutoDockScreenInput or dict
+            Screening input.
+        ligands : Iterable[str or Molecule], optional
+            Ligands to dock in place of ``input_data.ligands``. The iterable is
+            consumed lazily, so large libraries need not be loaded in memory, by
+            a separate thread, so it may block e.g. on a queue of ligands produced
+            while the screen runs.
+        max_inflight : int, optional
+            Maximum number of ligands submitted for docking but not yet yielded.
+            Defaults to twice the number of concurrent dockings.
+        extras : dict, optional
+            Component extras e.g. cache settings.
+        sizes : Sequence[int], optional
+            Heavy atom counts of representative ligands, used to plan the CPUs
+            per docking instead of sampling the head of the library before the
+            first docking.
+
+        Returns
+        -------
+        Iterator[ScreenResult]
+            Docking results in completion order, tagged with the ligand position.
+        """
+        if isinstance(input_data, dict):
+            input_data = cls.input(**input_data)
+
+        program = cls(
+            name=cls.__name__,
+            scratch=False,
+            thread_safe=False,
+            thread_parallel=False,
+            node_parallel=False,
+            managed_memory=False,
+            extras=extras,
+        )
+        return program.iter_dock(
+            input_data, ligands=ligands, max_inflight=max_inflight, sizes=sizes
+        )
+
+    def iter_dock(
+        self,
+        inputs: AutoDockScreenInput,
+        ligands: Optional[Iterable[Union[str, Molecule]]] = None,
+        max_inflight: Optional[int] = None,
+        config: Optional["TaskConfig"] = None,
+        sizes: Optional[Sequence[int]] = None,
+    ) -> Iterator[ScreenResult]:
+        """Yields the docking result of each ligand in completion order."""
+        prep = self.subcomponent(AutoDockPrepComponent)
+        receptor_pdbqt = prep.receptor_prep(inputs.receptor, config=config)
+        params = self.build_params(inputs, prep)
+
+        # The receptor is split once, the flexible side-chains docked with every ligand
+        if inputs.flex_residues:
+            receptor_pdbqt, params["flex"] = prep.flex_prep(
+                receptor_pdbqt, inputs.flex_residues
+            )
+
+        # Affinity maps are computed before the workers start, which all read them
+        if (self.extras or {}).get("grid_maps"):
+            compute = self.subcomponent(AutoDockComputeComponent)
+            params["maps"] = compute.get_maps(receptor_pdbqt, params, config)
+
+        # Unless given, ligand sizes for the job plan are sampled from the head
+        # of the library
+        ligands = iter(inputs.ligands if ligands is None else ligands)
+        if sizes is None:
+            head = list(itertools.islice(ligands, PLAN_SAMPLE_SIZE))
+            sizes = [heavy_atom_count(ligand) for ligand in head]
+            ligands = itertools.chain(head, ligands)
+        plan = self.get_plan(inputs, sizes=sizes)
+        params["cpu"] = plan.cpu
+
+        ligands = enumerate(ligands)
+        settings = inputs.copy(update={"ligands": []})  # sent to every worker
+        warm = inputs.executor == "warm"
+        max_inflight = max_inflight or 2 * plan.njobs
+        prep_queue = inputs.prep_queue or 2 * plan.njobs
+        batch_size = inputs.prep_batch_size or 1
+
+        # Ligands are prepared by a thread pool (obabel runs in subprocesses)
+        # while the prepared ligands are docked, with at most prep_queue ligands
+        # prepared ahead of docking. With prep_batch_size, smiles are converted
+        # by batch tasks, each running a few obabel processes. Ligands are pulled
+        # from the library by a feeder thread, so a library that blocks (e.g. a
+        # queue filled while the screen runs) does not hold up the dispatch loop.
+        prep_pending, batch_pending, dock_pending = {}, {}, {}
+        prepared = collections.deque()
+        fetching, exhausted = None, False
+
+        feeder = ThreadPoolExecutor(max_workers=1)
+        prep_pool = ThreadPoolExecutor(
+            max_workers=inputs.prep_workers or max(1, plan.njobs // 4)
+        )
+        pool = self.get_executor(
+            plan,
+            inputs.executor,
+            state={
+                "component": self,
+                "inputs": settings,
+                "receptor_pdbqt": receptor_pdbqt,
+                "params": params,
+            },
+        )
+        try:
+            while True:
+                ahead = len(prep_pending) + len(prepared)
+                ahead += sum(len(batch) for batch in batch_pending.values())
+                # A batch larger than prep_queue is only taken when none is ahead
+                if fetching is None and not exhausted:
+                    if ahead + batch_size <= prep_queue or not ahead:
+                        fetching = feeder.submit(
+                            list, itertools.islice(ligands, batch_size)
+                        )
+
+                while prepared and len(dock_pending) < max_inflight:
+                    index, ligand, ligand_pdbqt = prepared.popleft()
+                    if warm:
+                        future = pool.submit(dock_warm, ligand, ligand_pdbqt)
+                    else:
+                        future = pool.submit(
+                            self.dock,
+                            ligand,
+                            settings,
+                            receptor_pdbqt,
+                            params,
+                            config,
+                            ligand_pdbqt,
+                        )
+                    dock_pending[future] = (index, ligand)
+
+                pending = [*prep_pending, *batch_pending, *dock_pending]
+                if fetching is not None:
+                    pending.append(fetching)
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future is fetching:
+                        fetching = None
+                        batch = future.result()
+                        exhausted = len(batch) < batch_size
+                        if not batch:
+                            continue
+                        elif inputs.prep_batch_size:
+                            prep_future = prep_pool.submit(
+                                self.prep_batch,
+                                [ligand for _, ligand in batch],
+                                plan.njobs,
+                                config,
+                            )
+                            batch_pending[prep_future] = [index for index, _ in batch]
+                        else:
+                            index, ligand = batch[0]
+                            prep_future = prep_pool.submit(
+                                self.prepare, ligand, None, config
+                            )
+                            prep_pending[prep_future] = index
+                        continue
+                    elif future in batch_pending:
+                        # Ligands the batch did not convert are prepared one by one
+                        indices = batch_pending.pop(future)
+                        for index, (ligand, ligand_pdbqt) in zip(
+                            indices, future.result()
+                        ):
+                            if ligand_pdbqt is None:
+                                prep_future = prep_pool.submit(
+                                    self.prepare, ligand, None, config
+                                )
+                                prep_pending[prep_future] = index
+                            else:
+                                prepared.append((index, ligand, ligand_pdbqt))
+                        continue
+                    elif future in prep_pending:
+                        index = prep_pending.pop(future)
+                        try:
+                            prepared.append((index, *future.result()))
+                            continue
+                        except Exception as err:
+                            result = ScreenResult(
+                                index, None, f"{type(err).__name__}: {err}"
+                            )
+                    else:
+                        index, ligand = dock_pending.pop(future)
+                        try:
+                            output = future.result()
+                            if warm:
+                                output = self.warm_output(ligand, settings, output)
+                            result = ScreenResult(index, output, None)
+                        except Exception as err:
+                            result = ScreenResult(
+                                index, None, f"{type(err).__name__}: {err}"
+                            )
+                    yield result
+        finally:
+            # The feeder may be blocked on the library, which it then abandons
+            feeder.shutdown(wait=False, cancel_futures=True)
+            prep_pool.shutdown(wait=True, cancel_futures=True)
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def prep_batch(
+        self,
+        ligands: List[Union[str, Molecule]],
+        nprocs: Optional[int] = 1,
+        config: Optional["TaskConfig"] = None,
+    ) -> List[Tuple[Union[str, Molecule], Optional[str]]]:
+        """
+        Prepares a batch of ligands, converting the smiles ligands with ``nprocs``
+        obabel processes, see :meth:`AutoDockPrepComponent.smiles_batch_prep`.
+        Returns each ligand with its pdbqt string, which is None for the ligands
+        to prepare one by one: 3D ligands, and ligands the batch did not convert
+        or if the batch conversion failed.
+        """
+        prep = self.subcomponent(AutoDockPrepComponent)
+        cache = get_cache("ligand", (self.extras or {}).get("ligand_cache"))
+
+        smiles = {}
+        for index, ligand in enumerate(ligands):
+            code = self.get_smiles(ligand)
+            if code:
+                smiles[index] = code
+
+        try:
+            pdbqts = prep.smiles_batch_prep(
+                list(smiles.values()), config=config, cache=cache, nprocs=nprocs
+            )
+        except Exception:
+            pdbqts = []
+        converted = dict(zip(smiles, pdbqts))
+
+        batch = []
+        for index, ligand in enumerate(ligands):
+            ligand_pdbqt = converted.get(index)
+            if ligand_pdbqt is not None:
+                try:
+                    ligand, ligand_pdbqt = self.prepare(ligand, ligand_pdbqt, config)
+                except Exception:
+                    ligand_pdbqt = None  # the error is reported by its own prep
+            batch.append((ligand, ligand_pdbqt))
+        return batch
+
+    # helper functions
+    def prepare(
+        self,
+        ligand: Union[str, Molecule],
+        ligand_pdbqt: Optional[str] = None,
+        config: Optional["TaskConfig"] = None,
+    ) -> Tuple[Molecule, str]:
+        """Returns the ligand molecule and its pdbqt string, prepared unless supplied."""
+        if isinstance(ligand, str):
+            ligand = Molecule.from_data(ligand, dtype="smiles")
+        if ligand_pdbqt is None:
+            prep = self.subcomponent(AutoDockPrepComponent)
+            ligand_pdbqt = prep.ligand_prep(ligand, config=config)
+        return ligand, ligand_pdbqt
+
+    def get_smiles(self, ligand: Union[str, Molecule]) -> Optional[str]:
+        """Returns the smiles code a ligand is prepared from, None for 3D ligands."""
+        if isinstance(ligand, str):
+            return ligand
+        if ligand.identifiers is not None:
+            return ligand.identifiers.smiles
+        return None
+
+    def subcomponent(self, comp: type, **extras: Any) -> GenericComponent:
+        """
+        Returns an instance of a pipeline component sharing this component's
+        settings, with additional ``extras`` (None values are ignored).
+        """
+        extras = {key: val for key, val in extras.items() if val is not None}
+        return comp(
+            name=comp.__name__,
+            scratch=self.scratch,
+            thread_safe=self.thread_safe,
+            thread_parallel=self.thread_parallel,
+            node_parallel=self.node_parallel,
+            managed_memory=self.managed_memory,
+            extras={**(self.extras or {}), **extras},
+        )
+
+    def build_params(
+        self, inputs: AutoDockScreenInput, prep: AutoDockPrepComponent
+    ) -> Dict[str, Any]:
+        """Returns the vina parameters shared by all ligands: search box and keywords."""
+        params = prep.get_box(
+            inputs.receptor,
+            inputs.search_space,
+            inputs.search_space_units,
+            box=inputs.box,
+        )
+        params.update(inputs.keywords or {})
+        return params
+
+    def get_plan(
+        self,
+        inputs: AutoDockScreenInput,
+        ligands: Optional[List[Union[str, Molecule]]] = None,
+        sizes: Optional[Sequence[int]] = None,
+    ) -> JobPlan:
+        """
+        Returns the number of concurrent dockings and CPUs per docking, planned
+        from the heavy atom counts ``sizes``, or else from the sizes of ``ligands``
+        (the input ligands by default).
+        """
+        keywords = inputs.keywords or {}
+        if sizes is None:
+            ligands = inputs.ligands if ligands is None else ligands
+            sizes = [heavy_atom_count(ligand) for ligand in ligands]
+        return plan_jobs(
+            sizes=sizes,
+            ncores=inputs.ncores,
+            cpu=keywords.get("cpu"),
+            njobs=inputs.nworkers,
+            exhaustiveness=keywords.get("exhaustiveness", 8),
+            affinity=inputs.affinity,
+        )
+
+    def get_executor(
+        self,
+        plan: JobPlan,
+        executor: Optional[str] = "thread",
+        state: Optional[Dict[str, Any]] = None,
+    ) -> Executor:
+        """
+        Returns a worker pool for the job plan, pinning process workers to cores if
+        requested. The workers of the "warm" pool keep the screen ``state`` (see
+        :func:`init_warm_worker`) resident for the whole screen.
+        """
+        if executor == "thread":
+            if plan.cores:
+                raise ValueError(
+                    "CPU affinity requires the 'process' or 'warm' executor."
+                )
+            return ThreadPoolExecutor(max_workers=plan.njobs)
+        elif executor in ("process", "warm"):
+            core_sets = None
+            if plan.cores:
+                core_sets = multiprocessing.Queue()
+                for cores in plan.cores:
+                    core_sets.put(cores)
+            if executor == "warm":
+                initializer, initargs = init_warm_worker, (state or {}, core_sets)
+            elif core_sets is not None:
+                initializer, initargs = pin_worker, (core_sets,)
+            else:
+                initializer, initargs = None, ()
+            return ProcessPoolExecutor(
+                max_workers=plan.njobs, initializer=initializer, initargs=initargs
+            )
+        raise ValueError(
+            f"Executor {executor} not supported. Use 'thread', 'process', or 'warm'."
+        )
+
+    def dock(
+        self,
+        ligand: Union[str, Molecule],
+        inputs: AutoDockScreenInput,
+        receptor_pdbqt: str,
+        params: Dict[str, Any],
+        config: Optional["TaskConfig"] = None,
+        ligand_pdbqt: Optional[str] = None,
+    ) -> Union[OutputDock, LazyDockOutput]:
+        """
+        Prepares (unless ``ligand_pdbqt`` is supplied) and docks a single ligand
+        against the prepared receptor. The ligands in ``inputs`` are ignored.
+        """
+        ligand, ligand_pdbqt = self.prepare(ligand, ligand_pdbqt, config)
+        compute_output = self.dock_compute(
+            ligand, inputs, receptor_pdbqt, params, ligand_pdbqt
+        )
+        return self.postprocess(compute_output, inputs)
+
+    def dock_input(self, ligand: Molecule, inputs: AutoDockScreenInput) -> InputDock:
+        """Returns the docking input of a ligand against the screen receptor."""
+        return InputDock(
+            schema_name="mmschema",
+            schema_version=1,
+            molecule={"ligand": ligand, "receptor": inputs.receptor},
+            search_space=inputs.search_space,
+            search_space_units=inputs.search_space_units,
+        )
+
+    def dock_compute(
+        self,
+        ligand: Molecule,
+        inputs: AutoDockScreenInput,
+        receptor_pdbqt: str,
+        params: Dict[str, Any],
+        ligand_pdbqt: str,
+    ) -> AutoDockComputeOutput:
+        """Docks a prepared ligand against the prepared receptor."""
+        compute = self.subcomponent(AutoDockComputeComponent)
+        compute_input = AutoDockComputeInput(
+            proc_input=self.dock_input(ligand, inputs),
+            ligand=ligand_pdbqt,
+            receptor=receptor_pdbqt,
+            **params,
+        )
+
+        _, compute_output = compute.execute(compute_input)
+        return compute_output
+
+    def postprocess(
+        self, compute_output: AutoDockComputeOutput, inputs: AutoDockScreenInput
+    ) -> Union[OutputDock, LazyDockOutput]:
+        """Returns the lazy or full docking output of a docked ligand."""
+        post = self.subcomponent(
+            AutoDockPostComponent, materialize_top_k=inputs.materialize_top_k
+        )
+        if inputs.lazy:
+            return post.lazy_output(compute_output)
+
+        _, dock_output = post.execute(compute_output)
+        return dock_output
+
+    def warm_output(
+        self, ligand: Molecule, inputs: AutoDockScreenInput, result: "WarmResult"
+    ) -> Union[OutputDock, LazyDockOutput]:
+        """Returns the docking output of the compact result of a warm worker."""
+        compute_output = AutoDockComputeOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=True,
+            proc_input=self.dock_input(ligand, inputs),
+            **result._asdict(),
+        )
+        return self.postprocess(compute_output, inputs)
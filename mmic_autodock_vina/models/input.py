@@ -1,9 +1,17 @@
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from mmelemental.models.base import ProtoModel
+from mmelemental.models import Molecule
+from mmelemental.util.units import LENGTH_DIM
 from mmic_docking.models import InputDock
 from pydantic import Field
 
-__all__ = ["AutoDockComputeInput"]
+__all__ = [
+    "AutoDockCampaignInput",
+    "AutoDockComputeInput",
+    "AutoDockFunnelInput",
+    "AutoDockFunnelStage",
+    "AutoDockScreenInput",
+]
 
 
 class AutoDockComputeInput(ProtoModel):
@@ -11,6 +19,11 @@ class AutoDockComputeInput(ProtoModel):
     ligand: str = Field(..., description="Ligand file str.")
     receptor: str = Field(..., description="Receptor file str.")
     flex: Optional[str] = Field(None, description="Flexible side chains file str.")
+    maps: Optional[str] = Field(
+        None,
+        description="Path prefix of precomputed affinity maps, docked against instead of "
+        "the receptor. The maps define the search box.",
+    )
     cpu: Optional[int] = Field(
         1,
         description="The number of CPUs to use. The default is to try to "
@@ -49,3 +62,149 @@ class AutoDockComputeInput(ProtoModel):
         description="Maximum energy difference between the best binding mode "
         "and the worst one displayed (kcal/mol).",
     )
+
+
+class AutoDockScreenInput(ProtoModel):
+    receptor: Molecule = Field(
+        ..., description="Receptor molecule shared by all ligands."
+    )
+    ligands: List[Union[str, Molecule]] = Field(
+        ...,
+        description="Ligand molecules or smiles codes to dock against the receptor.",
+    )
+    search_space: Optional[Tuple[float, float, float, float, float, float]] = Field(
+        None,
+        description="Search space box (xmin, xmax, ymin, ymax, zmin, zmax). Defaults to the receptor extent.",
+    )
+    search_space_units: Optional[str] = Field(
+        "angstrom",
+        description="Units of the search space box.",
+        dimensionality=LENGTH_DIM,
+    )
+    box: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Search box specification used when no search space is given e.g. "
+        '{"mode": "sites", "sites": "sites.pdb", "site_names": ["S1"], "padding": 8.0}. '
+        "Modes: receptor (default), ligand (around a reference ligand), residues, sites, pocket. "
+        "See :func:`mmic_autodock_vina.util.box.build_box`.",
+    )
+    flex_residues: Optional[List[Union[int, str, Tuple[str, int]]]] = Field(
+        None,
+        description='Receptor residues with flexible side-chains e.g. ["B:MET225", ("TYR", 301)]. '
+        "The receptor is split into rigid and flexible parts once and shared by all ligands. "
+        "See :func:`mmic_autodock_vina.util.pdbqt.split_flex`.",
+    )
+    keywords: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Vina parameters applied to every ligand e.g. exhaustiveness, num_modes, seed. "
+        "See :class:`AutoDockComputeInput` for the supported parameters.",
+    )
+    nworkers: Optional[int] = Field(
+        None,
+        description="Number of ligands docked concurrently. The default is the number of cores "
+        "divided by the number of CPUs used per docking.",
+    )
+    ncores: Optional[int] = Field(
+        None,
+        description="Total number of cores used by the screen. Defaults to all available cores. "
+        "Unless the cpu keyword is set, the number of CPUs per docking is chosen from the ligand sizes.",
+    )
+    executor: Optional[str] = Field(
+        "thread",
+        description="Worker pool type: 'thread', 'process', or 'warm'. Warm worker processes keep "
+        "the prepared receptor and settings resident and send back compact results.",
+    )
+    affinity: Optional[bool] = Field(
+        False,
+        description="Pins each worker to a disjoint set of cores. Requires the 'process' or 'warm' executor.",
+    )
+    lazy: Optional[bool] = Field(
+        False,
+        description="If True, streamed results hold the scores and raw poses, which are parsed into "
+        "molecules on first access.",
+    )
+    materialize_top_k: Optional[int] = Field(
+        None,
+        description="Maximum number of poses per ligand parsed into molecules in the docking output.",
+    )
+    prep_workers: Optional[int] = Field(
+        None,
+        description="Number of ligands prepared (converted to pdbqt) concurrently with the dockings. "
+        "Defaults to a quarter of the number of concurrent dockings.",
+    )
+    prep_queue: Optional[int] = Field(
+        None,
+        description="Maximum number of ligands prepared ahead of docking, including the ligands of pending "
+        "prep batches. Defaults to twice the number of concurrent dockings.",
+    )
+    prep_batch_size: Optional[int] = Field(
+        None,
+        description="If set, smiles ligands are converted to 3D ahead of docking in batches of this size, "
+        "each batch split across a few obabel processes instead of one process per ligand.",
+    )
+
+
+class AutoDockCampaignInput(AutoDockScreenInput):
+    journal: str = Field(
+        ...,
+        description="Path of the append-only journal recording the status and result of each ligand. "
+        "Ligands completed in an existing journal are skipped.",
+    )
+    max_retries: Optional[int] = Field(
+        2, description="Number of times a failed ligand is retried."
+    )
+    backoff: Optional[float] = Field(
+        1.0,
+        description="Delay (seconds) before retrying failed ligands, doubled after each retry round.",
+    )
+
+
+class AutoDockFunnelStage(ProtoModel):
+    keywords: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Vina parameters of the stage, applied over the screen keywords e.g. "
+        '{"exhaustiveness": 1, "num_modes": 1} for a fast first pass.',
+    )
+    keep: Optional[float] = Field(
+        None,
+        description="Fraction (0-1] of the ligands docked in the previous stage promoted to this stage, "
+        "best scores first. Ignored for the first stage.",
+    )
+    threshold: Optional[float] = Field(
+        None,
+        description="Only ligands scoring at or below this affinity (kcal/mol) in the previous stage "
+        "are promoted to this stage. Ignored for the first stage.",
+    )
+    nworkers: Optional[int] = Field(
+        None,
+        description="Number of ligands docked concurrently in this stage. Defaults to the screen nworkers.",
+    )
+    ncores: Optional[int] = Field(
+        None,
+        description="Number of cores used by this stage. The stages run concurrently, and default to an "
+        "equal share of the screen cores.",
+    )
+    flex_residues: Optional[List[Union[int, str, Tuple[str, int]]]] = Field(
+        None,
+        description="Receptor residues with flexible side-chains in this stage, see "
+        ":attr:`AutoDockScreenInput.flex_residues`. Defaults to the screen flex_residues, an empty "
+        "list docks against the rigid receptor.",
+    )
+    extras: Optional[Dict[str, Any]] = Field(
+        None,
+        description="Component extras of this stage e.g. adaptive exhaustiveness settings.",
+    )
+
+
+class AutoDockFunnelInput(AutoDockScreenInput):
+    stages: List[AutoDockFunnelStage] = Field(
+        ...,
+        description="Docking stages. The first stage docks all the ligands, each following stage re-docks "
+        "the best ligands of the previous one. Stages run concurrently: ligands are promoted as soon "
+        "as their score beats the running cutoff of the previous stage.",
+    )
+    warmup: Optional[int] = Field(
+        32,
+        description="Number of ligands scored in a stage before ligands are promoted from it while it runs. "
+        "The remaining top ligands are promoted when the stage completes.",
+    )
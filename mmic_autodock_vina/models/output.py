@@ -1,9 +1,15 @@
-from typing import List, Optional
-from mmic_docking.models import InputDock
+from typing import Dict, List, Optional
+from mmic_docking.models import InputDock, OutputDock
 from cmselemental.models import OutputProc
 from pydantic import Field
+from .input import AutoDockCampaignInput, AutoDockFunnelInput, AutoDockScreenInput
 
-__all__ = ["AutoDockComputeOutput"]
+__all__ = [
+    "AutoDockCampaignOutput",
+    "AutoDockComputeOutput",
+    "AutoDockFunnelOutput",
+    "AutoDockScreenOutput",
+]
 
 
 class AutoDockComputeOutput(OutputProc):
@@ -12,6 +18,14 @@ class AutoDockComputeOutput(OutputProc):
         None,
         description="A metric for evaluating a particular pose. Length of scores must be equal to length of poses.",
     )
+    rmsd_lb: Optional[List[float]] = Field(
+        None,
+        description="RMSD lower bound of each pose from the best pose, in angstrom.",
+    )
+    rmsd_ub: Optional[List[float]] = Field(
+        None,
+        description="RMSD upper bound of each pose from the best pose, in angstrom.",
+    )
     poses: Optional[List[str]] = Field(
         None,
         description="List of file strings defining the conformation and orientation of the candidate ligand relative to the receptor.",
@@ -25,3 +39,52 @@ class AutoDockComputeOutput(OutputProc):
         None,
         description="Input file string storing the ligand poses with (optionally) the flexible receptor side-chains.",
     )
+
+
+class AutoDockScreenOutput(OutputProc):
+    proc_input: AutoDockScreenInput = Field(..., description="Screening input model.")
+    outputs: List[Optional[OutputDock]] = Field(
+        ...,
+        description="Docking output for each ligand, in the order of the input ligands. "
+        "Failed dockings are set to None.",
+    )
+    errors: Optional[Dict[int, str]] = Field(
+        None,
+        description="Error messages of the failed dockings, indexed by ligand position.",
+    )
+
+
+class AutoDockCampaignOutput(OutputProc):
+    proc_input: AutoDockCampaignInput = Field(..., description="Campaign input model.")
+    scores: List[Optional[float]] = Field(
+        ...,
+        description="Best score (kcal/mol) of each ligand, in the order of the input ligands. "
+        "Failed dockings are set to None. The poses are stored in the journal.",
+    )
+    errors: Optional[Dict[int, str]] = Field(
+        None,
+        description="Error messages of the ligands that failed after all retries, indexed by ligand position.",
+    )
+
+
+class AutoDockFunnelOutput(OutputProc):
+    proc_input: AutoDockFunnelInput = Field(..., description="Funnel input model.")
+    scores: List[Optional[float]] = Field(
+        ...,
+        description="Best score (kcal/mol) of each ligand in the last stage it was docked in, in the order "
+        "of the input ligands. Failed dockings are set to None.",
+    )
+    stage_scores: List[List[Optional[float]]] = Field(
+        ...,
+        description="Best score (kcal/mol) of each ligand in each stage. Ligands not docked in a stage "
+        "are set to None.",
+    )
+    outputs: List[Optional[OutputDock]] = Field(
+        ...,
+        description="Docking output of each ligand in the last stage, in the order of the input ligands. "
+        "Ligands not promoted to the last stage are set to None.",
+    )
+    errors: Optional[Dict[int, str]] = Field(
+        None,
+        description="Error messages of the failed dockings, indexed by ligand position.",
+    )
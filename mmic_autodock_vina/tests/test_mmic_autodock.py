@@ -57,3 +57,494 @@ def test_mmic_autodock_vina_run(ligand, dtype):
     assert len(scores) == len(ligands)
     assert isinstance(scores, list)
     # add more assertions here
+
+
+def test_mmic_autodock_vina_flex():
+    """Test docking with flexible receptor side-chains."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligand = Molecule.from_data("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "smiles")
+
+    dockInput = InputDock(
+        schema_name="mmschema",
+        schema_version=1,
+        molecule={"ligand": ligand, "receptor": receptor},
+        search_space=(-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        search_space_units="angstrom",
+    )
+
+    from mmic_autodock_vina.components.autodock_component import AutoDockComponent
+
+    dockOutput = AutoDockComponent.compute(
+        dockInput, extras={"flex_residues": [("PHE", 1414), "ILE1418"]}
+    )
+
+    scores, ligands, flex = (
+        dockOutput.scores,
+        dockOutput.poses.ligand,
+        dockOutput.poses.receptor,
+    )
+    assert 0 < len(scores) == len(ligands)
+    assert flex is not None and len(flex) == len(ligands)
+
+
+@pytest.mark.parametrize(
+    "box,nboxes",
+    [
+        ({"mode": "pocket", "top_k": 2}, 2),
+        (
+            {
+                "boxes": [(-37.807, 5.045, -2.001, 30.131, -19.633, 37.987)],
+                "tile": 36.0,
+            },
+            4,
+        ),
+    ],
+)
+def test_mmic_autodock_vina_boxes(box, nboxes, monkeypatch):
+    """Test docking into several boxes concurrently and merging the poses."""
+    from mmic_autodock_vina.components.autodock_component import AutoDockComponent
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+    from mmic_autodock_vina.util import available_cores
+
+    cpus = []
+    run = AutoDockComputeComponent.run
+
+    def run_spy(self, inputs, *args, **kwargs):
+        cpus.append(inputs.cpu)
+        return run(self, inputs, *args, **kwargs)
+
+    monkeypatch.setattr(AutoDockComputeComponent, "run", run_spy)
+
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligand = Molecule.from_data("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "smiles")
+    dockInput = InputDock(
+        schema_name="mmschema",
+        schema_version=1,
+        molecule={"ligand": ligand, "receptor": receptor},
+    )
+
+    dockOutput = AutoDockComponent.compute(dockInput, extras={"box": box})
+
+    # the cores are split between the boxes
+    assert len(cpus) >= nboxes
+    assert set(cpus) == {max(1, len(available_cores()) // len(cpus))}
+    assert 0 < len(dockOutput.scores) <= 9
+    assert dockOutput.scores == sorted(dockOutput.scores)
+    assert len(dockOutput.scores) == len(dockOutput.poses.ligand)
+
+
+def test_mmic_autodock_vina_result_cache(tmp_path, monkeypatch):
+    """Test reusing the cached results of seeded dockings."""
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+    from mmic_autodock_vina.models import AutoDockComputeInput, AutoDockComputeOutput
+
+    runs = []
+
+    def run_subprocess(self, inputs, config=None):
+        runs.append(inputs)
+        return AutoDockComputeOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=True,
+            stdout="",
+            scores=[-float(len(runs))],
+            proc_input=inputs.proc_input,
+        )
+
+    monkeypatch.setattr(AutoDockComputeComponent, "run_subprocess", run_subprocess)
+
+    ligand = Molecule.from_file(mols["ibu.pdb"])
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    computeInput = AutoDockComputeInput(
+        proc_input=InputDock(
+            schema_name="mmschema",
+            schema_version=1,
+            molecule={"ligand": ligand, "receptor": receptor},
+        ),
+        ligand="ligand",
+        receptor="receptor",
+        seed=1,
+        center_x=0.0,
+        center_y=0.0,
+        center_z=0.0,
+        size_x=20.0,
+        size_y=20.0,
+        size_z=20.0,
+    )
+    extras = {"result_cache": str(tmp_path)}
+
+    def dock(computeInput, extras=extras):
+        return AutoDockComputeComponent.compute(computeInput, extras=extras)
+
+    # hit: the fingerprint excludes the number of CPUs
+    first = dock(computeInput)
+    cached = dock(computeInput.copy(update={"cpu": 4}))
+    assert len(runs) == 1 and cached.extras == {"cached": True}
+    assert cached.scores == first.scores
+
+    # miss: a field of the fingerprint changed
+    assert dock(computeInput.copy(update={"exhaustiveness": 16})).scores == [-2.0]
+
+    # bypass, and unseeded runs are never cached
+    assert dock(computeInput, extras={"result_cache": False}).scores == [-3.0]
+    for _ in range(2):
+        dock(computeInput.copy(update={"seed": None}))
+    assert len(runs) == 5
+
+
+def test_mmic_autodock_vina_grid_maps(tmp_path, monkeypatch):
+    """Test writing the affinity maps once and docking every ligand against them."""
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+    from mmic_autodock_vina.models import AutoDockComputeInput, AutoDockComputeOutput
+    from mmic_cmd.components import CmdComponent
+    from concurrent.futures import ThreadPoolExecutor
+    import os
+    import time
+
+    writes, maps = [], []
+
+    def write_maps(inputs):
+        command = inputs["command"]
+        prefix = command[command.index("--write_maps") + 1]
+        writes.append(prefix)
+        time.sleep(0.1)  # concurrent runs wait for the maps instead of rewriting them
+        for adtype in ("C", "OA"):
+            with open(f"{prefix}.{adtype}.map", "w") as fp:
+                fp.write(f"{adtype} {len(writes)}\n")
+
+    def run_subprocess(self, inputs, config=None):
+        maps.append(inputs.maps)
+        return AutoDockComputeOutput(
+            schema_name="mmschema",
+            schema_version=1,
+            success=True,
+            stdout="",
+            scores=[-1.0],
+            proc_input=inputs.proc_input,
+        )
+
+    monkeypatch.setattr(CmdComponent, "compute", write_maps)
+    monkeypatch.setattr(AutoDockComputeComponent, "run_subprocess", run_subprocess)
+
+    ligand = Molecule.from_file(mols["ibu.pdb"])
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    computeInput = AutoDockComputeInput(
+        proc_input=InputDock(
+            schema_name="mmschema",
+            schema_version=1,
+            molecule={"ligand": ligand, "receptor": receptor},
+        ),
+        ligand="ligand",
+        receptor="receptor",
+        center_x=0.0,
+        center_y=0.0,
+        center_z=0.0,
+        size_x=20.0,
+        size_y=20.0,
+        size_z=20.0,
+    )
+    extras = {"grid_maps": str(tmp_path), "result_cache": False}
+
+    def dock(computeInput):
+        return AutoDockComputeComponent.compute(computeInput, extras=extras)
+
+    # concurrent dockings of several ligands share the maps written once
+    ligands = [computeInput.copy(update={"ligand": f"ligand{i}"}) for i in range(4)]
+    with ThreadPoolExecutor(max_workers=len(ligands)) as executor:
+        list(executor.map(dock, ligands))
+    assert len(writes) == 1 and len(maps) == len(ligands)
+    assert len(set(maps)) == 1 and maps[0].startswith(str(tmp_path))
+    with open(f"{maps[0]}.OA.map") as fp:
+        assert fp.read() == "OA 1\n"
+
+    # later runs reuse the cached maps, another box has its own
+    dock(computeInput)
+    assert len(writes) == 1 and maps[-1] == maps[0]
+    dock(computeInput.copy(update={"size_x": 24.0}))
+    assert len(writes) == 2 and maps[-1] != maps[0]
+
+    # the maps are rewritten if one of them was evicted
+    os.remove(f"{maps[0]}.C.map")
+    dock(computeInput)
+    assert len(writes) == 3 and os.path.exists(f"{maps[0]}.C.map")
+
+
+@pytest.mark.parametrize("executor", ["thread", "warm"])
+def test_mmic_autodock_vina_screen(executor):
+    """Test docking several ligands against one receptor."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligands = ["CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", Molecule.from_file(mols["ibu.pdb"])]
+
+    screenInput = {
+        "receptor": receptor,
+        "ligands": ligands,
+        "search_space": (-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        "search_space_units": "angstrom",
+        "keywords": {"exhaustiveness": 2},
+        "executor": executor,
+    }
+
+    from mmic_autodock_vina.components import AutoDockScreenComponent
+
+    screenOutput = AutoDockScreenComponent.compute(screenInput)
+
+    assert len(screenOutput.outputs) == len(ligands)
+    assert screenOutput.errors is None
+    for dockOutput in screenOutput.outputs:
+        assert len(dockOutput.scores) == len(dockOutput.poses.ligand)
+
+
+def test_mmic_autodock_vina_stream():
+    """Test streaming docking results from a ligand generator."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    smiles = ["BrC1=CC(CO)=NC=C1", "BrC1=CC(COC)=NC=C1", "BrC1=CC(O)=C(C(O)=O)C=C1"]
+
+    screenInput = {
+        "receptor": receptor,
+        "ligands": [],
+        "search_space": (-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        "keywords": {"exhaustiveness": 1, "num_modes": 1},
+    }
+
+    from mmic_autodock_vina.components import AutoDockScreenComponent
+
+    results = list(
+        AutoDockScreenComponent.stream(
+            screenInput, ligands=(code for code in smiles), max_inflight=2
+        )
+    )
+
+    assert sorted(result.index for result in results) == list(range(len(smiles)))
+    assert all(result.error is None for result in results)
+
+
+def test_mmic_autodock_vina_batch_prep():
+    """Test preparing several smiles codes in one obabel process."""
+    from mmic_autodock_vina.components.autodock_prep_component import (
+        AutoDockPrepComponent,
+    )
+
+    smiles = ["BrC1=CC(CO)=NC=C1", "not a smiles", "BrC1=CC(COC)=NC=C1"]
+    prep = AutoDockPrepComponent(
+        name="AutoDockPrepComponent",
+        scratch=False,
+        thread_safe=False,
+        thread_parallel=False,
+        node_parallel=False,
+        managed_memory=False,
+    )
+    ligands = prep.smiles_batch_prep(smiles, nprocs=2)
+
+    assert len(ligands) == len(smiles)
+    assert ligands[1] is None
+    assert "Br" in ligands[0] and "Br" in ligands[2]
+
+
+def test_mmic_autodock_vina_batch_prep_fallback(monkeypatch):
+    """Test preparing ligands one by one when their batch conversion fails."""
+    from mmic_autodock_vina.components import AutoDockScreenComponent
+    from mmic_autodock_vina.components.autodock_prep_component import (
+        AutoDockPrepComponent,
+    )
+
+    def smiles_batch_prep(self, smiles, config=None, cache=None, nprocs=1):
+        raise RuntimeError("obabel crashed")
+
+    monkeypatch.setattr(AutoDockPrepComponent, "smiles_batch_prep", smiles_batch_prep)
+
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    smiles = ["BrC1=CC(CO)=NC=C1", "BrC1=CC(COC)=NC=C1", "BrC1=CC(O)=C(C(O)=O)C=C1"]
+    screenInput = {
+        "receptor": receptor,
+        "ligands": smiles,
+        "search_space": (-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        "keywords": {"exhaustiveness": 1, "num_modes": 1},
+        "prep_batch_size": 2,
+    }
+
+    screenOutput = AutoDockScreenComponent.compute(screenInput)
+
+    assert screenOutput.errors is None
+    assert all(dockOutput.scores for dockOutput in screenOutput.outputs)
+
+
+def test_mmic_autodock_vina_campaign(tmp_path):
+    """Test resuming a screening campaign from its journal."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    smiles = ["BrC1=CC(CO)=NC=C1", "BrC1=CC(COC)=NC=C1"]
+
+    campaignInput = {
+        "receptor": receptor,
+        "ligands": smiles[:1],
+        "search_space": (-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        "keywords": {"exhaustiveness": 1, "num_modes": 1},
+        "journal": str(tmp_path / "campaign.jsonl"),
+    }
+
+    from mmic_autodock_vina.components import AutoDockCampaignComponent
+    from mmic_autodock_vina.util import Journal
+
+    campaignOutput = AutoDockCampaignComponent.compute(campaignInput)
+    assert campaignOutput.errors is None
+
+    # Only the new ligand is docked on resume
+    campaignInput["ligands"] = smiles
+    campaignOutput = AutoDockCampaignComponent.compute(campaignInput)
+
+    assert len(campaignOutput.scores) == len(smiles)
+    assert len(list(Journal(campaignInput["journal"]).records())) == len(smiles)
+
+
+def test_mmic_autodock_vina_adaptive():
+    """Test docking with adaptive exhaustiveness."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligand = Molecule.from_data("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "smiles")
+
+    dockInput = InputDock(
+        schema_name="mmschema",
+        schema_version=1,
+        molecule={"ligand": ligand, "receptor": receptor},
+        search_space=(-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        search_space_units="angstrom",
+    )
+
+    from mmic_autodock_vina.components.autodock_prep_component import (
+        AutoDockPrepComponent,
+    )
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+
+    computeInput = AutoDockPrepComponent.compute(dockInput)
+    computeOutput = AutoDockComputeComponent.compute(
+        computeInput,
+        extras={"adaptive": {"exhaustiveness": 1, "seeds": 2}, "result_cache": False},
+    )
+
+    adaptive = computeOutput.extras["adaptive"]
+    assert 1 <= adaptive["exhaustiveness"] <= computeInput.exhaustiveness
+    assert adaptive["runs"] % 2 == 0
+    assert computeOutput.scores == sorted(computeOutput.scores)
+
+
+def test_mmic_autodock_vina_replicas():
+    """Test the consensus of replica dockings with different seeds."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligand = Molecule.from_data("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "smiles")
+
+    dockInput = InputDock(
+        schema_name="mmschema",
+        schema_version=1,
+        molecule={"ligand": ligand, "receptor": receptor},
+        search_space=(-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        search_space_units="angstrom",
+    )
+
+    from mmic_autodock_vina.components.autodock_prep_component import (
+        AutoDockPrepComponent,
+    )
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+
+    computeInput = AutoDockPrepComponent.compute(dockInput)
+    computeOutput = AutoDockComputeComponent.compute(
+        computeInput,
+        extras={"replicas": {"seeds": 2, "exhaustiveness": 1}, "result_cache": False},
+    )
+
+    replicas = computeOutput.extras["replicas"]
+    scores, support = computeOutput.scores, replicas["support"]
+    assert len(set(replicas["seeds"])) == 2
+    assert 0 < len(scores) <= computeInput.num_modes
+    assert len(scores) == len(support) == len(replicas["std"])
+    assert len(scores) == computeOutput.system.count("ENDMDL")
+    assert all(1 <= count <= 2 for count in support)
+    # clusters found by more replicas rank first, then by mean score
+    ranks = list(zip([-count for count in support], scores))
+    assert ranks == sorted(ranks)
+
+
+def test_mmic_autodock_vina_funnel():
+    """Test a two-stage screening funnel."""
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligands = ["CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "c1ccccc1O", "CC(=O)Nc1ccc(O)cc1"]
+
+    funnelInput = {
+        "receptor": receptor,
+        "ligands": ligands,
+        "search_space": (-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        "search_space_units": "angstrom",
+        "stages": [
+            {"keywords": {"exhaustiveness": 1, "num_modes": 1}},
+            {"keywords": {"exhaustiveness": 2}, "keep": 0.3},
+        ],
+    }
+
+    from mmic_autodock_vina.components import AutoDockFunnelComponent
+
+    funnelOutput = AutoDockFunnelComponent.compute(funnelInput)
+
+    first, second = funnelOutput.stage_scores
+    assert all(score is not None for score in first)
+    best = min(range(len(ligands)), key=first.__getitem__)
+    assert second[best] is not None and funnelOutput.outputs[best] is not None
+    assert funnelOutput.errors is None
+
+
+def test_mmic_autodock_vina_bindings(monkeypatch):
+    """Test docking in-process with the vina Python bindings."""
+    pytest.importorskip("vina")
+    receptor = Molecule.from_file(mols["PHIPA_C2_apo.pdb"])
+    ligand = Molecule.from_data("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", "smiles")
+
+    dockInput = InputDock(
+        schema_name="mmschema",
+        schema_version=1,
+        molecule={"ligand": ligand, "receptor": receptor},
+        search_space=(-37.807, 5.045, -2.001, 30.131, -19.633, 37.987),
+        search_space_units="angstrom",
+    )
+
+    from mmic_autodock_vina.components.autodock_prep_component import (
+        AutoDockPrepComponent,
+    )
+    from mmic_autodock_vina.components.autodock_compute_component import (
+        AutoDockComputeComponent,
+    )
+    from mmic_autodock_vina.util import engine
+    from mmic_autodock_vina.util.engine import VinaEngine
+
+    # start without the engines loaded in this thread by earlier tests
+    monkeypatch.delattr(engine._engines, "cache", raising=False)
+
+    engines = []
+    init = VinaEngine.__init__
+
+    def init_spy(self, *args, **kwargs):
+        engines.append(self)
+        init(self, *args, **kwargs)
+
+    monkeypatch.setattr(VinaEngine, "__init__", init_spy)
+
+    computeInput = AutoDockPrepComponent.compute(dockInput)
+    extras = {"engine": "bindings", "result_cache": False}
+
+    # the second run reuses the receptor and grid of the first
+    for _ in range(2):
+        computeOutput = AutoDockComputeComponent.compute(computeInput, extras=extras)
+        assert len(computeOutput.scores) == computeOutput.system.count("ENDMDL")
+        assert computeOutput.scores == sorted(computeOutput.scores)
+        assert computeOutput.rmsd_lb[0] == 0.0
+    assert len(engines) == 1
+
+    # another box loads another engine
+    box = computeInput.copy(update={"size_x": computeInput.size_x + 2.0})
+    AutoDockComputeComponent.compute(box, extras=extras)
+    assert len(engines) == 2
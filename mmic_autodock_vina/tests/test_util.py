@@ -0,0 +1,466 @@
+"""
+Unit tests for the mmic_autodock_vina utilities.
+"""
+
+from mmelemental.models import Molecule
+from mmic_autodock_vina.util import (
+    Box,
+    FileCache,
+    Journal,
+    LazyPose,
+    ScratchDir,
+    VinaScores,
+    available_cores,
+    build_box,
+    consensus_poses,
+    find_pockets,
+    get_scores,
+    hash_smiles,
+    hash_text,
+    heavy_atom_count,
+    merge_poses,
+    parse_scores,
+    plan_jobs,
+    read_sites,
+    read_pdbqt,
+    select_residues,
+    split_flex,
+    split_poses,
+    split_titled,
+    tile_boxes,
+    write_pdbqt,
+)
+from mmic_autodock_vina.util import scratch as scratch_module
+import numpy
+import os
+import pytest
+import tempfile
+import time
+
+data_dir = os.path.join(os.path.dirname(__file__), "..", "data", "autodock_test")
+
+pdbqt_ligand = """REMARK VINA RESULT:     -11.2      0.000      0.000
+ROOT
+ATOM      1  C   UNL     1      12.740  93.279  64.324  0.00  0.00    +0.048 A
+ENDROOT
+TORSDOF 0
+"""
+pdbqt_flex = """BEGIN_RES MET B 225
+ROOT
+ATOM      1  C   UNL     1       7.641 114.206  73.505  0.00  0.00    +0.013 C
+ENDROOT
+END_RES MET B 225
+"""
+vina_stdout = """Performing docking (random seed: 1) ... done.
+
+mode |   affinity | dist from best mode
+     | (kcal/mol) | rmsd l.b.| rmsd u.b.
+-----+------------+----------+----------
+   1       -11.2          0          0
+   2       -10.85     1.842      2.501
+Writing output ... done.
+"""
+
+
+def test_file_cache(tmp_path):
+    """Test cache hits, misses, and LRU eviction."""
+    cache = FileCache(str(tmp_path), max_size=None, max_entries=2)
+    keys = [hash_text("receptor", i) for i in range(3)]
+
+    assert cache.get(keys[0]) is None
+
+    cache.put(keys[0], "ATOM 0")
+    cache.put(keys[1], "ATOM 1")
+    assert cache.get(keys[0]) == "ATOM 0"
+
+    # keys[1] is now the least recently used entry
+    fname = cache._fname(keys[1])
+    os.utime(fname, (0, 0))
+    cache.put(keys[2], "ATOM 2")
+
+    assert keys[1] not in cache
+    assert cache.get(keys[2]) == "ATOM 2"
+    assert cache.usage()[1] <= 2
+
+    # entries read from disk by other programs
+    assert cache.locate(keys[1]) is None
+    with open(cache.locate(keys[2])) as fp:
+        assert fp.read() == "ATOM 2"
+
+
+def test_file_cache_ttl(tmp_path):
+    """Test that entries expire a fixed time after they are written."""
+    cache = FileCache(str(tmp_path), ttl=60, suffix=".json")
+    key = hash_text("result")
+    cache.put(key, "{}")
+    assert cache.get(key) == "{}"
+
+    fname = cache._fname(key)
+    os.utime(fname, (time.time(), time.time() - 120))
+    assert key not in cache and cache.get(key) is None
+    assert cache.locate(key) is None
+
+    cache.evict()
+    assert not os.path.exists(fname)
+
+
+def test_hash_smiles():
+    """Test ligand cache keys of smiles codes."""
+    assert hash_smiles("OCC") == hash_smiles(" OCC\n")
+    assert hash_smiles("OCC", "--gen3d") != hash_smiles("OCC", "--gen2d")
+    assert hash_smiles("OCC") != hash_smiles("CCC")
+
+
+def test_heavy_atom_count():
+    assert heavy_atom_count("CC(C)CC1=CC=C(C=C1)C(C)C(=O)O") == 15
+    assert heavy_atom_count("BrC1=CC(CO)=NC=C1") == 9
+    assert heavy_atom_count("[H]OC([2H])Cl") == 3
+
+    # symbols suffice, without geometry or identifiers
+    assert heavy_atom_count(Molecule(symbols=["C", "C", "O", "H"])) == 3
+    with pytest.raises(ValueError):
+        heavy_atom_count(Molecule.construct(symbols=None))
+
+
+def test_plan_jobs():
+    """Test splitting cores across vina jobs."""
+    ncores = len(available_cores())
+
+    plan = plan_jobs(sizes=[9, 12, 15], affinity=True)
+    assert plan.cpu == 1 and plan.njobs == ncores
+    assert len(set(plan.cores)) == ncores
+
+    plan = plan_jobs(sizes=[60], exhaustiveness=2)
+    assert plan.cpu == min(2, ncores)
+
+    plan = plan_jobs(cpu=1, njobs=3)
+    assert plan == (3, 1, None)
+
+
+def test_split_poses():
+    """Test splitting vina output into ligand and flexible side-chain poses."""
+    system = "".join(
+        f"MODEL {i}\n{pdbqt_ligand}{pdbqt_flex}ENDMDL\n" for i in range(1, 4)
+    )
+    poses = split_poses(system)
+
+    assert len(poses) == 3
+    assert all(system[pose.ligand] == pdbqt_ligand for pose in poses)
+    assert all(system[pose.flex] == pdbqt_flex for pose in poses)
+
+    poses = split_poses(pdbqt_ligand)
+    assert len(poses) == 1 and poses[0].flex is None
+
+
+def test_split_titled():
+    """Test mapping multi-molecule obabel output back to molecule titles."""
+    system = "".join(f"REMARK  Name = {i}\n{pdbqt_ligand}" for i in (0, 2))
+    titled = split_titled(system)
+
+    assert [title for title, _ in titled] == ["0", "2"]
+    assert titled[1][1] == f"REMARK  Name = 2\n{pdbqt_ligand}"
+
+
+def test_read_pdbqt():
+    """Test reading a docked pose without obabel."""
+    with open(os.path.join(data_dir, "results", "rigid", "ligand1.pdbqt")) as fp:
+        mol = read_pdbqt(fp.read())
+
+    assert len(mol.symbols) == 39
+    assert mol.extras["autodock_types"][:3] == ["A", "A", "C"]
+    assert list(mol.symbols[:3]) == ["C", "C", "C"]
+    assert abs(mol.partial_charges[0] - 0.048) < 1e-6
+    assert len(mol.connectivity) > 0
+
+
+def test_write_pdbqt():
+    """Test writing pre-typed molecules without obabel."""
+    with open(os.path.join(data_dir, "results", "rigid", "ligand1.pdbqt")) as fp:
+        mol = read_pdbqt(fp.read())
+
+    pdbqt = write_pdbqt(mol)
+    lines = pdbqt.splitlines()
+    assert lines[0] == "ROOT" and lines[-1].startswith("TORSDOF")
+    assert pdbqt.count("BRANCH") == 2 * int(lines[-1].split()[1])
+
+    # the torsion tree reorders atoms
+    mol2 = read_pdbqt(pdbqt)
+    assert sorted(zip(mol2.extras["autodock_types"], mol2.partial_charges)) == sorted(
+        zip(mol.extras["autodock_types"], mol.partial_charges)
+    )
+
+    rigid = write_pdbqt(mol, rigid=True)
+    assert "ROOT" not in rigid and rigid.count("ATOM") == len(mol.symbols)
+    assert read_pdbqt(rigid).geometry.tolist() == mol.geometry.tolist()
+
+    # a disconnected counterion cannot be written in the torsion tree
+    salt = read_pdbqt(
+        "ATOM      1  C1  UNL     1       0.000   0.000   0.000  0.00  0.00    +0.000 C \n"
+        "ATOM      2  C2  UNL     1       1.540   0.000   0.000  0.00  0.00    +0.000 C \n"
+        "ATOM      3  O3  UNL     1       2.050   1.350   0.000  0.00  0.00    -0.400 OA\n"
+        "ATOM      4 CL   UNL     1       8.000   8.000   8.000  0.00  0.00    -1.000 Cl\n"
+    )
+    assert write_pdbqt(salt, rigid=True).count("ATOM") == 4
+    with pytest.raises(ValueError):
+        write_pdbqt(salt)
+
+
+def test_split_flex():
+    """Test splitting a receptor into rigid and flexible side-chain parts."""
+    with open(os.path.join(data_dir, "input", "receptor_rigid.pdbqt")) as fp:
+        receptor = fp.read()
+
+    rigid, flex = split_flex(receptor, ["A:MET1", ("PHE", 158)])
+    assert flex.count("BEGIN_RES") == 2 and flex.count("END_RES") == 2
+    assert "BEGIN_RES MET A   1" in flex
+
+    # the CA atoms root the side-chains and stay in the rigid receptor
+    assert flex.count(" CA ") == 2
+    assert rigid.count("ATOM") + flex.count("ATOM") == receptor.count("ATOM") + 2
+    assert "TORSDOF 3" in flex and "TORSDOF 2" in flex
+    assert len(read_pdbqt(rigid, bonds=False).symbols) == rigid.count("ATOM")
+
+    with pytest.raises(ValueError):
+        split_flex(receptor, ["B:MET1"])
+
+
+def test_select_residues():
+    """Test selecting residues by number, name, pair, and chain:NAMEnumber."""
+    names = ["MET", "MET", "PHE", "PHE", "TYR"]
+    numbers = [1, 1, 2, 2, 3]
+    chains = ["A", "A", "A", "B", "B"]
+
+    mask = select_residues([1, ("TYR", 3)], names, numbers)
+    assert mask.tolist() == [True, True, False, False, True]
+    mask = select_residues(["PHE2"], names, numbers)
+    assert mask.tolist() == [False, False, True, True, False]
+    mask = select_residues(["B:phe2", "met"], names, numbers, chains)
+    assert mask.tolist() == [True, True, False, True, False]
+
+    for residues, kwargs in [
+        (["B:MET1"], {"chains": chains}),
+        (["A:MET1"], {}),
+        (["MET-"], {}),
+        ([4], {}),
+    ]:
+        with pytest.raises(ValueError):
+            select_residues(residues, names, numbers, **kwargs)
+
+
+def test_build_box():
+    """Test deriving the search box from sites, residues, and a reference ligand."""
+    with open(os.path.join(data_dir, "input", "receptor_rigid.pdbqt")) as fp:
+        receptor = read_pdbqt(fp.read())
+    with open(os.path.join(data_dir, "results", "rigid", "ligand1.pdbqt")) as fp:
+        ligand = read_pdbqt(fp.read())
+    sites = os.path.join(data_dir, "..", "PHIPA_C2", "PHIPA_C2_apo_sites.pdb")
+
+    box = build_box(receptor, mode="sites", sites=sites, site_names=["S1"], padding=5)
+    assert numpy.allclose(box.center, [-19.150, 12.842, 24.700])
+    assert numpy.allclose(box.size, 10.0)
+
+    box = build_box(receptor, mode="ligand", ligand=ligand, min_size=30.0)
+    geometry = ligand.geometry.reshape(-1, 3)
+    assert numpy.allclose(box.center, (geometry.min(0) + geometry.max(0)) / 2)
+    assert numpy.all(box.size >= 30.0)
+
+    resname, resid = receptor.substructs[0]
+    box = build_box(receptor, mode="residues", residues=[resid], padding=0)
+    assert numpy.all(box.size < build_box(receptor).size)
+
+    # residues are selected as for the flexible side-chains
+    for residue in [f"{resname}{resid}", f"{resname.lower()}{resid}"]:
+        other = build_box(receptor, mode="residues", residues=[residue], padding=0)
+        assert numpy.allclose(other.center, box.center)
+        assert numpy.allclose(other.size, box.size)
+    for residue in [f"A:{resname}{resid}", "XYZ1"]:
+        with pytest.raises(ValueError):
+            build_box(receptor, mode="residues", residues=[residue])
+
+    box = Box.from_search_space((0.0, 10.0, -2.0, 2.0, 1.0, 3.0))
+    assert box.to_params() == {
+        "center_x": 5.0, "size_x": 10.0,
+        "center_y": 0.0, "size_y": 4.0,
+        "center_z": 2.0, "size_z": 2.0,
+    }  # fmt: skip
+
+
+def test_find_pockets():
+    """Test that the best pocket detected on PHIPA_C2 is the S1 site."""
+    pdb = os.path.join(data_dir, "..", "PHIPA_C2", "PHIPA_C2_apo.pdb")
+    with open(pdb) as fp:
+        coords = [
+            (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            for line in fp
+            if line.startswith("ATOM")
+        ]
+
+    pockets = find_pockets(coords)
+    assert pockets and pockets[0].volume >= 50.0
+    assert [pocket.score for pocket in pockets] == sorted(
+        (pocket.score for pocket in pockets), reverse=True
+    )
+
+    sites = os.path.join(data_dir, "..", "PHIPA_C2", "PHIPA_C2_apo_sites.pdb")
+    site = read_sites(sites, ["S1"])["S1"]
+    assert numpy.linalg.norm(pockets[0].points - site, axis=1).min() < 2.0
+
+
+def test_tile_boxes():
+    """Test splitting a large box into overlapping tiles."""
+    box = Box(center=numpy.zeros(3), size=numpy.array([50.0, 20.0, 10.0]))
+    tiles = tile_boxes([box], 22.0, overlap=4.0)
+
+    assert len(tiles) == 3
+    assert numpy.allclose(tiles[0].size, [22.0, 20.0, 10.0])
+    assert numpy.allclose([tile.center[0] for tile in tiles], [-14.0, 0.0, 14.0])
+
+
+def test_merge_poses():
+    """Test merging overlapping docking outputs into one ranked, deduplicated output."""
+    poses = []
+    for index in range(1, 10):
+        with open(
+            os.path.join(data_dir, "results", "rigid", f"ligand{index}.pdbqt")
+        ) as fp:
+            poses.append(fp.read())
+
+    def system(poses):
+        return "".join(f"MODEL {i}\n{pose}ENDMDL\n" for i, pose in enumerate(poses, 1))
+
+    # poses 4 and 5 are in both outputs
+    first, second = system(poses[3:]), system(poses[:5])
+    merged, scores = merge_poses(
+        [first, second],
+        [parse_scores(first).affinity, parse_scores(second).affinity],
+    )
+
+    # same poses, scores, and RMSD bounds as the single vina run
+    reference = parse_scores(system(poses))
+    assert merged.count("MODEL") == 9
+    assert numpy.allclose(scores.affinity, reference.affinity)
+    assert numpy.allclose(scores.rmsd_lb, reference.rmsd_lb, atol=1e-3)
+    assert numpy.allclose(scores.rmsd_ub, reference.rmsd_ub, atol=1e-3)
+    assert numpy.allclose(parse_scores(merged).rmsd_ub, reference.rmsd_ub)
+
+    merged, scores = merge_poses(
+        [first, second],
+        [parse_scores(first).affinity, parse_scores(second).affinity],
+        num_modes=3,
+    )
+    assert len(scores) == 3 and merged.count("ENDMDL") == 3
+
+
+def test_consensus_poses():
+    """Test clustering the poses of replica dockings by consensus score."""
+    poses = []
+    for index in range(1, 10):
+        with open(
+            os.path.join(data_dir, "results", "rigid", f"ligand{index}.pdbqt")
+        ) as fp:
+            poses.append(fp.read())
+
+    def system(poses):
+        return "".join(f"MODEL {i}\n{pose}ENDMDL\n" for i, pose in enumerate(poses, 1))
+
+    # the first replica misses the best pose and scores 1 kcal/mol worse
+    first, second = system(poses[1:]), system(poses)
+    reference = parse_scores(second).affinity
+    consensus = consensus_poses(
+        [first, second], [reference[1:] + 1.0, reference], cluster_rmsd=0.0
+    )[1]
+
+    # the best pose, found by one replica only, ranks below the agreed poses
+    assert len(consensus.scores) == 9
+    assert consensus.support.tolist() == [2] * 8 + [1]
+    assert numpy.allclose(consensus.scores.affinity[-1], reference[0])
+    assert numpy.allclose(consensus.scores.affinity[:-1], reference[1:] + 0.5)
+    assert numpy.allclose(consensus.std[:-1], 0.5)
+
+    # with a large cutoff, all poses are one cluster represented by the best pose
+    merged, consensus = consensus_poses(
+        [first, second], [reference[1:], reference], cluster_rmsd=100.0
+    )
+    assert merged.count("MODEL") == 1 and consensus.support.tolist() == [2]
+    assert numpy.allclose(consensus.scores.affinity, (reference[0] + reference[1]) / 2)
+
+
+def test_lazy_pose():
+    """Test that poses are only parsed on first access."""
+    system = f"MODEL 1\n{pdbqt_ligand}ENDMDL\n"
+    pose = LazyPose(system, split_poses(system)[0].ligand, score=-11.2)
+
+    assert pose.pdbqt == pdbqt_ligand
+    assert pose._molecule is None
+    assert pose.molecule is pose.molecule
+    assert list(pose.molecule.symbols) == ["C"]
+
+
+def test_parse_scores():
+    """Test parsing scores and RMSD bounds from vina stdout and pdbqt output."""
+    scores = parse_scores(vina_stdout)
+    assert scores.affinity.tolist() == [-11.2, -10.85]
+    assert scores.rmsd_lb.tolist() == [0.0, 1.842]
+    assert scores.rmsd_ub.tolist() == [0.0, 2.501]
+    assert scores[:1].affinity.tolist() == [-11.2]
+    assert scores.top(1).rmsd_ub.tolist() == [0.0] and len(scores.top()) == 2
+    assert scores[-1].affinity.tolist() == [-10.85]
+
+    # the number of modes does not depend on the number of score arrays
+    scores = VinaScores(*numpy.zeros((3, 4)))
+    assert len(scores) == len(list(scores)) == 4
+    assert len(scores[3]) == 1
+
+    scores = get_scores("", None, f"MODEL 1\n{pdbqt_ligand}ENDMDL\n")
+    assert scores.affinity.tolist() == [-11.2] and len(scores) == 1
+
+    assert len(parse_scores("Writing output ... done.")) == 0
+
+
+@pytest.mark.parametrize("backend", ["tmp", "shm", "memfd"])
+def test_scratch_dir(backend):
+    """Test writing inputs to each scratch backend and removing them on exit."""
+    with ScratchDir(backend) as scratch:
+        path = scratch.write("ligand.pdbqt", pdbqt_ligand)
+        with open(path) as fp:
+            assert fp.read() == pdbqt_ligand
+        assert os.path.dirname(scratch.name("out.pdbqt")) == scratch.path
+        root = scratch.path
+
+    assert not os.path.exists(root) and not scratch._fds
+
+
+def test_scratch_dir_fallback(monkeypatch, tmp_path):
+    """Test falling back on files in the temporary directory without /dev/shm or memfd."""
+    monkeypatch.setattr(scratch_module, "SHM_DIR", str(tmp_path / "missing"))
+    monkeypatch.delattr(os, "memfd_create", raising=False)
+
+    for backend in ("shm", "memfd"):
+        with ScratchDir(backend) as scratch:
+            path = scratch.write("ligand.pdbqt", pdbqt_ligand)
+            assert scratch.parent is None and not scratch.memfd
+            assert os.path.dirname(path) == scratch.path
+            assert os.path.dirname(scratch.path) == tempfile.gettempdir()
+
+    with ScratchDir(str(tmp_path)) as scratch:
+        assert os.path.dirname(scratch.write("ligand.pdbqt", "")) == scratch.path
+        assert os.path.dirname(scratch.path) == str(tmp_path)
+
+
+def test_journal(tmp_path):
+    """Test appending and loading journal records, skipping a truncated record."""
+    path = str(tmp_path / "campaign.jsonl")
+    with Journal(path) as journal:
+        journal.append({"index": 0, "status": "failed"})
+        journal.append({"index": 1, "status": "done"})
+        journal.append({"index": 0, "status": "done"})
+
+    with open(path, "a") as fp:
+        fp.write('{"index": 2, "sta')  # crash while writing
+
+    with Journal(path) as journal:
+        journal.append({"index": 3, "status": "done"})
+
+    records = Journal(path).load()
+    assert sorted(records) == [0, 1, 3]
+    assert records[0]["status"] == "done"
@@ -0,0 +1,20 @@
+from . import cache
+from .cache import *
+from . import scheduler
+from .scheduler import *
+from . import pdbqt
+from .pdbqt import *
+from . import scores
+from .scores import *
+from . import scratch
+from .scratch import *
+from . import journal
+from .journal import *
+from . import box
+from .box import *
+from . import pocket
+from .pocket import *
+from . import merge
+from .merge import *
+from . import engine
+from .engine import *
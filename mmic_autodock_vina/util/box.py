@@ -0,0 +1,365 @@
+"""
+Derivation of the vina search box from receptor, ligand, residue, or binding site coordinates.
+"""
+
+from mmelemental.models import Molecule
+from mmelemental.util.units import convert
+from .pdbqt import molecule_geometry, select_residues
+from .pocket import find_pockets
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy
+import os
+
+__all__ = [
+    "Box",
+    "BOX_MODES",
+    "MULTI_BOX_OPTIONS",
+    "box_from_coords",
+    "build_box",
+    "build_boxes",
+    "ligand_box",
+    "pocket_boxes",
+    "read_sites",
+    "receptor_box",
+    "residue_box",
+    "sites_box",
+    "tile_boxes",
+]
+
+BOX_MODES = ("receptor", "ligand", "residues", "sites", "pocket")
+DEFAULT_PADDING = 4.0  # angstrom
+DEFAULT_OVERLAP = 4.0  # angstrom
+
+# Box specification options producing several boxes, see build_boxes
+MULTI_BOX_OPTIONS = ("boxes", "tile", "top_k")
+
+
+class Box(NamedTuple):
+    """Search box center and size (angstrom)."""
+
+    center: numpy.ndarray
+    size: numpy.ndarray
+
+    def to_params(self) -> Dict[str, float]:
+        """Returns the box as vina parameters e.g. center_x, size_x."""
+        params = {}
+        for axis, center, size in zip("xyz", self.center.tolist(), self.size.tolist()):
+            params[f"center_{axis}"] = center
+            params[f"size_{axis}"] = size
+        return params
+
+    @classmethod
+    def from_search_space(
+        cls,
+        search_space: Tuple[float, ...],
+        search_space_units: Optional[str] = "angstrom",
+    ) -> "Box":
+        """Returns the box of a search space (xmin, xmax, ymin, ymax, zmin, zmax)."""
+        bounds = numpy.asarray(search_space, dtype=float).reshape(3, 2)
+        if search_space_units not in (None, "angstrom"):
+            bounds = convert(bounds, search_space_units, "angstrom")
+        return cls(center=bounds.mean(axis=1), size=bounds[:, 1] - bounds[:, 0])
+
+
+def box_from_coords(
+    coords: numpy.ndarray,
+    padding: Optional[float] = DEFAULT_PADDING,
+    min_size: Optional[float] = None,
+) -> Box:
+    """
+    Returns the box enclosing a set of coordinates with ``padding`` added on each
+    side, and each dimension at least ``min_size``.
+    """
+    coords = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+    if not len(coords):
+        raise ValueError("Cannot build a search box from an empty set of coordinates.")
+
+    lower, upper = coords.min(axis=0), coords.max(axis=0)
+    size = upper - lower + 2 * (padding or 0.0)
+    if min_size:
+        size = numpy.maximum(size, min_size)
+    return Box(center=(lower + upper) / 2.0, size=size)
+
+
+def receptor_box(receptor: Molecule, padding: Optional[float] = 0.0, **kwargs) -> Box:
+    """Returns the box enclosing the whole receptor."""
+    return box_from_coords(molecule_geometry(receptor), padding=padding, **kwargs)
+
+
+def ligand_box(ligand: Molecule, padding: Optional[float] = DEFAULT_PADDING, **kwargs):
+    """Returns the box around a reference (e.g. co-crystallized) ligand."""
+    if ligand.geometry is None:
+        raise ValueError("The reference ligand must have 3D coordinates.")
+    return box_from_coords(molecule_geometry(ligand), padding=padding, **kwargs)
+
+
+def residue_box(
+    receptor: Molecule,
+    residues: Sequence[Union[int, str, Tuple[str, int]]],
+    padding: Optional[float] = DEFAULT_PADDING,
+    **kwargs,
+) -> Box:
+    """
+    Returns the box around selected receptor residues.
+
+    Parameters
+    ----------
+    receptor : Molecule
+        Receptor with residue information (``substructs``).
+    residues : Sequence[int or str or Tuple[str, int]]
+        Residue numbers, residue names, (name, number) pairs, or "NAMEnumber"
+        strings e.g. "TYR97", see :func:`~mmic_autodock_vina.util.pdbqt.select_residues`.
+        The receptor has no chain information, so chains cannot be selected.
+    padding : float, optional
+        Padding (angstrom) added on each side of the selected atoms.
+    """
+    if receptor.substructs is None:
+        raise ValueError("Receptor has no residue information (substructs).")
+
+    substructs = list(receptor.substructs)
+    names = numpy.array([str(name) for name, _ in substructs])
+    numbers = numpy.array([int(number) for _, number in substructs])
+
+    mask = select_residues(residues, names, numbers)
+    return box_from_coords(molecule_geometry(receptor)[mask], padding=padding, **kwargs)
+
+
+def read_sites(
+    sites: str, names: Optional[Sequence[str]] = None
+) -> Dict[str, numpy.ndarray]:
+    """
+    Reads binding site atoms from the HETATM records of a PDB file or string, e.g.
+    pocket pseudo-atoms or co-crystallized fragments. Waters are ignored.
+
+    Parameters
+    ----------
+    sites : str
+        Path to a PDB file or PDB string.
+    names : Sequence[str], optional
+        Residue names of the sites to read. Defaults to all HETATM residues.
+
+    Returns
+    -------
+    Dict[str, numpy.ndarray]
+        Coordinates (angstrom) of the atoms of each site, by residue name.
+    """
+    if os.path.isfile(sites):
+        with open(sites, "r") as fp:
+            sites = fp.read()
+
+    coords = {}
+    for line in sites.splitlines():
+        if not line.startswith("HETATM"):
+            continue
+        resname = line[17:20].strip()
+        if resname in ("HOH", "WAT") or (names and resname not in names):
+            continue
+        xyz = float(line[30:38]), float(line[38:46]), float(line[46:54])
+        coords.setdefault(resname, []).append(xyz)
+
+    return {name: numpy.array(xyz) for name, xyz in coords.items()}
+
+
+def sites_box(
+    sites: str,
+    names: Optional[Sequence[str]] = None,
+    padding: Optional[float] = DEFAULT_PADDING,
+    **kwargs,
+) -> Box:
+    """Returns the box around the binding site atoms of a sites PDB file (see :func:`read_sites`)."""
+    coords = read_sites(sites, names)
+    if not coords:
+        raise ValueError(f"No binding site atoms found for the sites {names}.")
+    return box_from_coords(
+        numpy.concatenate(list(coords.values())), padding=padding, **kwargs
+    )
+
+
+def pocket_boxes(
+    receptor: Molecule,
+    top_k: Optional[int] = 1,
+    padding: Optional[float] = DEFAULT_PADDING,
+    min_size: Optional[float] = None,
+    **kwargs: Any,
+) -> List[Box]:
+    """
+    Returns the boxes around the top ``top_k`` pockets detected on the receptor,
+    best first. Additional keyword arguments are passed to
+    :func:`~mmic_autodock_vina.util.pocket.find_pockets`.
+    """
+    pockets = find_pockets(molecule_geometry(receptor), top_k=top_k, **kwargs)
+    if not pockets:
+        raise ValueError("No pockets detected on the receptor.")
+    return [
+        box_from_coords(pocket.points, padding=padding, min_size=min_size)
+        for pocket in pockets
+    ]
+
+
+def build_box(
+    receptor: Molecule,
+    mode: Optional[str] = "receptor",
+    ligand: Optional[Union[Molecule, Dict[str, Any]]] = None,
+    residues: Optional[List[Union[int, str, Tuple[str, int]]]] = None,
+    sites: Optional[str] = None,
+    site_names: Optional[List[str]] = None,
+    rank: Optional[int] = 0,
+    pockets: Optional[Dict[str, Any]] = None,
+    padding: Optional[float] = None,
+    min_size: Optional[float] = None,
+    **kwargs: Any,
+) -> Box:
+    """
+    Derives the search box from a box specification e.g. the "box" extras.
+
+    Parameters
+    ----------
+    receptor : Molecule
+        Receptor molecule.
+    mode : str, optional
+        One of "receptor" (whole receptor extent), "ligand" (around a reference
+        ligand), "residues" (around receptor residues), "sites" (around the
+        binding site atoms of a PDB file), or "pocket" (around a pocket detected
+        on the receptor).
+    ligand : Molecule or Dict[str, Any], optional
+        Reference ligand for the "ligand" mode.
+    residues : List[int or str or Tuple[str, int]], optional
+        Residue selection for the "residues" mode, see :func:`residue_box`.
+    sites : str, optional
+        PDB file or string with the binding site atoms for the "sites" mode.
+    site_names : List[str], optional
+        Residue names of the sites to use, defaults to all sites.
+    rank : int, optional
+        Rank of the pocket used in the "pocket" mode, 0 for the best pocket.
+    pockets : Dict[str, Any], optional
+        Pocket detection parameters, see :func:`~mmic_autodock_vina.util.pocket.find_pockets`.
+    padding : float, optional
+        Padding (angstrom) added on each side. Defaults to 4 angstrom, and no
+        padding in the "receptor" mode.
+    min_size : float, optional
+        Minimum size (angstrom) of each box dimension.
+
+    Returns
+    -------
+    Box
+        Search box center and size.
+    """
+    if kwargs:
+        raise ValueError(f"Unknown box options: {sorted(kwargs)}.")
+
+    options = {"min_size": min_size}
+    if padding is not None:
+        options["padding"] = padding
+
+    if mode == "receptor":
+        return receptor_box(receptor, **options)
+    elif mode == "ligand":
+        if ligand is None:
+            raise ValueError("The 'ligand' box mode requires a reference ligand.")
+        if isinstance(ligand, dict):
+            ligand = Molecule(**ligand)
+        return ligand_box(ligand, **options)
+    elif mode == "residues":
+        if not residues:
+            raise ValueError("The 'residues' box mode requires a residue selection.")
+        return residue_box(receptor, residues, **options)
+    elif mode == "sites":
+        if not sites:
+            raise ValueError("The 'sites' box mode requires a sites PDB file.")
+        return sites_box(sites, site_names, **options)
+    elif mode == "pocket":
+        boxes = pocket_boxes(receptor, top_k=rank + 1, **options, **(pockets or {}))
+        if len(boxes) <= rank:
+            raise ValueError(f"Only {len(boxes)} pockets detected on the receptor.")
+        return boxes[rank]
+    raise ValueError(f"Box mode {mode} not supported. Use one of {BOX_MODES}.")
+
+
+def tile_boxes(
+    boxes: Sequence[Box], size: float, overlap: Optional[float] = DEFAULT_OVERLAP
+) -> List[Box]:
+    """
+    Splits boxes larger than ``size`` into tiles of at most ``size`` (angstrom)
+    along each axis, overlapping by at least ``overlap`` so that ligands spanning
+    tile borders are sampled.
+    """
+    if overlap >= size:
+        raise ValueError("The tile overlap must be smaller than the tile size.")
+
+    tiles = []
+    for box in boxes:
+        lower = box.center - box.size / 2.0
+        ntiles = numpy.maximum(
+            numpy.ceil((box.size - overlap) / (size - overlap)), 1
+        ).astype(int)
+        tile_size = numpy.minimum(box.size, size)
+        step = (box.size - tile_size) / numpy.maximum(ntiles - 1, 1)
+
+        index = numpy.stack(
+            numpy.meshgrid(*(numpy.arange(n) for n in ntiles), indexing="ij"), -1
+        ).reshape(-1, 3)
+        for center in lower + tile_size / 2.0 + index * step:
+            tiles.append(Box(center=center, size=tile_size.copy()))
+
+    return tiles
+
+
+def build_boxes(
+    receptor: Molecule,
+    boxes: Optional[List[Union[Box, Tuple[float, ...], Dict[str, Any]]]] = None,
+    tile: Optional[float] = None,
+    overlap: Optional[float] = DEFAULT_OVERLAP,
+    top_k: Optional[int] = None,
+    **kwargs: Any,
+) -> List[Box]:
+    """
+    Derives one or more search boxes from a box specification.
+
+    Parameters
+    ----------
+    receptor : Molecule
+        Receptor molecule.
+    boxes : List[Box or Tuple[float, ...] or Dict[str, Any]], optional
+        Several boxes, each a Box, a search space (xmin, xmax, ymin, ymax, zmin,
+        zmax) in angstrom, or a box specification e.g. for several sites.
+    tile : float, optional
+        Tile size (angstrom). Boxes larger than ``tile`` are split into
+        overlapping tiles, see :func:`tile_boxes`.
+    overlap : float, optional
+        Minimum overlap (angstrom) of adjacent tiles.
+    top_k : int, optional
+        In the "pocket" mode, number of pockets docked into.
+    **kwargs
+        Box specification of a single box, see :func:`build_box`.
+
+    Returns
+    -------
+    List[Box]
+        Search boxes.
+    """
+    if boxes:
+        if kwargs:
+            raise ValueError(f"Unknown box options with boxes: {sorted(kwargs)}.")
+        result = []
+        for item in boxes:
+            if isinstance(item, Box):
+                result.append(item)
+            elif isinstance(item, dict):
+                result.extend(build_boxes(receptor, **item))
+            else:
+                result.append(Box.from_search_space(item))
+    elif kwargs.get("mode") == "pocket" and top_k:
+        options = {
+            key: kwargs[key]
+            for key in ("padding", "min_size")
+            if kwargs.get(key) is not None
+        }
+        result = pocket_boxes(
+            receptor, top_k=top_k, **options, **(kwargs.get("pockets") or {})
+        )
+    else:
+        result = [build_box(receptor, **kwargs)]
+
+    if tile:
+        result = tile_boxes(result, tile, overlap)
+    return result
@@ -0,0 +1,290 @@
+"""
+Content-addressed, on-disk caches for intermediate docking files.
+"""
+
+from mmelemental.models import Molecule
+from typing import Any, Iterator, Optional, Tuple, Union
+import hashlib
+import numpy
+import os
+import tempfile
+import time
+
+__all__ = [
+    "FileCache",
+    "canonical_smiles",
+    "get_cache",
+    "hash_molecule",
+    "hash_smiles",
+    "hash_text",
+]
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MMIC_AUTODOCK_VINA_CACHE",
+    os.path.join(
+        os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+        ),
+        "mmic_autodock_vina",
+    ),
+)
+DEFAULT_MAX_SIZE = 2**30  # 1 GiB per cache
+
+
+class FileCache:
+    """
+    A directory store of text entries addressed by a hex digest key. Entries are
+    written atomically so the cache can be shared between concurrent processes, and
+    the least recently used entries are evicted once the cache exceeds ``max_size``
+    bytes or ``max_entries`` files. Entries older than ``ttl`` seconds expire.
+
+    Parameters
+    ----------
+    path : str
+        Root directory of the cache, created if it does not exist.
+    max_size : int, optional
+        Maximum total size of the cached entries in bytes.
+    max_entries : int, optional
+        Maximum number of cached entries.
+    suffix : str, optional
+        File extension used for the cached entries.
+    ttl : float, optional
+        Time to live of the cached entries in seconds, from the time they were
+        written.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: Optional[int] = DEFAULT_MAX_SIZE,
+        max_entries: Optional[int] = None,
+        suffix: Optional[str] = ".pdbqt",
+        ttl: Optional[float] = None,
+    ):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+        self.max_entries = max_entries
+        self.suffix = suffix or ""
+        self.ttl = ttl
+        self._usage = None  # (size, count) estimate, computed on first write
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
+
+    def __contains__(self, key: str) -> bool:
+        try:
+            return not self._expired(os.stat(self._fname(key)))
+        except FileNotFoundError:
+            return False
+
+    def _expired(self, stat: os.stat_result) -> bool:
+        return self.ttl is not None and time.time() - stat.st_mtime > self.ttl
+
+    def _fname(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + self.suffix)
+
+    def _entries(self) -> Iterator[Tuple[str, os.stat_result]]:
+        for subdir in os.scandir(self.path):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(self.suffix) and not entry.name.startswith("."):
+                    try:
+                        yield entry.path, entry.stat()
+                    except FileNotFoundError:  # removed by a concurrent process
+                        continue
+
+    def get(self, key: str) -> Optional[str]:
+        """Returns the cached entry for ``key`` or None on a cache miss."""
+        fname = self._fname(key)
+        try:
+            with open(fname, "r") as fp:
+                stat = os.fstat(fp.fileno())
+                if self._expired(stat):
+                    return None
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # The access time marks recent use, the modification time is the write time
+            os.utime(fname, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+        return data
+
+    def locate(self, key: str) -> Optional[str]:
+        """
+        Returns the path of the cached file for ``key``, or None on a cache miss,
+        for programs that read the entry from disk.
+        """
+        fname = self._fname(key)
+        try:
+            stat = os.stat(fname)
+        except FileNotFoundError:
+            return None
+        if self._expired(stat):
+            return None
+        try:
+            os.utime(fname, (time.time(), stat.st_mtime))
+        except OSError:
+            pass
+        return fname
+
+    def put(self, key: str, data: str) -> str:
+        """Stores ``data`` under ``key`` and returns the path of the cached file."""
+        fname = self._fname(key)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+        fd, tmp = tempfile.mkstemp(prefix=".", dir=os.path.dirname(fname))
+        try:
+            with os.fdopen(fd, "w") as fp:
+                fp.write(data)
+            os.replace(tmp, fname)
+        except BaseException:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+            raise
+
+        if self._usage is None:
+            self._usage = self.usage()
+        else:
+            size, count = self._usage
+            self._usage = (size + os.path.getsize(fname), count + 1)
+
+        if self._over_limit(*self._usage):
+            self.evict()
+
+        return fname
+
+    def usage(self) -> Tuple[int, int]:
+        """Returns the total size in bytes and number of cached entries."""
+        size, count = 0, 0
+        for _, stat in self._entries():
+            size += stat.st_size
+            count += 1
+        return size, count
+
+    def _over_limit(self, size: int, count: int, fraction: float = 1.0) -> bool:
+        if self.max_size is not None and size > self.max_size * fraction:
+            return True
+        if self.max_entries is not None and count > self.max_entries * fraction:
+            return True
+        return False
+
+    def evict(self, fraction: Optional[float] = 0.9):
+        """
+        Removes the expired entries, then the least recently used entries until
+        the cache is below ``fraction`` of its limits. Evicting below the limits
+        amortizes the cost of scanning the cache directory over many writes.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_atime)
+        size = sum(stat.st_size for _, stat in entries)
+        count = len(entries)
+
+        for fname, stat in entries:
+            if not self._expired(stat) and not self._over_limit(size, count, fraction):
+                continue
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+            size -= stat.st_size
+            count -= 1
+
+        self._usage = (size, count)
+
+    def clear(self):
+        """Removes all cached entries."""
+        for fname, _ in list(self._entries()):
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+        self._usage = (0, 0)
+
+
+def get_cache(
+    name: str, cache: Optional[Union[bool, str, FileCache]] = None, **kwargs: Any
+) -> Optional[FileCache]:
+    """
+    Resolves a cache setting (e.g. from component extras) to a :class:`FileCache`.
+
+    Parameters
+    ----------
+    name : str
+        Name of the cache, used as a subdirectory of the default cache directory.
+    cache : bool or str or FileCache, optional
+        None or True selects the default cache directory, False disables caching,
+        and a str is used as the cache root directory.
+    **kwargs
+        Additional keyword arguments passed to :class:`FileCache`.
+
+    Returns
+    -------
+    FileCache or None
+        The resolved cache, or None if caching is disabled.
+    """
+    if cache is False:
+        return None
+    elif isinstance(cache, FileCache):
+        return cache
+    elif isinstance(cache, str):
+        return FileCache(cache, **kwargs)
+    return FileCache(os.path.join(DEFAULT_CACHE_DIR, name), **kwargs)
+
+
+def hash_text(*args: Any) -> str:
+    """Returns a sha256 hex digest of the str representation of ``args``."""
+    m = hashlib.sha256()
+    for arg in args:
+        m.update(str(arg).encode("utf-8"))
+        m.update(b"\0")
+    return m.hexdigest()
+
+
+def hash_molecule(mol: Molecule, *args: Any) -> str:
+    """
+    Returns a sha256 hex digest of the molecular content that determines how a
+    molecule is written to a structure file: geometry, symbols, atom labels,
+    residues, and connectivity. Additional ``args`` (e.g. program options) are
+    included in the digest.
+    """
+    m = hashlib.sha256()
+
+    if mol.geometry is not None:
+        geometry = numpy.asarray(mol.geometry, dtype=float).round(4)
+        m.update(numpy.ascontiguousarray(geometry).tobytes())
+        m.update(str(mol.geometry_units).encode("utf-8"))
+
+    for field in ("symbols", "atom_labels", "substructs", "connectivity"):
+        data = getattr(mol, field, None)
+        m.update(field.encode("utf-8"))
+        if data is not None:
+            m.update("\0".join(map(str, numpy.asarray(data).tolist())).encode("utf-8"))
+
+    m.update(hash_text(*args).encode("utf-8"))
+    return m.hexdigest()
+
+
+def canonical_smiles(smiles: str) -> str:
+    """
+    Returns the canonical form of a smiles code if RDKit is installed, so that
+    different smiles of the same molecule share cache entries. Otherwise, or if
+    RDKit cannot parse the smiles, it is returned unchanged.
+    """
+    try:
+        from rdkit import Chem, RDLogger
+    except ImportError:
+        return smiles
+
+    RDLogger.DisableLog("rdApp.*")
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return smiles
+    return Chem.MolToSmiles(mol)
+
+
+def hash_smiles(smiles: str, *args: Any) -> str:
+    """Returns a sha256 hex digest of the canonical smiles code and ``args``."""
+    return hash_text("smiles", canonical_smiles(smiles.strip()), *args)
@@ -0,0 +1,151 @@
+"""
+In-process docking with the AutoDock Vina Python bindings.
+"""
+
+from .cache import hash_text
+from .scratch import ScratchDir
+from typing import Dict, Optional, Sequence, Tuple
+import collections
+import numpy
+import threading
+
+__all__ = ["VinaEngine", "get_engine", "has_bindings"]
+
+ENGINE_CACHE_SIZE = 2  # engines kept loaded per thread
+
+_engines = threading.local()
+
+
+def has_bindings() -> bool:
+    """Returns True if the vina Python bindings are installed."""
+    try:
+        import vina  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class VinaEngine:
+    """
+    A vina instance with a receptor and its grid maps loaded, docking ligands
+    from PDBQT strings in-process. The receptor is read and the maps are computed
+    (or loaded) once, then reused by every :meth:`dock` call. An engine docks one
+    ligand at a time.
+
+    Parameters
+    ----------
+    receptor : str, optional
+        Rigid receptor PDBQT string. Not needed if ``maps`` is given without
+        flexible side-chains.
+    box : Sequence[float], optional
+        Search box (center_x, center_y, center_z, size_x, size_y, size_z) in
+        angstrom. Not needed if ``maps`` is given.
+    flex : str, optional
+        Flexible side-chains PDBQT string.
+    maps : str, optional
+        Path prefix of precomputed affinity maps, loaded instead of computing the
+        grid from the receptor.
+    cpu : int, optional
+        Number of CPUs used by each docking.
+    seed : int, optional
+        Random seed, random by default.
+    scratch_backend : str, optional
+        Scratch backend of the receptor files, which vina reads by path, see
+        :class:`~mmic_autodock_vina.util.scratch.ScratchDir`.
+    """
+
+    def __init__(
+        self,
+        receptor: Optional[str] = None,
+        box: Optional[Sequence[float]] = None,
+        flex: Optional[str] = None,
+        maps: Optional[str] = None,
+        cpu: Optional[int] = 1,
+        seed: Optional[int] = None,
+        scratch_backend: Optional[str] = None,
+    ):
+        try:
+            from vina import Vina
+        except ImportError:
+            raise ImportError(
+                "The bindings engine requires the vina Python package e.g. pip install vina."
+            ) from None
+
+        self.vina = Vina(sf_name="vina", cpu=cpu or 0, seed=seed or 0, verbosity=0)
+
+        with ScratchDir(scratch_backend) as scratch:
+            rigid = None if maps else scratch.write("receptor.pdbqt", receptor)
+            if flex:
+                flex = scratch.write("flex.pdbqt", flex)
+            if rigid or flex:
+                self.vina.set_receptor(rigid, flex)
+
+        if maps:
+            self.vina.load_maps(maps)
+        else:
+            box = numpy.asarray(box, dtype=float)
+            self.vina.compute_vina_maps(
+                center=box[:3].tolist(), box_size=box[3:].tolist()
+            )
+
+    def dock(
+        self,
+        ligand: str,
+        exhaustiveness: Optional[int] = 8,
+        num_modes: Optional[int] = 9,
+        energy_range: Optional[float] = 3.0,
+    ) -> Tuple[str, numpy.ndarray]:
+        """
+        Docks a ligand PDBQT string.
+
+        Returns
+        -------
+        Tuple[str, numpy.ndarray]
+            Docked poses as a multi-model PDBQT string, in the vina output format,
+            and the energies of each pose, shape (num_modes, 5+): total, inter,
+            intra, torsional, and intra energy of the best pose (kcal/mol).
+        """
+        self.vina.set_ligand_from_string(ligand)
+        self.vina.dock(
+            exhaustiveness=exhaustiveness or 8, n_poses=max(20, num_modes or 9)
+        )
+        kwargs = {"n_poses": num_modes or 9, "energy_range": energy_range or 3.0}
+        return self.vina.poses(**kwargs), numpy.asarray(self.vina.energies(**kwargs))
+
+
+def get_engine(
+    receptor: Optional[str] = None,
+    box: Optional[Sequence[float]] = None,
+    flex: Optional[str] = None,
+    maps: Optional[str] = None,
+    cpu: Optional[int] = 1,
+    seed: Optional[int] = None,
+    scratch_backend: Optional[str] = None,
+) -> VinaEngine:
+    """
+    Returns an engine of the calling thread for a receptor, box, and settings (see
+    :class:`VinaEngine`), loading the receptor only if the thread has no engine
+    for them. The last :data:`ENGINE_CACHE_SIZE` engines of each thread are kept
+    loaded, so workers docking many ligands against one receptor stay warm.
+    """
+    key = hash_text(
+        receptor if not maps or flex else None,
+        None if box is None else numpy.asarray(box, dtype=float).tolist(),
+        flex,
+        maps,
+        cpu,
+        seed,
+    )
+    engines: Dict[str, VinaEngine] = getattr(_engines, "cache", None)
+    if engines is None:
+        engines = _engines.cache = collections.OrderedDict()
+
+    if key in engines:
+        engines.move_to_end(key)
+        return engines[key]
+
+    engine = VinaEngine(receptor, box, flex, maps, cpu, seed, scratch_backend)
+    engines[key] = engine
+    while len(engines) > ENGINE_CACHE_SIZE:
+        engines.popitem(last=False)
+    return engine
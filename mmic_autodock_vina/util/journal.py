@@ -0,0 +1,82 @@
+"""
+Append-only journals recording the progress of screening campaigns.
+"""
+
+from typing import Any, Dict, Iterator, Optional
+import json
+import os
+
+__all__ = ["Journal"]
+
+
+class Journal:
+    """
+    A JSON lines file of records appended as work completes. Each record is flushed
+    and synced to disk before :meth:`append` returns, so a crash loses at most the
+    record being written, which is skipped on :meth:`load`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the journal file, created if it does not exist.
+    sync : bool, optional
+        If True, calls fsync after every record.
+    """
+
+    def __init__(self, path: str, sync: Optional[bool] = True):
+        self.path = os.path.abspath(path)
+        self.sync = sync
+        self._fp = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(path={self.path!r})"
+
+    def __enter__(self) -> "Journal":
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def open(self) -> "Journal":
+        """Opens the journal for appending."""
+        if self._fp is None:
+            dirname = os.path.dirname(self.path)
+            os.makedirs(dirname, exist_ok=True)
+            self._fp = open(self.path, "a")
+            if self._fp.tell() and not self._ends_with_newline():
+                self._fp.write("\n")  # terminate a record truncated by a crash
+        return self
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as fp:
+            fp.seek(-1, os.SEEK_END)
+            return fp.read(1) == b"\n"
+
+    def append(self, record: Dict[str, Any]):
+        """Appends a record to the journal."""
+        if self._fp is None:
+            self.open()
+        self._fp.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._fp.flush()
+        if self.sync:
+            os.fsync(self._fp.fileno())
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """Yields the journal records in order, skipping truncated records."""
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r") as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    def load(self, key: Optional[str] = "index") -> Dict[Any, Dict[str, Any]]:
+        """Returns the latest record for each value of ``key``."""
+        return {record[key]: record for record in self.records() if key in record}
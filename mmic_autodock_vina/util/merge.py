@@ -0,0 +1,228 @@
+"""
+Merging of the poses of a ligand docked in several runs e.g. several search boxes.
+"""
+
+from .pdbqt import get_element, pose_coordinates, split_poses
+from .scores import VinaScores
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+import numpy
+import re
+
+__all__ = ["Consensus", "consensus_poses", "merge_poses", "pose_rmsd"]
+
+MIN_RMSD = 1.0  # angstrom, vina default
+
+_remark = re.compile(r"^(REMARK VINA RESULT:[ \t]+\S+)[^\n]*", re.M)
+
+
+def _heavy_elements(types: Sequence[str]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """Returns the elements of AutoDock atom types and the mask of heavy atoms."""
+    elements = numpy.array([get_element(adtype) for adtype in types])
+    return elements, elements != "H"
+
+
+def pose_rmsd(
+    coords: numpy.ndarray,
+    types: Sequence[str],
+    ref_coords: numpy.ndarray,
+) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Returns the RMSD lower and upper bounds of poses of a ligand from a reference
+    pose, computed over the heavy atoms as reported by vina. The upper bound
+    matches each atom with itself in the other pose, the lower bound with the
+    closest atom of the same element.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        Coordinates of the poses, shape (P, N, 3).
+    types : Sequence[str]
+        AutoDock atom types of the ligand, shape (N,).
+    ref_coords : numpy.ndarray
+        Coordinates of the reference pose, shape (N, 3).
+
+    Returns
+    -------
+    Tuple[numpy.ndarray, numpy.ndarray]
+        RMSD lower and upper bounds of each pose (angstrom), shape (P,).
+    """
+    elements, heavy = _heavy_elements(types)
+    elements = elements[heavy]
+    coords = numpy.asarray(coords, dtype=float).reshape(-1, len(heavy), 3)[:, heavy]
+    ref_coords = numpy.asarray(ref_coords, dtype=float)[heavy]
+
+    ub = numpy.sqrt(((coords - ref_coords) ** 2).sum(axis=-1).mean(axis=-1))
+
+    # (P, N, N) squared distances between the atoms of each pose and the reference
+    dist = ((coords[:, :, None, :] - ref_coords[None, None, :, :]) ** 2).sum(axis=-1)
+    dist[:, elements[:, None] != elements[None, :]] = numpy.inf
+    lb = numpy.maximum(dist.min(axis=2).mean(axis=1), dist.min(axis=1).mean(axis=1))
+
+    return numpy.sqrt(lb), ub
+
+
+def _poses(
+    systems: Sequence[str], scores: Sequence[Sequence[float]]
+) -> Tuple[List[str], List[str], numpy.ndarray, numpy.ndarray]:
+    """
+    Returns the model body (ligand and flexible residues) and ligand PDBQT string
+    of each pose of several outputs, with the pose scores and output indices.
+    """
+    bodies, ligands, affinity, source = [], [], [], []
+    for output, (system, system_scores) in enumerate(zip(systems, scores)):
+        for pose, score in zip(split_poses(system), system_scores):
+            body = system[pose.ligand.start : (pose.flex or pose.ligand).stop]
+            bodies.append(body if body.endswith("\n") else body + "\n")
+            ligands.append(system[pose.ligand])
+            affinity.append(score)
+            source.append(output)
+    return bodies, ligands, numpy.asarray(affinity, dtype=float), numpy.array(source)
+
+
+def _models(bodies: Sequence[str], scores: VinaScores) -> str:
+    """Returns a multi-model PDBQT string with the RMSD bounds of each pose updated."""
+    models = []
+    for model, body in enumerate(bodies, 1):
+        lb, ub = scores.rmsd_lb[model - 1], scores.rmsd_ub[model - 1]
+        body = _remark.sub(
+            lambda match: f"{match.group(1)} {lb:10.3f} {ub:10.3f}", body, count=1
+        )
+        models.append(f"MODEL {model}\n{body}ENDMDL\n")
+    return "".join(models)
+
+
+def merge_poses(
+    systems: Sequence[str],
+    scores: Sequence[Sequence[float]],
+    num_modes: Optional[int] = None,
+    min_rmsd: Optional[float] = MIN_RMSD,
+) -> Tuple[str, VinaScores]:
+    """
+    Merges the poses of several vina outputs of the same ligand into a single
+    output ranked by score. Poses within ``min_rmsd`` (heavy atom RMSD upper
+    bound) of a better pose are dropped, and the RMSD bounds are recomputed from
+    the new best pose.
+
+    Parameters
+    ----------
+    systems : Sequence[str]
+        Vina output PDBQT strings.
+    scores : Sequence[Sequence[float]]
+        Affinity (kcal/mol) of each pose of each output.
+    num_modes : int, optional
+        Maximum number of poses kept, defaults to all.
+    min_rmsd : float, optional
+        Minimum RMSD (angstrom) between the kept poses.
+
+    Returns
+    -------
+    Tuple[str, VinaScores]
+        Merged multi-model PDBQT string and the scores of its poses.
+    """
+    bodies, ligands, affinity, _ = _poses(systems, scores)
+    if not bodies:
+        return "", VinaScores(*numpy.empty((3, 0)))
+
+    order = numpy.argsort(affinity, kind="stable")
+    types, _ = pose_coordinates(ligands[order[0]])
+    coords = numpy.array([pose_coordinates(ligands[i])[1] for i in order])
+    heavy = coords[:, _heavy_elements(types)[1]]
+
+    kept = [0]
+    for index in range(1, len(order)):
+        if num_modes and len(kept) >= num_modes:
+            break
+        rmsd = numpy.sqrt(((heavy[kept] - heavy[index]) ** 2).sum(-1).mean(-1))
+        if not min_rmsd or rmsd.min() > min_rmsd:
+            kept.append(index)
+
+    merged = VinaScores(
+        affinity[order[kept]], *pose_rmsd(coords[kept], types, coords[0])
+    )
+    return _models([bodies[i] for i in order[kept]], merged), merged
+
+
+class Consensus(NamedTuple):
+    """Consensus scores of the pose clusters of replica dockings."""
+
+    scores: VinaScores  # mean affinity and RMSD bounds of the cluster representatives
+    std: numpy.ndarray  # standard deviation of the affinity across replicas
+    support: numpy.ndarray  # number of replicas that found each cluster
+
+
+def consensus_poses(
+    systems: Sequence[str],
+    scores: Sequence[Sequence[float]],
+    num_modes: Optional[int] = None,
+    cluster_rmsd: Optional[float] = 2.0,
+) -> Tuple[str, Consensus]:
+    """
+    Clusters the poses of replica dockings of the same ligand (e.g. with
+    different seeds) and ranks the clusters by support, then consensus score.
+    Poses are visited best first, each joining the closest cluster whose best
+    pose lies within ``cluster_rmsd`` (heavy atom RMSD), or founding a new
+    cluster. The support of a cluster is the number of replicas that found it,
+    and its consensus score the mean, over these replicas, of the best score of
+    each replica in the cluster. A pose found by a single replica thus ranks
+    below the poses most replicas agree on, however well it scores.
+
+    Parameters
+    ----------
+    systems : Sequence[str]
+        Vina output PDBQT string of each replica.
+    scores : Sequence[Sequence[float]]
+        Affinity (kcal/mol) of each pose of each replica.
+    num_modes : int, optional
+        Maximum number of clusters kept, defaults to all.
+    cluster_rmsd : float, optional
+        Clustering RMSD cutoff (angstrom).
+
+    Returns
+    -------
+    Tuple[str, Consensus]
+        Multi-model PDBQT string of the best pose of each cluster, ranked by
+        support and consensus score, and the consensus scores of the clusters.
+    """
+    bodies, ligands, affinity, source = _poses(systems, scores)
+    if not bodies:
+        empty = numpy.empty(0)
+        return "", Consensus(VinaScores(empty, empty, empty), empty, empty)
+
+    order = numpy.argsort(affinity, kind="stable")
+    types, _ = pose_coordinates(ligands[order[0]])
+    coords = numpy.array([pose_coordinates(ligands[i])[1] for i in order])
+    heavy = coords[:, _heavy_elements(types)[1]]
+
+    # Leader clustering: leaders are the best pose of each cluster
+    leaders, members = [0], [[0]]
+    for index in range(1, len(order)):
+        rmsd = numpy.sqrt(((heavy[leaders] - heavy[index]) ** 2).sum(-1).mean(-1))
+        cluster = int(rmsd.argmin())
+        if rmsd[cluster] <= cluster_rmsd:
+            members[cluster].append(index)
+        else:
+            leaders.append(index)
+            members.append([index])
+
+    mean, std, support = [], [], []
+    for cluster in members:
+        best = {}
+        for index in cluster:  # in score order, the first pose of a replica is its best
+            best.setdefault(source[order[index]], affinity[order[index]])
+        values = numpy.array(list(best.values()))
+        mean.append(values.mean())
+        std.append(values.std())
+        support.append(len(values))
+
+    # lexsort sorts by the last key first: most replicas, then best mean score
+    ranked = numpy.lexsort((mean, -numpy.array(support)))[:num_modes]
+    leaders = numpy.array(leaders)[ranked]
+    consensus = Consensus(
+        scores=VinaScores(
+            numpy.array(mean)[ranked],
+            *pose_rmsd(coords[leaders], types, coords[leaders[0]]),
+        ),
+        std=numpy.array(std)[ranked],
+        support=numpy.array(support)[ranked],
+    )
+    return _models([bodies[i] for i in order[leaders]], consensus.scores), consensus
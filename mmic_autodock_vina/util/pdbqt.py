@@ -0,0 +1,771 @@
+"""
+In-process handling of PDBQT files written by AutoDock Vina.
+"""
+
+from mmelemental.models import Molecule
+from mmelemental.util.units import convert
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+import numpy
+import re
+
+__all__ = [
+    "LazyPose",
+    "PoseSlice",
+    "get_poses",
+    "has_autodock_types",
+    "infer_bonds",
+    "molecule_geometry",
+    "pose_coordinates",
+    "read_pdbqt",
+    "select_residues",
+    "split_flex",
+    "split_models",
+    "split_poses",
+    "split_titled",
+    "torsion_tree",
+    "write_pdbqt",
+]
+
+# AutoDock atom types that are not element symbols
+AUTODOCK_ELEMENTS = {
+    "A": "C",
+    "NA": "N",
+    "NS": "N",
+    "OA": "O",
+    "OS": "O",
+    "SA": "S",
+    "HD": "H",
+    "HS": "H",
+    "CL": "Cl",
+    "BR": "Br",
+    "MG": "Mg",
+    "CA": "Ca",
+    "MN": "Mn",
+    "FE": "Fe",
+    "ZN": "Zn",
+    "G0": "C",
+    "G1": "C",
+    "G2": "C",
+    "G3": "C",
+    "CG0": "C",
+    "CG1": "C",
+    "CG2": "C",
+    "CG3": "C",
+    "W": "O",
+}
+
+# Covalent radii (angstrom) used to infer bonds
+COVALENT_RADII = {
+    "H": 0.31,
+    "C": 0.76,
+    "N": 0.71,
+    "O": 0.66,
+    "F": 0.57,
+    "P": 1.07,
+    "S": 1.05,
+    "Cl": 1.02,
+    "Br": 1.20,
+    "I": 1.39,
+}
+BOND_TOLERANCE = 0.45  # angstrom
+LINE_WIDTH = 80
+
+# Backbone atoms of flexible residues kept in the rigid receptor
+BACKBONE_ATOMS = {"N", "C", "O", "H", "HN", "OXT"}
+
+_model = re.compile(r"^MODEL[^\n]*\n(.*?)^ENDMDL[^\n]*(?:\n|$)", re.M | re.S)
+_flex = re.compile(r"^BEGIN_RES", re.M)
+_name = re.compile(r"^REMARK\s+Name\s*=[ \t]*(\S*)[^\n]*(?:\n|$)", re.M)
+_residue = re.compile(r"^(?:(\w):)?([A-Za-z]*)(-?\d*)$")
+
+
+class PoseSlice(NamedTuple):
+    """Offsets of the ligand and flexible side-chain records of a pose in a PDBQT string."""
+
+    ligand: slice
+    flex: Optional[slice] = None
+
+
+class LazyPose:
+    """
+    Handle to a docked pose: a slice of the vina output string and the pose score.
+    The pose is parsed into a Molecule on first access of :attr:`molecule`.
+    """
+
+    __slots__ = ("system", "span", "score", "_molecule")
+
+    def __init__(self, system: str, span: slice, score: Optional[float] = None):
+        self.system = system
+        self.span = span
+        self.score = score
+        self._molecule = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(score={self.score}, materialized={self._molecule is not None})"
+
+    @property
+    def pdbqt(self) -> str:
+        """The PDBQT string of the pose."""
+        return self.system[self.span]
+
+    @property
+    def molecule(self) -> Molecule:
+        """The pose as a Molecule, parsed on first access."""
+        if self._molecule is None:
+            self._molecule = read_pdbqt(self.pdbqt)
+        return self._molecule
+
+
+def split_models(system: str) -> List[slice]:
+    """
+    Returns the offsets of the body (records between MODEL and ENDMDL) of each
+    model in a multi-model PDBQT string. A string without MODEL records is
+    treated as a single model.
+    """
+    models = [slice(*match.span(1)) for match in _model.finditer(system)]
+    if not models and system.strip():
+        models = [slice(0, len(system))]
+    return models
+
+
+def split_poses(system: str) -> List[PoseSlice]:
+    """
+    Splits vina output into poses, replacing ``vina_split``. The flexible residues
+    (BEGIN_RES ... END_RES blocks) follow the ligand records in each model.
+
+    Parameters
+    ----------
+    system : str
+        Vina output PDBQT string with (optionally) flexible side-chains.
+
+    Returns
+    -------
+    List[PoseSlice]
+        Ligand and flexible side-chain offsets of each pose in ``system``. Use
+        ``system[pose.ligand]`` to extract the ligand PDBQT string of a pose.
+    """
+    poses = []
+    for model in split_models(system):
+        match = _flex.search(system, model.start, model.stop)
+        if match:
+            poses.append(
+                PoseSlice(
+                    ligand=slice(model.start, match.start()),
+                    flex=slice(match.start(), model.stop),
+                )
+            )
+        else:
+            poses.append(PoseSlice(ligand=model))
+    return poses
+
+
+def split_titled(system: str) -> List[Tuple[str, str]]:
+    """
+    Splits multi-molecule pdbqt output of obabel into (title, pdbqt) pairs, using
+    the ``REMARK  Name = title`` record written at the start of each molecule.
+    Molecules are split on MODEL records if present, on the name records otherwise.
+    """
+    if _model.search(system):
+        blocks = [system[model] for model in split_models(system)]
+    else:
+        starts = [match.start() for match in _name.finditer(system)]
+        blocks = [system[i:j] for i, j in zip(starts, starts[1:] + [len(system)])]
+
+    titled = []
+    for block in blocks:
+        match = _name.search(block)
+        titled.append((match.group(1) if match else "", block))
+    return titled
+
+
+def get_poses(system: str) -> Tuple[List[str], List[str]]:
+    """Returns the ligand and flexible side-chain PDBQT strings of each pose."""
+    poses = split_poses(system)
+    ligands = [system[pose.ligand] for pose in poses]
+    flex = [system[pose.flex] for pose in poses if pose.flex is not None]
+    return ligands, flex
+
+
+def _columns(records: numpy.ndarray, start: int, stop: int) -> numpy.ndarray:
+    """Returns the fixed-width columns [start, stop) of PDB records as a bytes array."""
+    return (
+        numpy.ascontiguousarray(records[:, start:stop]).view(f"S{stop - start}").ravel()
+    )
+
+
+def _records(pdbqt: str) -> numpy.ndarray:
+    """Returns the ATOM/HETATM records of a PDBQT string as a 2D array of characters."""
+    lines = [
+        line[:LINE_WIDTH].ljust(LINE_WIDTH)
+        for line in pdbqt.splitlines()
+        if line.startswith(("ATOM", "HETATM"))
+    ]
+    if not lines:
+        raise ValueError("No ATOM or HETATM records found in pdbqt string.")
+
+    return numpy.frombuffer("".join(lines).encode("ascii"), dtype="S1").reshape(
+        -1, LINE_WIDTH
+    )
+
+
+def _geometry(records: numpy.ndarray) -> numpy.ndarray:
+    """Returns the coordinates of PDB records as an (N, 3) array."""
+    return numpy.stack(
+        [
+            _columns(records, 30, 38),
+            _columns(records, 38, 46),
+            _columns(records, 46, 54),
+        ],
+        axis=1,
+    ).astype(float)
+
+
+def pose_coordinates(pdbqt: str) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Returns the AutoDock atom types and coordinates (angstrom) of a pose, without
+    building a Molecule. Faster than :func:`read_pdbqt` for comparing poses.
+    """
+    records = _records(pdbqt)
+    types = numpy.char.strip(_columns(records, 77, 79).astype(str))
+    return types, _geometry(records)
+
+
+def read_pdbqt(pdbqt: str, bonds: Optional[bool] = True) -> Molecule:
+    """
+    Builds a Molecule from a PDBQT string without running obabel. The fixed-width
+    ATOM/HETATM records are parsed column-wise with NumPy.
+
+    Parameters
+    ----------
+    pdbqt : str
+        PDBQT string e.g. a single pose from :func:`split_poses`.
+    bonds : bool, optional
+        If True, infers the connectivity from interatomic distances.
+
+    Returns
+    -------
+    Molecule
+        Molecule with geometry, symbols, atom names (``atom_labels``), residues
+        (``substructs``), partial charges, and AutoDock atom types stored in
+        ``extras["autodock_types"]``.
+    """
+    records = _records(pdbqt)
+    geometry = _geometry(records)
+    charges = _columns(records, 70, 76).astype(float)
+    types = numpy.char.strip(_columns(records, 77, 79).astype(str))
+    names = numpy.char.strip(_columns(records, 12, 16).astype(str))
+    resnames = numpy.char.strip(_columns(records, 17, 20).astype(str))
+    resids = _columns(records, 22, 26).astype(int)
+
+    symbols = [get_element(adtype, name) for adtype, name in zip(types, names)]
+
+    mol = {
+        "symbols": symbols,
+        "geometry": geometry,
+        "geometry_units": "angstrom",
+        "atom_labels": names,
+        "substructs": list(zip(resnames.tolist(), resids.tolist())),
+        "partial_charges": charges,
+        "extras": {"autodock_types": types.tolist()},
+    }
+
+    connectivity = infer_bonds(geometry, symbols) if bonds else None
+    if connectivity:
+        mol["connectivity"] = connectivity
+
+    return Molecule(**mol)
+
+
+def get_element(adtype: str, name: Optional[str] = None) -> str:
+    """Returns the element symbol of an AutoDock atom type, falling back on the atom name."""
+    if adtype:
+        element = AUTODOCK_ELEMENTS.get(adtype.upper())
+        if element:
+            return element
+        if adtype.isalpha():
+            return adtype.capitalize()
+    if name:
+        return name.lstrip("0123456789")[:1].upper()
+    raise ValueError(f"Cannot determine the element of atom type {adtype}.")
+
+
+def infer_bonds(
+    geometry: numpy.ndarray, symbols: List[str], chunk: Optional[int] = 1024
+) -> List[Tuple[int, int, float]]:
+    """
+    Returns bonds (i, j, 1.0) between atoms closer than the sum of their covalent
+    radii plus a tolerance. Distances are computed in row chunks to bound memory
+    for large receptors.
+    """
+    geometry = numpy.asarray(geometry, dtype=float).reshape(-1, 3)
+    radii = numpy.array([COVALENT_RADII.get(symbol, 1.5) for symbol in symbols])
+    hydrogen = numpy.array([symbol == "H" for symbol in symbols])
+
+    bonds = []
+    for start in range(0, len(geometry), chunk):
+        block = geometry[start : start + chunk]
+        dist = numpy.linalg.norm(block[:, None, :] - geometry[None, :, :], axis=-1)
+        cutoff = radii[start : start + chunk, None] + radii[None, :] + BOND_TOLERANCE
+        bonded = (dist < cutoff) & (dist > 0.4)
+        bonded &= ~(hydrogen[start : start + chunk, None] & hydrogen[None, :])
+        i, j = numpy.nonzero(bonded)
+        i += start
+        upper = i < j
+        bonds.extend(zip(i[upper].tolist(), j[upper].tolist(), [1.0] * upper.sum()))
+
+    return bonds
+
+
+def has_autodock_types(mol: Molecule) -> bool:
+    """Returns True if a molecule carries the partial charges and AutoDock atom types needed by :func:`write_pdbqt`."""
+    natoms = len(mol.symbols) if mol.symbols is not None else 0
+    types = (mol.extras or {}).get("autodock_types")
+    return (
+        natoms > 0
+        and mol.partial_charges is not None
+        and len(mol.partial_charges) == natoms
+        and types is not None
+        and len(types) == natoms
+        and all(types)
+    )
+
+
+def _bridges(natoms: int, neighbors: List[List[int]]) -> set:
+    """Returns the bonds (i, j), i < j, whose removal disconnects the graph i.e. bonds not in rings."""
+    order = [-1] * natoms
+    low = [0] * natoms
+    bridges = set()
+    counter = 0
+
+    for start in range(natoms):
+        if order[start] != -1:
+            continue
+        order[start] = low[start] = counter
+        counter += 1
+        stack = [(start, -1, iter(neighbors[start]))]
+        while stack:
+            atom, parent, children = stack[-1]
+            for child in children:
+                if child == parent:
+                    continue
+                if order[child] == -1:
+                    order[child] = low[child] = counter
+                    counter += 1
+                    stack.append((child, atom, iter(neighbors[child])))
+                    break
+                low[atom] = min(low[atom], order[child])
+            else:
+                stack.pop()
+                if parent != -1:
+                    low[parent] = min(low[parent], low[atom])
+                    if low[atom] > order[parent]:
+                        bridges.add((min(atom, parent), max(atom, parent)))
+    return bridges
+
+
+def torsion_tree(
+    bonds: List[Tuple[int, int, float]],
+    types: List[str],
+    root_atom: Optional[int] = None,
+) -> Tuple[List[int], List[Tuple[int, int, int]]]:
+    """
+    Builds the AutoDock torsion tree of a ligand: rigid fragments joined by
+    rotatable bonds. A bond is rotatable if it is a single bond outside rings,
+    not an amide C-N bond, and both atoms have another neighbor that is not a
+    nonpolar hydrogen. The root is the central fragment, which minimizes the
+    depth of the tree, unless ``root_atom`` is given.
+
+    Parameters
+    ----------
+    bonds : List[Tuple[int, int, float]]
+        Bonds (i, j, order) between atoms.
+    types : List[str]
+        AutoDock type of each atom.
+    root_atom : int, optional
+        Atom of the root fragment e.g. the CA atom of a flexible residue.
+
+    Returns
+    -------
+    Tuple[List[int], List[Tuple[int, int, int]]]
+        The fragment index of each atom, and the rotatable bonds (parent atom,
+        child atom, child fragment) in depth-first order from the root fragment 0.
+    """
+    natoms = len(types)
+    neighbors = [[] for _ in range(natoms)]
+    orders = {}
+    for i, j, order in bonds:
+        i, j = int(i), int(j)
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+        orders[(min(i, j), max(i, j))] = order
+
+    def degree(atom):
+        return sum(1 for other in neighbors[atom] if types[other] != "H")
+
+    def carbonyl(atom):
+        # Bond orders inferred from distances are all 1: a terminal oxygen is a carbonyl
+        return any(
+            types[other] in ("OA", "O")
+            and (
+                orders[(min(atom, other), max(atom, other))] == 2
+                or len(neighbors[other]) == 1
+            )
+            for other in neighbors[atom]
+        )
+
+    def amide(i, j):
+        for c, n in ((i, j), (j, i)):
+            if types[c] in ("C", "A") and types[n].startswith("N"):
+                if carbonyl(c):
+                    return True
+        return False
+
+    rotatable = [
+        (i, j)
+        for i, j in _bridges(natoms, neighbors)
+        if orders[(i, j)] == 1 and degree(i) > 1 and degree(j) > 1 and not amide(i, j)
+    ]
+
+    # Rigid fragments: connected components without the rotatable bonds
+    fragment = list(range(natoms))
+
+    def find(atom):
+        while fragment[atom] != atom:
+            fragment[atom] = fragment[fragment[atom]]
+            atom = fragment[atom]
+        return atom
+
+    cut = set(rotatable)
+    for i, j in orders:
+        if (i, j) not in cut:
+            fragment[find(i)] = find(j)
+
+    roots = sorted({find(atom) for atom in range(natoms)})
+    index = {root: k for k, root in enumerate(roots)}
+    labels = [index[find(atom)] for atom in range(natoms)]
+
+    tree = [[] for _ in roots]
+    for i, j in rotatable:
+        tree[labels[i]].append((i, j))
+        tree[labels[j]].append((j, i))
+
+    def depths(start):
+        depth, queue = {start: 0}, [start]
+        for frag in queue:
+            for _, other in tree[frag]:
+                if labels[other] not in depth:
+                    depth[labels[other]] = depth[frag] + 1
+                    queue.append(labels[other])
+        return depth
+
+    # The central fragment of the first connected component is the root
+    if root_atom is not None:
+        root = labels[root_atom]
+    else:
+        component = depths(labels[0])
+        root = min(component, key=lambda frag: (max(depths(frag).values()), frag))
+
+    branches, seen, stack = [], {root}, [(root, iter(tree[root]))]
+    while stack:
+        for parent_atom, child_atom in stack[-1][1]:
+            frag = labels[child_atom]
+            if frag not in seen:
+                seen.add(frag)
+                branches.append((parent_atom, child_atom, frag))
+                stack.append((frag, iter(tree[frag])))
+                break
+        else:
+            stack.pop()
+
+    # Renumber the fragments so the root is 0
+    renumber = {root: 0}
+    for _, _, frag in branches:
+        renumber[frag] = len(renumber)
+    for frag in range(len(roots)):
+        renumber.setdefault(frag, len(renumber))
+
+    labels = [renumber[frag] for frag in labels]
+    branches = [(i, j, renumber[frag]) for i, j, frag in branches]
+    return labels, branches
+
+
+def molecule_geometry(mol: Molecule) -> numpy.ndarray:
+    """Returns the geometry of a molecule in angstrom as an (N, 3) array."""
+    geometry = numpy.asarray(mol.geometry, dtype=float).reshape(-1, 3)
+    if mol.geometry_units not in (None, "angstrom"):
+        # convert builds a unit registry on each call, avoided for angstrom geometries
+        geometry = convert(geometry, mol.geometry_units, "angstrom")
+    return geometry
+
+
+def _atom_records(mol: Molecule) -> List[str]:
+    """Returns the PDBQT ATOM records of a molecule with AutoDock types and charges, without the serial numbers."""
+    geometry = molecule_geometry(mol)
+    natoms = len(geometry)
+    names = mol.atom_labels if mol.atom_labels is not None else mol.symbols
+    substructs = mol.substructs if mol.substructs is not None else [("UNL", 1)] * natoms
+    charges = numpy.asarray(mol.partial_charges, dtype=float)
+    types = mol.extras["autodock_types"]
+
+    records = []
+    for (x, y, z), name, (resname, resid), charge, adtype in zip(
+        geometry.tolist(), names, substructs, charges.tolist(), types
+    ):
+        name = str(name)
+        name = name[:4] if len(name) > 3 else f" {name:<3}"
+        records.append(
+            f" {name:4s} {str(resname)[:3]:>3s}  {int(resid) % 10000:4d}    "
+            f"{x:8.3f}{y:8.3f}{z:8.3f}  0.00  0.00    {charge:+6.3f} {adtype:<2s}"
+        )
+    return records
+
+
+def write_pdbqt(mol: Molecule, rigid: Optional[bool] = False) -> str:
+    """
+    Writes a PDBQT string from a Molecule that carries partial charges and AutoDock
+    atom types (``extras["autodock_types"]``) e.g. a molecule read with
+    :func:`read_pdbqt`, without running obabel.
+
+    Parameters
+    ----------
+    mol : Molecule
+        Molecule to write. The connectivity is inferred from the geometry if missing.
+    rigid : bool, optional
+        If True, writes the atom records only e.g. for a rigid receptor. Otherwise
+        writes the ROOT/BRANCH torsion tree of a flexible ligand.
+
+    Returns
+    -------
+    str
+        PDBQT string.
+
+    Raises
+    ------
+    ValueError
+        If the molecule has no AutoDock types, or if a flexible molecule has
+        several connected components (e.g. a salt), which one torsion tree cannot hold.
+    """
+    if not has_autodock_types(mol):
+        raise ValueError(
+            "Molecule must have partial charges and AutoDock atom types to be written as pdbqt."
+        )
+
+    records = _atom_records(mol)
+
+    if rigid:
+        return "".join(
+            f"ATOM  {serial:5d}{record}\n" for serial, record in enumerate(records, 1)
+        )
+
+    bonds = mol.connectivity
+    if bonds is None:
+        bonds = infer_bonds(mol.geometry, mol.symbols)
+
+    labels, branches = torsion_tree(bonds, mol.extras["autodock_types"])
+    # Fragments not reached from the root belong to other connected components
+    if len(branches) + 1 < max(labels) + 1:
+        raise ValueError(
+            "Molecule has several connected components, which cannot be written as one torsion tree."
+        )
+
+    lines = _write_tree(records, labels, branches)
+    lines.append(f"TORSDOF {len(branches)}")
+    return "\n".join(lines) + "\n"
+
+
+def _write_tree(
+    records: List[Optional[str]],
+    labels: List[int],
+    branches: List[Tuple[int, int, int]],
+) -> List[str]:
+    """
+    Returns the ROOT/BRANCH lines of a torsion tree (see :func:`torsion_tree`)
+    from the ATOM records of its atoms without the serial numbers. Atoms whose
+    record is None are not written.
+    """
+    atoms = [[] for _ in range(max(labels) + 1)]
+    for atom, frag in enumerate(labels):
+        if records[atom] is not None:
+            atoms[frag].append(atom)
+
+    # Atoms are numbered in output order, which BRANCH records refer to
+    serials, lines = {}, []
+
+    def write_fragment(frag):
+        for atom in atoms[frag]:
+            serials[atom] = len(serials) + 1
+            lines.append(f"ATOM  {serials[atom]:5d}{records[atom]}")
+
+    lines.append("ROOT")
+    write_fragment(0)
+    lines.append("ENDROOT")
+
+    children = {}
+    for parent_atom, child_atom, frag in branches:
+        children.setdefault(labels[parent_atom], []).append(
+            (parent_atom, child_atom, frag)
+        )
+
+    def write_branch(parent_atom, child_atom, frag):
+        index = len(lines)
+        lines.append(None)  # BRANCH record, once the child atom is numbered
+        write_fragment(frag)
+        for branch in children.get(frag, []):
+            write_branch(*branch)
+        parent, child = serials[parent_atom], serials[child_atom]
+        lines[index] = f"BRANCH {parent:3d} {child:3d}"
+        lines.append(f"ENDBRANCH {parent:3d} {child:3d}")
+
+    for branch in children.get(0, []):
+        write_branch(*branch)
+
+    return lines
+
+
+def _select_residue(
+    residue: Union[int, str, Tuple[str, int]],
+    names: numpy.ndarray,
+    numbers: numpy.ndarray,
+    chains: Optional[numpy.ndarray],
+) -> numpy.ndarray:
+    """Returns the mask of the atoms of a residue, see :func:`select_residues`."""
+    if isinstance(residue, (tuple, list)):
+        name, number = residue
+        return (names == str(name)) & (numbers == int(number))
+    elif not isinstance(residue, str):
+        return numbers == int(residue)
+
+    match = _residue.match(residue.strip())
+    if match is None or not any(match.groups()):
+        raise ValueError(f"Invalid residue selection {residue}.")
+
+    chain, name, number = match.groups()
+    mask = numpy.ones(len(names), dtype=bool)
+    if chain:
+        if chains is None:
+            raise ValueError(f"No chain information to select the residue {residue}.")
+        mask &= chains == chain
+    if name:
+        mask &= names == name.upper()
+    if number:
+        mask &= numbers == int(number)
+    return mask
+
+
+def select_residues(
+    residues: Sequence[Union[int, str, Tuple[str, int]]],
+    names: Sequence[str],
+    numbers: Sequence[int],
+    chains: Optional[Sequence[str]] = None,
+) -> numpy.ndarray:
+    """
+    Returns the mask of the atoms of the selected residues, shared by the
+    flexible side-chains (:func:`split_flex`) and the residues search box
+    (:func:`~mmic_autodock_vina.util.box.residue_box`).
+
+    Parameters
+    ----------
+    residues : Sequence[int or str or Tuple[str, int]]
+        Residue numbers, residue names, (name, number) pairs, or "[chain:]NAMEnumber"
+        strings e.g. "B:MET225" or "TYR97".
+    names : Sequence[str]
+        Residue name of each atom.
+    numbers : Sequence[int]
+        Residue number of each atom.
+    chains : Sequence[str], optional
+        Chain identifier of each atom, required to select residues by chain.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the selected atoms.
+
+    Raises
+    ------
+    ValueError
+        If a selection is invalid or matches no atom.
+    """
+    names = numpy.asarray(names, dtype=str)
+    numbers = numpy.asarray(numbers, dtype=int)
+    chains = None if chains is None else numpy.asarray(chains, dtype=str)
+
+    selected = numpy.zeros(len(names), dtype=bool)
+    for residue in residues:
+        mask = _select_residue(residue, names, numbers, chains)
+        if not mask.any():
+            raise ValueError(f"No receptor atoms match the residue {residue}.")
+        selected |= mask
+    return selected
+
+
+def split_flex(
+    receptor: str, residues: Sequence[Union[int, str, Tuple[str, int]]]
+) -> Tuple[str, str]:
+    """
+    Splits a rigid receptor PDBQT string into the rigid part and the flexible
+    side-chains of the selected residues, replacing ``prepare_flexreceptor``.
+    The side-chain atoms (beyond the backbone) move to the flexible part, with
+    a torsion tree rooted at the CA atom that also stays in the rigid part.
+
+    Parameters
+    ----------
+    receptor : str
+        Receptor PDBQT string.
+    residues : Sequence[int or str or Tuple[str, int]]
+        Flexible residues, see :func:`select_residues`.
+
+    Returns
+    -------
+    Tuple[str, str]
+        Rigid receptor and flexible side-chains PDBQT strings.
+    """
+    lines = receptor.splitlines(keepends=True)
+    atoms = [
+        index for index, line in enumerate(lines) if line.startswith(("ATOM", "HETATM"))
+    ]
+    records = _records(receptor)
+    atom_names = numpy.char.strip(_columns(records, 12, 16).astype(str))
+    names = numpy.char.strip(_columns(records, 17, 20).astype(str))
+    chains = numpy.char.strip(_columns(records, 21, 22).astype(str))
+    numbers = _columns(records, 22, 26).astype(int)
+    types = numpy.char.strip(_columns(records, 77, 79).astype(str))
+
+    selected = select_residues(residues, names, numbers, chains)
+
+    flex, moved = [], set()
+    keys = list(zip(chains.tolist(), numbers.tolist(), names.tolist()))
+    for key in dict.fromkeys(key for key, sel in zip(keys, selected) if sel):
+        residue = [atom for atom, other in enumerate(keys) if other == key]
+        ca = [atom for atom in residue if atom_names[atom] == "CA"]
+        if not ca:
+            raise ValueError(f"Flexible residue {key[2]} {key[1]} has no CA atom.")
+
+        # N and C are bonded for the CA-CB torsion to be rotatable, but not written
+        side = [
+            atom
+            for atom in residue
+            if atom_names[atom] == "CA" or atom_names[atom] not in BACKBONE_ATOMS
+        ]
+        tree = side + [atom for atom in residue if atom_names[atom] in ("N", "C")]
+        geometry = _geometry(records[tree])
+        elements = [get_element(types[atom], atom_names[atom]) for atom in tree]
+        labels, branches = torsion_tree(
+            infer_bonds(geometry, elements),
+            [types[atom] for atom in tree],
+            root_atom=tree.index(ca[0]),
+        )
+        tree_records = [
+            lines[atoms[atom]][11:LINE_WIDTH].rstrip() if atom in side else None
+            for atom in tree
+        ]
+
+        title = lines[atoms[ca[0]]][17:26]
+        flex.append(f"BEGIN_RES {title}")
+        flex.append(f"REMARK  {len(branches)} active torsions:")
+        flex.extend(_write_tree(tree_records, labels, branches))
+        flex.append(f"TORSDOF {len(branches)}")
+        flex.append(f"END_RES {title}")
+        moved.update(atoms[atom] for atom in side if atom not in ca)
+
+    rigid = "".join(line for index, line in enumerate(lines) if index not in moved)
+    return rigid, "\n".join(flex) + "\n"
@@ -0,0 +1,178 @@
+"""
+Grid-based detection of buried pockets on receptor geometries.
+"""
+
+from typing import List, NamedTuple, Optional
+import collections
+import numpy
+
+__all__ = ["Pocket", "find_pockets"]
+
+# Scan lines of the buriedness test: the 3 axes and the 4 cube diagonals
+DIRECTIONS = numpy.array(
+    [
+        [1, 0, 0],
+        [0, 1, 0],
+        [0, 0, 1],
+        [1, 1, 1],
+        [1, 1, -1],
+        [1, -1, 1],
+        [-1, 1, 1],
+    ]
+)
+
+# Face neighbors used to cluster pocket points
+NEIGHBORS = numpy.concatenate([numpy.eye(3, dtype=int), -numpy.eye(3, dtype=int)])
+
+
+class Pocket(NamedTuple):
+    """A cluster of buried solvent grid points."""
+
+    points: numpy.ndarray  # (N, 3) coordinates in angstrom
+    buriedness: float  # mean number of scan lines enclosed by the receptor
+    volume: float  # angstrom^3
+
+    @property
+    def center(self) -> numpy.ndarray:
+        return self.points.mean(axis=0)
+
+    @property
+    def score(self) -> float:
+        """Ranking score: volume weighted by the mean buriedness."""
+        return self.volume * self.buriedness
+
+
+def _shift(grid: numpy.ndarray, offset: numpy.ndarray) -> numpy.ndarray:
+    """Returns ``out`` with ``out[i] = grid[i + offset]``, False outside the grid."""
+    out = numpy.zeros_like(grid)
+    src, dst = [], []
+    for step, size in zip(offset.tolist(), grid.shape):
+        if abs(step) >= size:
+            return out
+        src.append(slice(max(step, 0), size + min(step, 0)))
+        dst.append(slice(max(-step, 0), size + min(-step, 0)))
+    out[tuple(dst)] = grid[tuple(src)]
+    return out
+
+
+def _occupancy(
+    coords: numpy.ndarray,
+    origin: numpy.ndarray,
+    shape: tuple,
+    spacing: float,
+    radius: float,
+) -> numpy.ndarray:
+    """Returns the grid points within ``radius`` of any atom."""
+    reach = int(numpy.ceil(radius / spacing))
+    span = numpy.arange(-reach, reach + 2)
+    offsets = numpy.stack(numpy.meshgrid(span, span, span, indexing="ij"), -1).reshape(
+        -1, 3
+    )
+
+    base = numpy.floor((coords - origin) / spacing).astype(int)
+    occupied = numpy.zeros(shape, dtype=bool)
+
+    # Atoms in chunks to bound the (natoms, noffsets, 3) intermediates
+    for start in range(0, len(coords), 1024):
+        index = base[start : start + 1024, None, :] + offsets[None, :, :]
+        dist = origin + index * spacing - coords[start : start + 1024, None, :]
+        mask = (numpy.einsum("ijk,ijk->ij", dist, dist) <= radius**2) & numpy.all(
+            (index >= 0) & (index < shape), axis=-1
+        )
+        index = index[mask]
+        occupied[index[:, 0], index[:, 1], index[:, 2]] = True
+
+    return occupied
+
+
+def _clusters(mask: numpy.ndarray) -> List[numpy.ndarray]:
+    """Returns the grid indices of each face-connected cluster of True points."""
+    remaining = set(map(tuple, numpy.argwhere(mask).tolist()))
+    clusters = []
+    while remaining:
+        seed = remaining.pop()
+        cluster, queue = [seed], collections.deque([seed])
+        while queue:
+            point = queue.popleft()
+            for step in NEIGHBORS.tolist():
+                neighbor = (point[0] + step[0], point[1] + step[1], point[2] + step[2])
+                if neighbor in remaining:
+                    remaining.remove(neighbor)
+                    cluster.append(neighbor)
+                    queue.append(neighbor)
+        clusters.append(numpy.array(cluster))
+    return clusters
+
+
+def find_pockets(
+    coords: numpy.ndarray,
+    spacing: Optional[float] = 1.0,
+    radius: Optional[float] = 3.0,
+    max_distance: Optional[float] = 8.0,
+    min_buriedness: Optional[int] = 5,
+    min_volume: Optional[float] = 50.0,
+    top_k: Optional[int] = None,
+) -> List[Pocket]:
+    """
+    Detects pockets on a receptor with a LIGSITE-style grid scan. Grid points
+    farther than ``radius`` from every atom are solvent. A solvent point is buried
+    along a scan line (axes and cube diagonals) if receptor points lie within
+    ``max_distance`` on both sides. Points buried along at least ``min_buriedness``
+    of the 7 lines are clustered into pockets.
+
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        Receptor atom coordinates (angstrom), shape (N, 3).
+    spacing : float, optional
+        Grid spacing in angstrom.
+    radius : float, optional
+        Distance (angstrom) from the atom centers within which grid points are
+        occupied by the receptor.
+    max_distance : float, optional
+        Scan distance (angstrom) along each direction.
+    min_buriedness : int, optional
+        Minimum number of enclosing scan lines (1-7) of pocket points.
+    min_volume : float, optional
+        Minimum pocket volume in angstrom^3.
+    top_k : int, optional
+        Number of pockets returned, defaults to all.
+
+    Returns
+    -------
+    List[Pocket]
+        Pockets sorted by decreasing :attr:`Pocket.score`.
+    """
+    coords = numpy.asarray(coords, dtype=float).reshape(-1, 3)
+    origin = coords.min(axis=0)
+    shape = tuple((numpy.ceil((coords.max(axis=0) - origin) / spacing) + 1).astype(int))
+
+    occupied = _occupancy(coords, origin, shape, spacing, radius)
+
+    buriedness = numpy.zeros(shape, dtype=numpy.int8)
+    for direction in DIRECTIONS:
+        nsteps = int(max_distance / (spacing * numpy.linalg.norm(direction)))
+        forward = numpy.zeros(shape, dtype=bool)
+        backward = numpy.zeros(shape, dtype=bool)
+        for step in range(1, nsteps + 1):
+            forward |= _shift(occupied, step * direction)
+            backward |= _shift(occupied, -step * direction)
+        buriedness += forward & backward
+
+    buried = ~occupied & (buriedness >= min_buriedness)
+
+    pockets = []
+    for index in _clusters(buried):
+        volume = len(index) * spacing**3
+        if volume < min_volume:
+            continue
+        pockets.append(
+            Pocket(
+                points=origin + index * spacing,
+                buriedness=float(buriedness[tuple(index.T)].mean()),
+                volume=volume,
+            )
+        )
+
+    pockets.sort(key=lambda pocket: pocket.score, reverse=True)
+    return pockets[:top_k]
@@ -0,0 +1,125 @@
+"""
+Scheduling of concurrent vina jobs over the available CPU cores.
+"""
+
+from mmelemental.models import Molecule
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+import multiprocessing
+import numpy
+import os
+import re
+
+__all__ = ["JobPlan", "available_cores", "heavy_atom_count", "plan_jobs", "pin_worker"]
+
+# Vina parallelizes the Monte Carlo runs of a single docking across threads, which
+# scales poorly past ~8 threads. Small ligands converge quickly and are better
+# packed one core per job.
+MAX_CPU_PER_JOB = 8
+CPU_BY_SIZE = ((20, 1), (35, 2), (50, 4))  # (max heavy atoms, cpu per job)
+
+_smiles_atom = re.compile(r"\[[^\]]+\]|Cl|Br|[BCNOPSFI]|[bcnops]")
+
+
+class JobPlan(NamedTuple):
+    """Number of concurrent vina jobs, CPUs per job, and optional core sets per job."""
+
+    njobs: int
+    cpu: int
+    cores: Optional[List[Tuple[int, ...]]] = None
+
+
+def available_cores() -> List[int]:
+    """Returns the CPU cores this process is allowed to run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def heavy_atom_count(ligand: Union[str, Molecule]) -> int:
+    """Returns the number of heavy atoms in a ligand Molecule or smiles code."""
+    if isinstance(ligand, Molecule):
+        if ligand.symbols is not None:
+            return int(numpy.sum(numpy.asarray(ligand.symbols) != "H"))
+        if ligand.identifiers is None or not ligand.identifiers.smiles:
+            raise ValueError("Ligand Molecule has neither symbols nor a smiles code.")
+        ligand = ligand.identifiers.smiles
+
+    return sum(
+        1
+        for atom in _smiles_atom.findall(ligand)
+        if not re.match(r"\[\d*H[^a-z]", atom)
+    )
+
+
+def plan_jobs(
+    sizes: Optional[Sequence[int]] = None,
+    ncores: Optional[int] = None,
+    cpu: Optional[int] = None,
+    njobs: Optional[int] = None,
+    exhaustiveness: Optional[int] = None,
+    affinity: Optional[bool] = False,
+) -> JobPlan:
+    """
+    Splits the available cores across concurrent vina jobs to maximize throughput.
+
+    Parameters
+    ----------
+    sizes : Sequence[int], optional
+        Heavy atom counts of the ligands to dock. The median size determines the
+        number of CPUs per job unless ``cpu`` is supplied.
+    ncores : int, optional
+        Total number of cores to use. Defaults to all available cores.
+    cpu : int, optional
+        Number of CPUs per vina job.
+    njobs : int, optional
+        Number of concurrent vina jobs.
+    exhaustiveness : int, optional
+        Vina exhaustiveness. Vina does not use more threads than Monte Carlo runs,
+        so it bounds the number of CPUs per job.
+    affinity : bool, optional
+        If True, assigns a disjoint set of cores to each job.
+
+    Returns
+    -------
+    JobPlan
+        The number of concurrent jobs, CPUs per job, and the core set of each job.
+    """
+    cores = available_cores()
+    ncores = min(ncores or len(cores), len(cores))
+
+    if cpu is None:
+        if njobs:
+            cpu = max(1, ncores // njobs)
+        elif sizes is not None and len(sizes):
+            size = numpy.median(sizes)
+            cpu = next(
+                (ncpu for max_size, ncpu in CPU_BY_SIZE if size <= max_size),
+                MAX_CPU_PER_JOB,
+            )
+        else:
+            cpu = 1
+        if exhaustiveness:
+            cpu = min(cpu, exhaustiveness)
+        cpu = max(1, min(cpu, MAX_CPU_PER_JOB, ncores))
+
+    if not njobs:
+        njobs = max(1, ncores // cpu)
+
+    core_sets = None
+    if affinity:
+        core_sets = [
+            tuple(cores[(i * cpu + j) % ncores] for j in range(min(cpu, ncores)))
+            for i in range(njobs)
+        ]
+
+    return JobPlan(njobs=njobs, cpu=cpu, cores=core_sets)
+
+
+def pin_worker(core_sets: "multiprocessing.Queue"):
+    """
+    Process pool initializer: pins the worker process (and the vina processes it
+    spawns) to the next core set in the queue.
+    """
+    cores = core_sets.get()
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
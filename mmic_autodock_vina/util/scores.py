@@ -0,0 +1,119 @@
+"""
+Parsing of the docking scores reported by AutoDock Vina.
+"""
+
+from typing import Optional
+import numpy
+import re
+
+__all__ = ["VinaScores", "get_scores", "parse_scores"]
+
+_number = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+
+# Separator line of the results table e.g. "-----+------------+----------+----------"
+_table = re.compile(r"^[ \t]*-+\+[-+]+[ \t]*$", re.M)
+# Results table row: mode, affinity, rmsd l.b., rmsd u.b.
+_row = re.compile(
+    rf"^[ \t]*\d+[ \t]+({_number})[ \t]+({_number})[ \t]+({_number})[ \t]*$", re.M
+)
+# Pose score written by vina in the output pdbqt file
+_remark = re.compile(
+    rf"^REMARK VINA RESULT:\s+({_number})\s+({_number})\s+({_number})", re.M
+)
+
+
+class VinaScores:
+    """
+    Affinity (kcal/mol) and RMSD lower/upper bounds from the best mode (angstrom)
+    of each pose, as parallel arrays in mode order.
+    """
+
+    __slots__ = ("affinity", "rmsd_lb", "rmsd_ub")
+
+    def __init__(self, affinity, rmsd_lb, rmsd_ub):
+        self.affinity = numpy.asarray(affinity, dtype=float)
+        self.rmsd_lb = numpy.asarray(rmsd_lb, dtype=float)
+        self.rmsd_ub = numpy.asarray(rmsd_ub, dtype=float)
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(affinity={self.affinity!r}, "
+            f"rmsd_lb={self.rmsd_lb!r}, rmsd_ub={self.rmsd_ub!r})"
+        )
+
+    def __len__(self) -> int:
+        """Number of modes."""
+        return len(self.affinity)
+
+    def __getitem__(self, index) -> "VinaScores":
+        """Returns the scores of the modes selected by a slice, index, or index array."""
+        if isinstance(index, (int, numpy.integer)):
+            index = [index]
+        return VinaScores(
+            self.affinity[index], self.rmsd_lb[index], self.rmsd_ub[index]
+        )
+
+    def top(self, k: Optional[int] = None) -> "VinaScores":
+        """Returns the scores of the first ``k`` modes, all modes if ``k`` is None."""
+        return self[:k]
+
+
+def _scores(rows) -> VinaScores:
+    if not rows:
+        return VinaScores(*numpy.empty((3, 0)))
+    return VinaScores(*numpy.array(rows, dtype=float).T)
+
+
+def parse_scores(text: str) -> VinaScores:
+    """
+    Extracts the scores of every mode from vina output.
+
+    Parameters
+    ----------
+    text : str
+        Vina stdout, log file, or output pdbqt string. The results table is read
+        from stdout and log files, and the ``REMARK VINA RESULT`` records from pdbqt
+        strings. Rows are matched by content rather than exact column widths, which
+        differ between vina versions.
+
+    Returns
+    -------
+    VinaScores
+        Affinity, rmsd_lb, and rmsd_ub arrays in mode order. Empty if ``text``
+        contains no scores.
+    """
+    if not text:
+        return _scores(None)
+
+    table = None
+    for table in _table.finditer(text):
+        pass  # the last results table is the final one
+
+    if table is not None:
+        rows, end = [], table.end()
+        for row in _row.finditer(text, end):
+            # the table ends at the first line that is not a row
+            if text.count("\n", end, row.start()) > 1:
+                break
+            rows.append(row.groups())
+            end = row.end()
+        if rows:
+            return _scores(rows)
+
+    return _scores(_remark.findall(text))
+
+
+def get_scores(
+    stdout: Optional[str] = None,
+    log: Optional[str] = None,
+    system: Optional[str] = None,
+) -> VinaScores:
+    """
+    Returns the vina scores from the first of stdout, the log file, or the output
+    pdbqt string which contains them.
+    """
+    for text in (stdout, log, system):
+        scores = parse_scores(text)
+        if len(scores):
+            return scores
+    return scores
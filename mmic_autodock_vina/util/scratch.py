@@ -0,0 +1,99 @@
+"""
+Scratch space for the intermediate files of vina runs.
+"""
+
+from typing import List, Optional
+import os
+import shutil
+import tempfile
+
+__all__ = ["ScratchDir", "SCRATCH_BACKENDS"]
+
+SHM_DIR = "/dev/shm"
+SCRATCH_BACKENDS = ("tmp", "shm", "memfd")
+DEFAULT_SCRATCH_BACKEND = os.environ.get("MMIC_AUTODOCK_VINA_SCRATCH", "tmp")
+
+
+class ScratchDir:
+    """
+    Context manager providing paths for the input and output files of a single vina
+    run. Each input is written exactly once, and all files are removed on exit.
+
+    Parameters
+    ----------
+    backend : str, optional
+        Where files are placed:
+
+        * "tmp": a directory in the default temporary directory.
+        * "shm": a directory in the /dev/shm tmpfs, falling back on "tmp" if
+          /dev/shm is not available.
+        * "memfd": anonymous memory files (Linux), addressed by their /proc path.
+          Directory-based backends are used for the files vina creates itself.
+        * any other value is used as the parent directory.
+    prefix : str, optional
+        Prefix of the scratch directory name.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[str] = None,
+        prefix: Optional[str] = "mmic_autodock_vina_",
+    ):
+        self.backend = backend or DEFAULT_SCRATCH_BACKEND
+        self.prefix = prefix
+        self.path = None
+        self._fds: List[int] = []
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(backend={self.backend!r}, path={self.path!r})"
+        )
+
+    @property
+    def parent(self) -> Optional[str]:
+        """Parent directory of the scratch directory."""
+        if self.backend == "tmp":
+            return None
+        elif self.backend in ("shm", "memfd"):
+            if os.path.isdir(SHM_DIR) and os.access(SHM_DIR, os.W_OK):
+                return SHM_DIR
+            return None
+        return self.backend
+
+    @property
+    def memfd(self) -> bool:
+        return self.backend == "memfd" and hasattr(os, "memfd_create")
+
+    def __enter__(self) -> "ScratchDir":
+        self.path = tempfile.mkdtemp(prefix=self.prefix, dir=self.parent)
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+    def cleanup(self):
+        """Closes the memory files and removes the scratch directory."""
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+        if self.path is not None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
+
+    def name(self, fname: str) -> str:
+        """Returns the path of an output file in the scratch directory."""
+        return os.path.join(self.path, fname)
+
+    def write(self, fname: str, contents: str) -> str:
+        """Writes an input file and returns its path."""
+        if self.memfd:
+            fd = os.memfd_create(fname, 0)
+            self._fds.append(fd)
+            os.write(fd, contents.encode())
+            # Other processes reopen the file from its /proc path
+            return f"/proc/{os.getpid()}/fd/{fd}"
+
+        path = self.name(fname)
+        with open(path, "w") as fp:
+            fp.write(contents)
+        return path